@@ -3,11 +3,15 @@ SQLAdmin configuration for the Clicker Diamond admin panel.
 """
 from sqladmin import Admin, ModelView
 from sqladmin.authentication import AuthenticationBackend
+from starlette.concurrency import run_in_threadpool
 from starlette.requests import Request
 from starlette.responses import RedirectResponse
 
-from .database import engine
-from . import models
+from .database import engine, SessionLocal
+from .catalog import invalidate_catalog
+from .click_buffer import click_buffer
+from .scheduler import schedule_user_stats_recompute
+from . import crud, effects, models
 
 
 # ─────────────────────────────────────────────────────────────
@@ -40,6 +44,38 @@ class AdminAuth(AuthenticationBackend):
 # ─────────────────────────────────────────────────────────────
 # Model Views
 # ─────────────────────────────────────────────────────────────
+def _invalidate_catalog() -> None:
+    """Поднять версию каталога (улучшения, задания, товары) после правки в админке."""
+    db = SessionLocal()
+    try:
+        invalidate_catalog(db)
+        db.commit()
+    finally:
+        db.close()
+
+
+def _invalidate_admin_settings() -> None:
+    """Поднять версию кэша настроек после правки в админке."""
+    db = SessionLocal()
+    try:
+        crud.invalidate_admin_settings(db)
+        db.commit()
+    finally:
+        db.close()
+
+
+def _recompute_user_stats(user_id: int) -> None:
+    """Пересчитать характеристики игрока после ручной правки его улучшений."""
+    db = SessionLocal()
+    try:
+        user = db.get(models.User, user_id)
+        if user:
+            effects.recompute_user_stats(db, user)
+    finally:
+        db.close()
+    click_buffer.refresh_users([user_id])
+
+
 class UserAdmin(ModelView, model=models.User):
     name = "Пользователь"
     name_plural = "Пользователи"
@@ -79,6 +115,8 @@ class UserAdmin(ModelView, model=models.User):
         models.User.balance: "Баланс",
         models.User.energy: "Энергия",
         models.User.max_energy: "Макс. энергия",
+        models.User.click_power: "Доход за клик",
+        models.User.passive_rate: "Автокликов в секунду",
         models.User.last_energy_update: "Последнее обновление энергии",
         models.User.created_at: "Создан",
         models.User.updated_at: "Обновлён",
@@ -95,6 +133,10 @@ class UserAdmin(ModelView, model=models.User):
         models.User.max_energy,
     ]
 
+    async def after_model_change(self, data, model, is_created, request):
+        # Баланс / энергия поправлены вручную - буфер кликов должен их увидеть
+        await run_in_threadpool(click_buffer.refresh_users, [model.id])
+
 
 class UpgradeAdmin(ModelView, model=models.Upgrade):
     name = "Улучшение"
@@ -128,6 +170,14 @@ class UpgradeAdmin(ModelView, model=models.Upgrade):
         models.Upgrade.created_at: "Создано",
     }
 
+    async def after_model_change(self, data, model, is_created, request):
+        await run_in_threadpool(_invalidate_catalog)
+        schedule_user_stats_recompute()
+
+    async def after_model_delete(self, model, request):
+        await run_in_threadpool(_invalidate_catalog)
+        schedule_user_stats_recompute()
+
 
 class UserUpgradeAdmin(ModelView, model=models.UserUpgrade):
     name = "Улучшение игрока"
@@ -156,6 +206,12 @@ class UserUpgradeAdmin(ModelView, model=models.UserUpgrade):
         models.UserUpgrade.level,
     ]
 
+    async def after_model_change(self, data, model, is_created, request):
+        await run_in_threadpool(_recompute_user_stats, model.user_id)
+
+    async def after_model_delete(self, model, request):
+        await run_in_threadpool(_recompute_user_stats, model.user_id)
+
 
 class TransferAdmin(ModelView, model=models.Transfer):
     name = "Перевод"
@@ -211,6 +267,12 @@ class ShopItemAdmin(ModelView, model=models.ShopItem):
         models.ShopItem.created_at: "Создан",
     }
 
+    async def after_model_change(self, data, model, is_created, request):
+        await run_in_threadpool(_invalidate_catalog)
+
+    async def after_model_delete(self, model, request):
+        await run_in_threadpool(_invalidate_catalog)
+
 
 class PurchaseAdmin(ModelView, model=models.Purchase):
     name = "Покупка"
@@ -271,6 +333,12 @@ class TaskAdmin(ModelView, model=models.Task):
         models.Task.created_at: "Создано",
     }
 
+    async def after_model_change(self, data, model, is_created, request):
+        await run_in_threadpool(_invalidate_catalog)
+
+    async def after_model_delete(self, model, request):
+        await run_in_threadpool(_invalidate_catalog)
+
 
 class UserTaskAdmin(ModelView, model=models.UserTask):
     name = "Прогресс задания"
@@ -337,6 +405,15 @@ class AdminSettingsAdmin(ModelView, model=models.AdminSettings):
         models.AdminSettings.description,
     ]
 
+    async def after_model_change(self, data, model, is_created, request):
+        await run_in_threadpool(_invalidate_admin_settings)
+        # click_value - база click_power у всех игроков
+        if model.name == "click_value":
+            schedule_user_stats_recompute()
+
+    async def after_model_delete(self, model, request):
+        await run_in_threadpool(_invalidate_admin_settings)
+
 
 # ─────────────────────────────────────────────────────────────
 # Setup Admin
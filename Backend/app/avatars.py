@@ -0,0 +1,238 @@
+"""
+Аватары игроков: миниатюры на локальном диске вместо ссылок на api.telegram.org.
+
+Ссылка вида api.telegram.org/file/bot<token>/... раскрывает токен бота и со
+временем перестаёт работать. Вместо неё фото профиля скачивается один раз,
+уменьшается до AVATAR_SIZE x AVATAR_SIZE и кладётся в AVATAR_DIR под именем
+по sha256 содержимого. В users.url_image пишется постоянная ссылка
+{AVATAR_PUBLIC_URL}/avatars/<hash>.jpg - её отдают чат и лидерборды.
+
+- Содержимое файла по ссылке не меняется, поэтому GET /avatars/<hash>.jpg
+  отдаёт ETag и Cache-Control: immutable, и клиенты не перезапрашивают картинку.
+- Если фото в Telegram то же (file_unique_id не изменился), повторно не качаем.
+- Планировщик раз в AVATAR_REFRESH_SECONDS сверяет с Telegram игроков без
+  аватара в хранилище и тех, кого сверяли дольше AVATAR_MAX_AGE_HOURS назад.
+  Игрок сначала забирается записью fetched_at, так что воркеры не качают одно и то же.
+- AVATAR_DIR должен быть общим для всех воркеров и реплик API.
+"""
+import hashlib
+import io
+import os
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+import httpx
+from PIL import Image, ImageOps
+from sqlalchemy import insert, or_, select, update
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import func
+
+from .config import get_settings
+from .leaderboard import leaderboard
+from . import models
+
+HASH_LENGTH = 32
+JPEG_QUALITY = 85
+TELEGRAM_TIMEOUT_SECONDS = 10
+
+
+class AvatarError(Exception):
+    """Telegram не отдал фото профиля."""
+
+
+# ─────────────────────────────────────────────────────────────
+# Хранилище
+# ─────────────────────────────────────────────────────────────
+def is_avatar_name(digest: str) -> bool:
+    return len(digest) == HASH_LENGTH and all(c in "0123456789abcdef" for c in digest)
+
+
+def avatar_path(digest: str) -> str:
+    return os.path.join(get_settings().AVATAR_DIR, f"{digest}.jpg")
+
+
+def avatar_url(digest: str) -> str:
+    return f"{get_settings().AVATAR_PUBLIC_URL.rstrip('/')}/avatars/{digest}.jpg"
+
+
+def make_thumbnail(raw: bytes, size: int) -> bytes:
+    """Квадратная JPEG-миниатюра size x size по центру фото."""
+    with Image.open(io.BytesIO(raw)) as image:
+        thumb = ImageOps.fit(image.convert("RGB"), (size, size), Image.LANCZOS)
+    out = io.BytesIO()
+    thumb.save(out, "JPEG", quality=JPEG_QUALITY, optimize=True)
+    return out.getvalue()
+
+
+def store(data: bytes) -> str:
+    """Записать миниатюру под именем по содержимому. Возвращает хэш."""
+    digest = hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+    path = avatar_path(digest)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # Через временный файл: читатель никогда не увидит недописанную картинку
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    return digest
+
+
+def _drop_orphan(db: Session, digest: str) -> None:
+    """Удалить файл, на который больше не ссылается ни один игрок."""
+    if db.scalar(select(models.UserAvatar.user_id).where(models.UserAvatar.hash == digest).limit(1)):
+        return
+    try:
+        os.remove(avatar_path(digest))
+    except FileNotFoundError:
+        pass
+
+
+# ─────────────────────────────────────────────────────────────
+# Telegram
+# ─────────────────────────────────────────────────────────────
+def _api(client: httpx.Client, method: str, **params) -> dict:
+    settings = get_settings()
+    resp = client.get(f"{settings.TELEGRAM_API_URL}/bot{settings.TELEGRAM_BOT_TOKEN}/{method}", params=params)
+    try:
+        resp.raise_for_status()
+        data = resp.json()
+    except httpx.HTTPStatusError as e:
+        raise AvatarError(f"{method}: HTTP {e.response.status_code}") from e
+    except ValueError as e:
+        raise AvatarError(f"{method}: invalid JSON") from e
+    if not data.get("ok"):
+        raise AvatarError(f"{method}: {data.get('description')}")
+    return data["result"]
+
+
+def _download(client: httpx.Client, file_id: str) -> bytes:
+    settings = get_settings()
+    file = _api(client, "getFile", file_id=file_id)
+    resp = client.get(f"{settings.TELEGRAM_API_URL}/file/bot{settings.TELEGRAM_BOT_TOKEN}/{file['file_path']}")
+    try:
+        resp.raise_for_status()
+    except httpx.HTTPStatusError as e:
+        raise AvatarError(f"download: HTTP {e.response.status_code}") from e
+    return resp.content
+
+
+def _pick_size(sizes: List[dict], size: int) -> dict:
+    """Самый маленький вариант фото не меньше миниатюры (варианты идут по возрастанию)."""
+    for photo in sizes:
+        if min(photo["width"], photo["height"]) >= size:
+            return photo
+    return sizes[-1]
+
+
+def is_telegram_file_url(url: Optional[str]) -> bool:
+    """Старая ссылка на файл через Bot API (с токеном бота внутри)."""
+    return bool(url) and "/file/bot" in url
+
+
+def telegram_client() -> httpx.Client:
+    return httpx.Client(timeout=TELEGRAM_TIMEOUT_SECONDS)
+
+
+# ─────────────────────────────────────────────────────────────
+# Обновление
+# ─────────────────────────────────────────────────────────────
+def refresh_avatar(db: Session, client: httpx.Client, user: models.User) -> Optional[str]:
+    """
+    Сверить фото профиля игрока с Telegram, обновить миниатюру и users.url_image.
+    Возвращает ссылку на аватар или None, если фото нет.
+    """
+    size = get_settings().AVATAR_SIZE
+    avatar = db.get(models.UserAvatar, user.id) or models.UserAvatar(user_id=user.id)
+    old_digest = avatar.hash
+
+    photos = _api(client, "getUserProfilePhotos", user_id=user.telegram_id, limit=1)
+    file_unique_id, digest = None, None
+    if photos["total_count"]:
+        photo = _pick_size(photos["photos"][0], size)
+        file_unique_id = photo["file_unique_id"]
+        if file_unique_id == avatar.file_unique_id and old_digest and os.path.exists(avatar_path(old_digest)):
+            digest = old_digest
+        else:
+            digest = store(make_thumbnail(_download(client, photo["file_id"]), size))
+
+    avatar.file_unique_id = file_unique_id
+    avatar.hash = digest
+    avatar.fetched_at = func.now()
+    db.add(avatar)
+
+    url = avatar_url(digest) if digest else None
+    # Без фото в Telegram убираем только свои и старые токенные ссылки:
+    # url_image из Mini App (фото, скрытое от бота настройками) оставляем
+    own = old_digest is not None and user.url_image == avatar_url(old_digest)
+    if digest or own or is_telegram_file_url(user.url_image):
+        user.url_image = url
+    db.commit()
+    leaderboard.update(user)
+
+    if old_digest and old_digest != digest:
+        _drop_orphan(db, old_digest)
+    return url
+
+
+def _stale_user_ids(db: Session, limit: int) -> List[int]:
+    """Игроки без записи в хранилище, затем давно не сверявшиеся."""
+    missing = db.scalars(
+        select(models.User.id)
+        .where(~select(models.UserAvatar.user_id).where(models.UserAvatar.user_id == models.User.id).exists())
+        .order_by(models.User.id)
+        .limit(limit)
+    ).all()
+    if len(missing) >= limit:
+        return list(missing)
+    stale = db.scalars(
+        select(models.UserAvatar.user_id)
+        .where(or_(models.UserAvatar.fetched_at.is_(None), models.UserAvatar.fetched_at < _cutoff()))
+        .order_by(models.UserAvatar.fetched_at)
+        .limit(limit - len(missing))
+    ).all()
+    return list(missing) + list(stale)
+
+
+def _cutoff() -> datetime:
+    return datetime.now(timezone.utc) - timedelta(hours=get_settings().AVATAR_MAX_AGE_HOURS)
+
+
+def _claim(db: Session, user_id: int) -> bool:
+    """Отметить игрока сверенным сейчас. False, если его уже забрал другой воркер."""
+    claimed = db.execute(
+        insert(models.UserAvatar).prefix_with("IGNORE").values(user_id=user_id, fetched_at=func.now())
+    ).rowcount
+    if not claimed:
+        claimed = db.execute(
+            update(models.UserAvatar)
+            .where(
+                models.UserAvatar.user_id == user_id,
+                or_(models.UserAvatar.fetched_at.is_(None), models.UserAvatar.fetched_at < _cutoff()),
+            )
+            .values(fetched_at=func.now())
+        ).rowcount
+    db.commit()
+    return bool(claimed)
+
+
+def refresh_stale(db: Session, limit: int) -> int:
+    """Обновить до limit устаревших аватаров. Возвращает число обновлённых."""
+    if not get_settings().TELEGRAM_BOT_TOKEN:
+        return 0
+    refreshed = 0
+    with telegram_client() as client:
+        for user_id in _stale_user_ids(db, limit):
+            if not _claim(db, user_id):
+                continue
+            user = db.get(models.User, user_id)
+            if not user:
+                continue
+            try:
+                refresh_avatar(db, client, user)
+                refreshed += 1
+            except Exception as e:
+                # fetched_at уже сдвинут: игрока повторим через AVATAR_MAX_AGE_HOURS
+                db.rollback()
+                print(f"[Avatars] Refresh failed for user {user_id}: {e}")
+    return refreshed
@@ -0,0 +1,76 @@
+"""
+In-process кэши редко меняющихся таблиц с межпроцессной инвалидацией.
+
+Каждый кэш привязан к счётчику в таблице cache_versions. Любая запись
+(API, SQLAdmin, другой воркер, бот) увеличивает счётчик, а кэш не чаще раза в
+CACHE_VERSION_CHECK_SECONDS сверяет версию одним запросом по первичному ключу и
+перечитывает данные только если она изменилась.
+"""
+import threading
+import time
+from typing import Callable, Generic, Optional, TypeVar
+
+from sqlalchemy.orm import Session
+
+from .config import get_settings
+from . import models
+
+T = TypeVar("T")
+
+
+def read_version(db: Session, name: str) -> int:
+    row = db.get(models.CacheVersion, name, populate_existing=True)
+    return row.version if row else 0
+
+
+def bump_version(db: Session, name: str) -> None:
+    """Увеличить версию кэша. Коммит остаётся за вызывающим."""
+    updated = db.query(models.CacheVersion).filter(models.CacheVersion.name == name).update(
+        {models.CacheVersion.version: models.CacheVersion.version + 1},
+        synchronize_session=False,
+    )
+    if not updated:
+        db.add(models.CacheVersion(name=name, version=1))
+
+
+class VersionedCache(Generic[T]):
+    """
+    Данные, загруженные loader(db), которые живут до смены версии name.
+
+    Запросы к БД выполняются вне блокировки: в async-роутерах (AsyncSession.run_sync)
+    они переключают greenlet, и другой запрос в том же потоке не должен
+    упереться в удерживаемый threading.Lock.
+    """
+
+    def __init__(self, name: str, loader: Callable[[Session], T]):
+        self.name = name
+        self.loader = loader
+        self._lock = threading.Lock()
+        self._data: Optional[T] = None
+        self._version = -1
+        self._checked_at = 0.0
+        self._generation = 0
+
+    def get(self, db: Session) -> T:
+        ttl = get_settings().CACHE_VERSION_CHECK_SECONDS
+        now = time.monotonic()
+        with self._lock:
+            data, version, generation = self._data, self._version, self._generation
+            if data is not None and now - self._checked_at < ttl:
+                return data
+
+        current = read_version(db, self.name)
+        if data is None or current != version:
+            data = self.loader(db)
+
+        with self._lock:
+            # Пока грузили, кэш могли сбросить - тогда не сохраняем устаревшие данные
+            if generation == self._generation:
+                self._data, self._version, self._checked_at = data, current, now
+        return data
+
+    def invalidate(self) -> None:
+        """Сбросить локальную копию (запись прошла в этом же процессе)."""
+        with self._lock:
+            self._data = None
+            self._generation += 1
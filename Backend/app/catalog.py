@@ -0,0 +1,117 @@
+"""
+Неизменяемый in-memory каталог: улучшения, задания, товары магазина.
+
+Это маленькие таблицы, которые правит только админ, а читаются они почти в
+каждом игровом запросе. Каталог загружается целиком, хранится как набор
+замороженных снимков с индексами (по id, key, action_type) и подменяется
+одной ссылкой при смене версии "catalog" в cache_versions (см. app/cache.py).
+Версию поднимают CRUD-функции и представления SQLAdmin.
+"""
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from .cache import VersionedCache, bump_version
+from . import models
+
+CATALOG_CACHE = "catalog"
+
+
+class _Snapshot:
+    """Запись каталога только для чтения."""
+    __slots__ = ()
+
+    def __init__(self, row):
+        for name in self.__slots__:
+            object.__setattr__(self, name, getattr(row, name))
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is read-only")
+
+    def __repr__(self):
+        return f"<{type(self).__name__} id={self.id}>"
+
+
+class UpgradeSnapshot(_Snapshot):
+    __slots__ = ("id", "key", "title", "description", "base_price", "price_multiplier",
+                 "max_level", "value_per_level", "created_at")
+    id: int
+    key: str
+    title: str
+    description: Optional[str]
+    base_price: int
+    price_multiplier: int
+    max_level: int
+    value_per_level: float
+    created_at: datetime
+
+
+class TaskSnapshot(_Snapshot):
+    __slots__ = ("id", "task_type", "action_type", "target_value", "reward", "title",
+                 "description", "is_active", "created_at")
+    id: int
+    task_type: str
+    action_type: str
+    target_value: int
+    reward: int
+    title: str
+    description: Optional[str]
+    is_active: bool
+    created_at: datetime
+
+
+class ShopItemSnapshot(_Snapshot):
+    __slots__ = ("id", "crystals", "stars", "ton_price", "is_active", "created_at")
+    id: int
+    crystals: int
+    stars: int
+    ton_price: Optional[float]
+    is_active: bool
+    created_at: datetime
+
+
+class Catalog:
+    __slots__ = ("upgrades", "upgrades_by_id", "upgrades_by_key",
+                 "tasks", "tasks_by_id", "active_tasks_by_action",
+                 "shop_items", "shop_items_by_id")
+
+    def __init__(self, upgrades: Tuple[UpgradeSnapshot, ...], tasks: Tuple[TaskSnapshot, ...],
+                 shop_items: Tuple[ShopItemSnapshot, ...]):
+        self.upgrades = upgrades
+        self.upgrades_by_id: Dict[int, UpgradeSnapshot] = {u.id: u for u in upgrades}
+        self.upgrades_by_key: Dict[str, UpgradeSnapshot] = {u.key: u for u in upgrades}
+
+        self.tasks = tasks
+        self.tasks_by_id: Dict[int, TaskSnapshot] = {t.id: t for t in tasks}
+        by_action: Dict[str, list] = {}
+        for task in tasks:
+            if task.is_active:
+                by_action.setdefault(task.action_type, []).append(task)
+        self.active_tasks_by_action: Dict[str, Tuple[TaskSnapshot, ...]] = {
+            action: tuple(items) for action, items in by_action.items()
+        }
+
+        self.shop_items = shop_items
+        self.shop_items_by_id: Dict[int, ShopItemSnapshot] = {i.id: i for i in shop_items}
+
+
+def load_catalog(db: Session) -> Catalog:
+    return Catalog(
+        upgrades=tuple(UpgradeSnapshot(u) for u in db.query(models.Upgrade).order_by(models.Upgrade.id)),
+        tasks=tuple(TaskSnapshot(t) for t in db.query(models.Task).order_by(models.Task.id)),
+        shop_items=tuple(ShopItemSnapshot(i) for i in db.query(models.ShopItem).order_by(models.ShopItem.id)),
+    )
+
+
+_catalog_cache = VersionedCache(CATALOG_CACHE, load_catalog)
+
+
+def get_catalog(db: Session) -> Catalog:
+    return _catalog_cache.get(db)
+
+
+def invalidate_catalog(db: Session) -> None:
+    """Сообщить всем воркерам, что каталог изменился. Коммит за вызывающим."""
+    bump_version(db, CATALOG_CACHE)
+    _catalog_cache.invalidate()
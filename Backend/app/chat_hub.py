@@ -0,0 +1,208 @@
+"""
+Хаб чата: рассылка новых сообщений подписчикам вместо опроса БД.
+
+Воркер держит в памяти кольцевой буфер последних сообщений. send_message
+пишет сообщение в chat_messages и публикует его в хаб, а хаб раскладывает его
+по очередям подключённых SSE-клиентов (GET /chat/stream).
+
+- Очередь у каждого подключения ограничена. Публикация никогда не ждёт
+  медленного клиента: если его очередь переполнена, подключение помечается
+  отставшим и само догоняет ленту из кольцевого буфера.
+- Клиент возобновляет ленту после переподключения с last_id (заголовок
+  Last-Event-ID или параметр). Если last_id старше буфера, клиент получает
+  событие reset со свежими сообщениями и заменяет ими свой список.
+- GET /chat/messages без before_id тоже отвечает из буфера, а ETag по
+  последнему id позволяет ответить 304, вообще не обращаясь к MySQL.
+- Сообщения, отправленные через другие воркеры, подтягиваются из БД одним
+  запросом раз в CHAT_TAIL_SECONDS, и только пока у воркера есть подписчики
+  или чат недавно читали через REST.
+"""
+import asyncio
+import bisect
+import time
+from typing import List, Optional, Set, Tuple
+
+from .config import get_settings
+from .database import AsyncSessionLocal
+from . import crud_async, schemas
+
+# Запас хвоста: сообщение с меньшим id могло закоммититься позже соседнего
+TAIL_OVERLAP = 50
+# Сколько секунд после последнего чтения через REST продолжать подтягивать хвост
+READ_IDLE_SECONDS = 30
+
+
+class Subscription:
+    """Подключение к ленте: ограниченная очередь и флаг отставания."""
+
+    def __init__(self, maxsize: int):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.lagged = False
+        self.closed = False
+
+    def push(self, message: dict) -> None:
+        if self.lagged or self.closed:
+            return
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.lagged = True
+
+    def close(self) -> None:
+        self.closed = True
+        try:
+            self.queue.put_nowait(None)
+        except asyncio.QueueFull:
+            pass  # читатель проверит closed, когда разберёт очередь
+
+
+class ChatHub:
+    def __init__(self, size: int):
+        self.size = size
+        self._ids: List[int] = []  # id сообщений буфера по возрастанию
+        self._messages: List[dict] = []
+        # Сообщения с id <= floor в буфер уже не помещаются
+        self._floor = 0
+        self._loaded = False
+        self._subscribers: Set[Subscription] = set()
+        self._tail_task: Optional[asyncio.Task] = None
+        self._read_at = 0.0
+        self._synced_at = 0.0  # когда буфер последний раз сверялся с БД
+
+    # ── буфер ────────────────────────────────────────────────
+    def _insert(self, message: dict) -> bool:
+        """Положить сообщение в буфер по порядку id. False, если оно уже есть или устарело."""
+        msg_id = message["id"]
+        if msg_id <= self._floor:
+            return False
+        index = bisect.bisect_left(self._ids, msg_id)
+        if index < len(self._ids) and self._ids[index] == msg_id:
+            return False
+        self._ids.insert(index, msg_id)
+        self._messages.insert(index, message)
+        if len(self._ids) > self.size:
+            self._floor = self._ids.pop(0)
+            self._messages.pop(0)
+        return True
+
+    @property
+    def high_water(self) -> int:
+        return self._ids[-1] if self._ids else self._floor
+
+    def recent(self, limit: int) -> List[dict]:
+        return self._messages[-limit:] if limit > 0 else []
+
+    def since(self, last_id: int) -> Tuple[List[dict], bool]:
+        """
+        Сообщения с id > last_id из буфера и признак полноты:
+        False, если часть ленты после last_id из буфера уже вытеснена.
+        """
+        index = bisect.bisect_right(self._ids, last_id)
+        return self._messages[index:], last_id >= self._floor
+
+    def read(self, limit: int, after_id: Optional[int] = None) -> Optional[List[dict]]:
+        """
+        Страница для GET /chat/messages из буфера: последние limit сообщений
+        или первые limit после after_id. None, если буфер ответить не может.
+        """
+        now = time.monotonic()
+        self._read_at = now
+        # Без подписчиков и чтений хвост стоит на паузе: после простоя буфер
+        # мог отстать от других воркеров, такой ответ берём из БД
+        interval = get_settings().CHAT_TAIL_SECONDS
+        stale = interval > 0 and now - self._synced_at > 2 * interval + 1
+        if not self._loaded or stale:
+            return None
+        if after_id is None:
+            if limit > len(self._ids) and self._floor > 0:
+                return None  # страница длиннее того, что осталось в буфере
+            return self.recent(limit)
+        backlog, complete = self.since(after_id)
+        return backlog[:limit] if complete else None
+
+    def etag(self) -> str:
+        """ETag ленты по последнему id."""
+        return f'W/"chat-{self.high_water}"'
+
+    # ── публикация ───────────────────────────────────────────
+    def publish(self, message: schemas.ChatMessageOut) -> None:
+        """Добавить сообщение в буфер и разослать подписчикам."""
+        self._deliver(message.model_dump(mode="json"))
+
+    def _deliver(self, message: dict) -> None:
+        if not self._insert(message):
+            return
+        for sub in self._subscribers:
+            sub.push(message)
+
+    def subscribe(self) -> Subscription:
+        sub = Subscription(get_settings().CHAT_SUBSCRIBER_QUEUE)
+        self._subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        self._subscribers.discard(sub)
+
+    @property
+    def subscribers(self) -> int:
+        return len(self._subscribers)
+
+    # ── синхронизация с БД ───────────────────────────────────
+    async def load(self) -> int:
+        """Заполнить буфер последними сообщениями из БД. Возвращает их число."""
+        async with AsyncSessionLocal() as db:
+            messages = await crud_async.get_chat_feed(db, limit=self.size)
+        self._ids, self._messages = [], []
+        self._floor = messages[0].id - 1 if len(messages) >= self.size else 0
+        for message in messages:
+            self._insert(message.model_dump(mode="json"))
+        self._loaded = True
+        self._synced_at = time.monotonic()
+        return len(messages)
+
+    async def _poll(self) -> None:
+        if not self._loaded:
+            await self.load()
+            return
+        async with AsyncSessionLocal() as db:
+            messages = await crud_async.get_chat_feed(
+                db, after_id=max(self.high_water - TAIL_OVERLAP, 0), limit=self.size
+            )
+        for message in messages:
+            self._deliver(message.model_dump(mode="json"))
+        self._synced_at = time.monotonic()
+
+    async def _tail(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            idle = time.monotonic() - self._read_at > READ_IDLE_SECONDS
+            if not self._subscribers and idle and self._loaded:
+                continue
+            try:
+                await self._poll()
+            except Exception as e:
+                print(f"[ChatHub] Tail failed: {e}")
+
+    async def start(self) -> None:
+        try:
+            print(f"[ChatHub] Loaded {await self.load()} messages")
+        except Exception as e:
+            print(f"[ChatHub] Load failed, will retry: {e}")
+        interval = get_settings().CHAT_TAIL_SECONDS
+        if interval > 0:
+            self._tail_task = asyncio.create_task(self._tail(interval))
+
+    async def stop(self) -> None:
+        if self._tail_task:
+            self._tail_task.cancel()
+            try:
+                await self._tail_task
+            except asyncio.CancelledError:
+                pass
+            self._tail_task = None
+        # Завершаем открытые потоки, иначе сервер ждал бы их при остановке
+        for sub in list(self._subscribers):
+            sub.close()
+
+
+chat_hub = ChatHub(get_settings().CHAT_BUFFER_SIZE)
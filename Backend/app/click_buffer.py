@@ -0,0 +1,531 @@
+"""
+Write-behind буфер кликов.
+
+Клики не пишутся в БД на каждый запрос. Для каждого игрока в памяти воркера
+держится модель энергии и накопленные дельты (клики, заработок). Фоновый поток
+сбрасывает их в MySQL пачкой раз в CLICK_FLUSH_INTERVAL_MS или досрочно, когда
+у игрока накопилось CLICK_FLUSH_MAX_CLICKS кликов.
+
+Надёжность:
+- Перед ответом клиенту клик дописывается в журнал на диске (сегмент на воркер).
+  fsync делает отдельный поток сразу за всё, что записано с прошлого fsync
+  (group commit), а запрос ждёт его в пуле потоков, не в event loop.
+- Сегмент удаляется только после коммита в БД; в той же транзакции в
+  click_flushes пишется имя сегмента, поэтому повторное применение невозможно.
+- Сегмент держит flock, пока воркер жив. При старте любой воркер забирает
+  «осиротевшие» сегменты упавших процессов и доигрывает их в БД. Сегмент
+  создаётся под временным именем и получает имя .log уже под flock, так что
+  recover() никогда не заберёт сегмент живого воркера.
+- Энергия в БД пишется не снимком воркера, а списанием кликов от значения в БД
+  (как в crud.settle_clicks): траты других воркеров и бота не затираются.
+  Если в БД энергии меньше, чем кликов в пачке (игрок кликал через два воркера),
+  оплачиваются только клики, на которые энергии хватает, остальные отбрасываются.
+"""
+import fcntl
+import json
+import os
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import update
+from sqlalchemy.sql import func
+
+from .config import get_settings
+from .database import SessionLocal
+from .leaderboard import leaderboard
+from . import crud, effects, models, schemas
+
+
+# ─────────────────────────────────────────────────────────────
+# Журнал
+# ─────────────────────────────────────────────────────────────
+NEW_SUFFIX = ".new"  # сегмент до взятия flock
+NEW_SEGMENT_TTL_SECONDS = 60  # брошенный .new старше этого удаляется при recover()
+
+
+class JournalSegment:
+    """Файл журнала кликов, заблокированный текущим процессом."""
+
+    def __init__(self, directory: str, name: str, fsync: bool):
+        self.name = name
+        self.path = os.path.join(directory, name)
+        self.fsync = fsync
+        # Под именем .log сегмент появляется уже заблокированным
+        tmp_path = self.path + NEW_SUFFIX
+        self.fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_APPEND, 0o644)
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        os.rename(tmp_path, self.path)
+        self.records = 0
+        self._synced = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def append(self, user_id: int, clicks: int, amount: float) -> int:
+        """Дописать запись без fsync. Возвращает её номер для wait_synced."""
+        line = json.dumps({"u": user_id, "c": clicks, "a": amount}) + "\n"
+        os.write(self.fd, line.encode("utf-8"))
+        self.records += 1
+        return self.records
+
+    def sync(self) -> None:
+        """fsync всего записанного к этому моменту; будит ждущих."""
+        with self._cond:
+            target = self.records
+            if self._closed or target <= self._synced:
+                return
+            os.fsync(self.fd)
+            self._synced = target
+            self._cond.notify_all()
+
+    def wait_synced(self, record: int) -> None:
+        """Дождаться, пока запись record на диске (или сегмент уже в БД)."""
+        with self._cond:
+            self._cond.wait_for(lambda: self._synced >= record or self._closed)
+
+    def discard(self) -> None:
+        """Удалить сегмент после того, как его данные закоммичены."""
+        with self._cond:
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+            os.close(self.fd)
+            self._closed = True
+            self._cond.notify_all()
+
+
+def _read_segment(path: str) -> Dict[int, List[float]]:
+    """Сложить записи сегмента по игрокам: {user_id: [clicks, amount]}."""
+    totals: Dict[int, List[float]] = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                continue  # недописанная последняя строка
+            acc = totals.setdefault(int(rec["u"]), [0, 0.0])
+            acc[0] += int(rec["c"])
+            acc[1] += float(rec["a"])
+    return totals
+
+
+def _settle(db, user_id: int, clicks: int, amount: float, now: datetime) -> Tuple[int, float]:
+    """
+    Списать энергию за клики и начислить доход. Возвращает оплаченные (клики, доход):
+    меньше переданных, если энергии в БД на все клики не хватает.
+    """
+    energy = crud.regenerated_energy_expr(now)
+    # MySQL выполняет SET слева направо: energy считается от старого last_energy_update
+    settled = db.execute(
+        update(models.User)
+        .where(models.User.id == user_id, energy >= clicks)
+        .ordered_values(
+            (models.User.energy, energy - clicks),
+            (models.User.balance, func.round(models.User.balance + amount, 2)),
+            (models.User.last_energy_update, now),
+        )
+    ).rowcount
+    if settled:
+        return clicks, amount
+
+    # Энергию уже потратили мимо этого воркера - оплачиваем остаток под блокировкой строки
+    user = db.query(models.User).filter(models.User.id == user_id).with_for_update().first()
+    if user is None:
+        return 0, 0.0
+    available, _ = crud.calc_regenerated_energy(user.energy, user.max_energy, user.last_energy_update, now)
+    paid_clicks = max(min(clicks, available), 0)
+    paid_amount = amount * paid_clicks / clicks
+    db.execute(
+        update(models.User)
+        .where(models.User.id == user_id)
+        .values(
+            energy=available - paid_clicks,
+            balance=func.round(models.User.balance + paid_amount, 2),
+            last_energy_update=now,
+        )
+    )
+    print(f"[ClickBuffer] User {user_id}: dropped {clicks - paid_clicks} clicks without energy")
+    return paid_clicks, paid_amount
+
+
+# ─────────────────────────────────────────────────────────────
+# Аккумулятор игрока
+# ─────────────────────────────────────────────────────────────
+@dataclass
+class UserAccumulator:
+    snapshot: dict  # последний UserOut игрока (для ответа без запроса в БД)
+    energy: int
+    max_energy: int
+    last_energy_update: datetime
+    click_power: float
+    pending_clicks: int = 0
+    pending_amount: float = 0.0
+    last_click_at: datetime = field(default_factory=lambda: datetime.now(timezone.utc))
+
+
+# ─────────────────────────────────────────────────────────────
+# Буфер
+# ─────────────────────────────────────────────────────────────
+class ClickBuffer:
+    # Аккумуляторы без кликов дольше этого срока выгружаются из памяти
+    IDLE_TTL = timedelta(minutes=5)
+
+    def __init__(self):
+        self.settings = get_settings()
+        self._lock = threading.Lock()
+        self._accumulators: Dict[int, UserAccumulator] = {}
+        self._segment: Optional[JournalSegment] = None
+        self._sealed: List[JournalSegment] = []  # сегменты, ждущие коммита в БД
+        self._segment_prefix = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._segment_seq = 0
+        self._wakeup = threading.Event()
+        self._dirty = threading.Event()  # в журнале есть записи без fsync
+        self._stop = threading.Event()
+        self._flush_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._syncer: Optional[threading.Thread] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.settings.CLICK_BUFFER_ENABLED
+
+    # ── жизненный цикл ──────────────────────────────────────
+    def start(self) -> None:
+        """Доиграть осиротевшие журналы и запустить фоновый сброс."""
+        if not self.enabled:
+            return
+        os.makedirs(self.settings.CLICK_JOURNAL_DIR, exist_ok=True)
+        self.recover()
+        with self._lock:
+            self._segment = self._open_segment()
+        self._thread = threading.Thread(target=self._run, name="click-buffer", daemon=True)
+        self._thread.start()
+        if self.settings.CLICK_JOURNAL_FSYNC:
+            self._syncer = threading.Thread(target=self._sync_loop, name="click-journal-sync", daemon=True)
+            self._syncer.start()
+        print("[ClickBuffer] Started")
+
+    def stop(self) -> None:
+        """Остановить фоновый поток и сбросить всё накопленное."""
+        if not self._thread:
+            return
+        self._stop.set()
+        self._wakeup.set()
+        self._dirty.set()
+        self._thread.join()
+        self._thread = None
+        if self._syncer:
+            self._syncer.join()
+            self._syncer = None
+        try:
+            self.flush()
+        except Exception as e:
+            # Сегменты останутся на диске и будут доиграны следующим стартом
+            print(f"[ClickBuffer] Final flush failed: {e}")
+            return
+        with self._lock:
+            if self._segment:
+                self._segment.discard()
+                self._segment = None
+        print("[ClickBuffer] Stopped")
+
+    def _open_segment(self) -> JournalSegment:
+        self._segment_seq += 1
+        name = f"{self._segment_prefix}-{self._segment_seq:08d}.log"
+        return JournalSegment(self.settings.CLICK_JOURNAL_DIR, name, self.settings.CLICK_JOURNAL_FSYNC)
+
+    # ── горячий путь ─────────────────────────────────────────
+    def add_clicks(self, user_id: int, clicks: int) -> Optional[dict]:
+        """
+        Принять клики игрока. Возвращает актуальное состояние игрока
+        или None, если не хватает энергии. Бросает KeyError, если игрока нет.
+        Блокирует до fsync журнала - вызывать из пула потоков, не из event loop.
+        """
+        with self._lock:
+            acc = self._accumulators.get(user_id)
+
+        if acc is None:
+            seeded = self._seed(user_id)
+            with self._lock:
+                acc = self._accumulators.setdefault(user_id, seeded)
+
+        with self._lock:
+            now = datetime.now(timezone.utc)
+            acc.energy, acc.last_energy_update = crud.calc_regenerated_energy(
+                acc.energy, acc.max_energy, acc.last_energy_update, now
+            )
+            if acc.energy < clicks:
+                return None
+
+            amount = clicks * acc.click_power
+            # Сначала журнал, потом подтверждение клиенту
+            segment = self._segment
+            record = segment.append(user_id, clicks, amount)
+
+            acc.energy -= clicks
+            acc.last_energy_update = now
+            acc.last_click_at = now
+            acc.pending_clicks += clicks
+            acc.pending_amount += amount
+            acc.snapshot["balance"] = round(acc.snapshot["balance"] + amount, 2)
+            acc.snapshot["energy"] = acc.energy
+            acc.snapshot["last_energy_update"] = now
+
+            if acc.pending_clicks >= self.settings.CLICK_FLUSH_MAX_CLICKS:
+                self._wakeup.set()
+            state = dict(acc.snapshot)
+
+        if self.settings.CLICK_JOURNAL_FSYNC:
+            self._dirty.set()
+            segment.wait_synced(record)
+        return state
+
+    def _seed(self, user_id: int) -> UserAccumulator:
+        db = SessionLocal()
+        try:
+            user = crud.get_user_by_id(db, user_id)
+            if not user:
+                raise KeyError(user_id)
+            user = effects.ensure_user_stats(db, user)
+            user = crud.with_current_energy(user)
+            last_update = user.last_energy_update or datetime.now(timezone.utc)
+            if last_update.tzinfo is None:
+                last_update = last_update.replace(tzinfo=timezone.utc)
+            return UserAccumulator(
+                snapshot=schemas.UserOut.model_validate(user).model_dump(),
+                energy=user.energy,
+                max_energy=user.max_energy,
+                last_energy_update=last_update,
+                click_power=user.click_power,
+            )
+        finally:
+            db.close()
+
+    def flush_user(self, user_id: int) -> None:
+        """Сбросить клики игрока перед операцией, зависящей от баланса."""
+        with self._lock:
+            acc = self._accumulators.get(user_id)
+            has_pending = acc is not None and acc.pending_clicks > 0
+        if has_pending:
+            self.flush()
+
+    def refresh_users(self, user_ids: Optional[List[int]] = None) -> None:
+        """
+        Перечитать из БД игроков после изменений мимо буфера (покупки, переводы,
+        награды, пассивный доход, правки админки): иначе следующие клики считаются
+        по старым click_power / max_energy, а ответ отдаёт старый баланс.
+        None - всех игроков в памяти. Несброшенные клики сохраняются.
+        Вызывать после коммита; другие воркеры подтянут изменения своим сбросом.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            known = [uid for uid in (user_ids if user_ids is not None else self._accumulators) if uid in self._accumulators]
+        self._refresh(known)
+
+    # ── group commit журнала ─────────────────────────────────
+    def _sync_loop(self) -> None:
+        """
+        Один fsync на все клики, записанные с прошлого fsync: пока идёт
+        текущий, новые записи копятся и уходят следующим.
+        """
+        while not self._stop.is_set():
+            self._dirty.wait()
+            self._dirty.clear()
+            with self._lock:
+                segments = self._sealed + ([self._segment] if self._segment else [])
+            for seg in segments:
+                try:
+                    seg.sync()
+                except OSError as e:
+                    print(f"[ClickBuffer] Journal fsync failed: {e}")
+
+    # ── фоновый сброс ────────────────────────────────────────
+    def _run(self) -> None:
+        interval = self.settings.CLICK_FLUSH_INTERVAL_MS / 1000.0
+        while not self._stop.is_set():
+            self._wakeup.wait(interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"[ClickBuffer] Flush error: {e}")
+
+    def flush(self) -> None:
+        """Записать накопленные дельты в БД одной транзакцией."""
+        with self._flush_lock:
+            with self._lock:
+                if self._segment is None or (self._segment.records == 0 and not self._sealed):
+                    self._evict_idle()
+                    return
+                batch = {}
+                for user_id, acc in self._accumulators.items():
+                    if acc.pending_clicks:
+                        batch[user_id] = (acc.pending_clicks, acc.pending_amount)
+                        acc.pending_clicks = 0
+                        acc.pending_amount = 0.0
+                if self._segment.records:
+                    self._sealed.append(self._segment)
+                    self._segment = self._open_segment()
+                sealed = list(self._sealed)
+
+            try:
+                self._apply(batch, [seg.name for seg in sealed])
+            except Exception:
+                # Возвращаем дельты обратно: запечатанные сегменты остаются на
+                # диске и уйдут со следующим сбросом (или доиграются при рестарте)
+                with self._lock:
+                    for user_id, (clicks, amount) in batch.items():
+                        acc = self._accumulators.get(user_id)
+                        if acc:
+                            acc.pending_clicks += clicks
+                            acc.pending_amount += amount
+                raise
+
+            with self._lock:
+                self._sealed = [seg for seg in self._sealed if seg not in sealed]
+            for seg in sealed:
+                seg.discard()
+            self._refresh(list(batch))
+
+    def _apply(self, batch: dict, segment_names: List[str]) -> None:
+        now = datetime.now(timezone.utc).replace(microsecond=0)
+        db = SessionLocal()
+        try:
+            paid = {
+                user_id: _settle(db, user_id, clicks, amount, now)
+                for user_id, (clicks, amount) in batch.items()
+            }
+            # Прогресс заданий - в той же транзакции, чтобы доигрывание не учло его дважды
+            crud.add_action_counts(db, [
+                (user_id, action_type, value)
+                for user_id, (clicks, amount) in paid.items()
+                for action_type, value in (("click", clicks), ("earn", int(amount)))
+            ])
+            for name in segment_names:
+                db.add(models.ClickFlush(segment=name))
+            db.commit()
+        finally:
+            db.close()
+
+    def _refresh(self, user_ids: List[int]) -> None:
+        """Подтянуть из БД изменения, сделанные мимо буфера (покупки, переводы, улучшения)."""
+        if not user_ids:
+            return
+        db = SessionLocal()
+        try:
+            users = db.query(models.User).filter(models.User.id.in_(user_ids)).all()
+        finally:
+            db.close()
+
+        for user in users:
+            leaderboard.update(user)
+
+        with self._lock:
+            now = datetime.now(timezone.utc)
+            for user in users:
+                acc = self._accumulators.get(user.id)
+                if acc is None:
+                    continue
+                if user.click_power is not None:
+                    acc.click_power = user.click_power
+                acc.max_energy = user.max_energy
+                # Энергия - из БД за вычетом ещё не сброшенных кликов этого воркера
+                db_energy, _ = crud.calc_regenerated_energy(user.energy, user.max_energy, user.last_energy_update, now)
+                acc.energy = max(db_energy - acc.pending_clicks, 0)
+                acc.last_energy_update = now
+                acc.snapshot = schemas.UserOut.model_validate(user).model_dump()
+                acc.snapshot["energy"] = acc.energy
+                acc.snapshot["last_energy_update"] = now
+                acc.snapshot["balance"] = round(user.balance + acc.pending_amount, 2)
+            self._evict_idle()
+
+    def _evict_idle(self) -> None:
+        threshold = datetime.now(timezone.utc) - self.IDLE_TTL
+        for user_id in [
+            uid for uid, acc in self._accumulators.items()
+            if not acc.pending_clicks and acc.last_click_at < threshold
+        ]:
+            del self._accumulators[user_id]
+
+    # ── восстановление после падения ─────────────────────────
+    def recover(self) -> None:
+        """Доиграть сегменты журнала, чьи процессы-владельцы умерли."""
+        directory = self.settings.CLICK_JOURNAL_DIR
+        for name in sorted(os.listdir(directory)):
+            if name.endswith(NEW_SUFFIX):
+                self._drop_abandoned(os.path.join(directory, name))
+                continue
+            if not name.endswith(".log"):
+                continue
+            path = os.path.join(directory, name)
+            try:
+                fd = os.open(path, os.O_RDONLY)
+            except FileNotFoundError:
+                continue
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)  # сегмент живого воркера
+                continue
+            try:
+                self._replay(path, name)
+                os.unlink(path)
+            except Exception as e:
+                print(f"[ClickBuffer] Failed to replay {name}: {e}")
+            finally:
+                os.close(fd)
+
+        db = SessionLocal()
+        try:
+            db.query(models.ClickFlush).filter(
+                models.ClickFlush.created_at < datetime.now(timezone.utc) - timedelta(days=1)
+            ).delete(synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+    @staticmethod
+    def _drop_abandoned(path: str) -> None:
+        """Удалить .new, брошенный процессом, упавшим до переименования (записей в нём нет)."""
+        try:
+            if time.time() - os.path.getmtime(path) < NEW_SEGMENT_TTL_SECONDS:
+                return  # возможно, воркер прямо сейчас берёт на него flock
+            fd = os.open(path, os.O_RDONLY)
+        except FileNotFoundError:
+            return
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            os.unlink(path)
+        except (BlockingIOError, FileNotFoundError):
+            pass
+        finally:
+            os.close(fd)
+
+    def _replay(self, path: str, segment_name: str) -> None:
+        db = SessionLocal()
+        try:
+            if db.get(models.ClickFlush, segment_name):
+                return  # уже закоммичен до падения
+            now = datetime.now(timezone.utc).replace(microsecond=0)
+            paid = {
+                user_id: _settle(db, user_id, int(clicks), amount, now)
+                for user_id, (clicks, amount) in _read_segment(path).items()
+            }
+            crud.add_action_counts(db, [
+                (user_id, action_type, value)
+                for user_id, (clicks, amount) in paid.items()
+                for action_type, value in (("click", int(clicks)), ("earn", int(amount)))
+            ])
+            db.add(models.ClickFlush(segment=segment_name))
+            db.commit()
+            print(f"[ClickBuffer] Replayed {segment_name}: {len(paid)} users")
+        finally:
+            db.close()
+
+
+click_buffer = ClickBuffer()
@@ -1,9 +1,17 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import desc
-from typing import Optional, List
+from sqlalchemy.orm import Session, joinedload
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy import and_, desc, literal, literal_column, or_, select, union_all, update
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.sql import func
+from typing import Dict, Optional, List
 import math
 
-from . import models, schemas
+from . import models, schemas, effects
+from .cache import VersionedCache, bump_version
+from .catalog import UpgradeSnapshot, TaskSnapshot, ShopItemSnapshot, get_catalog, invalidate_catalog
+from .config import get_settings
+from .leaderboard import leaderboard
 
 
 # ─────────────────────────────────────────────────────────────
@@ -25,10 +33,6 @@ def get_users(db: Session, skip: int = 0, limit: int = 100) -> List[models.User]
     return db.query(models.User).offset(skip).limit(limit).all()
 
 
-def get_leaderboard(db: Session, limit: int = 50) -> List[models.User]:
-    return db.query(models.User).order_by(desc(models.User.balance)).limit(limit).all()
-
-
 def create_user(db: Session, user: schemas.UserCreate) -> models.User:
     db_user = models.User(
         telegram_id=user.telegram_id,
@@ -41,6 +45,7 @@ def create_user(db: Session, user: schemas.UserCreate) -> models.User:
     db.add(db_user)
     db.commit()
     db.refresh(db_user)
+    leaderboard.update(db_user)
     return db_user
 
 
@@ -49,13 +54,20 @@ def update_user(db: Session, user: models.User, data: schemas.UserUpdate) -> mod
         setattr(user, field, value)
     db.commit()
     db.refresh(user)
+    leaderboard.update(user)
     return user
 
 
 def add_balance(db: Session, user: models.User, amount: float) -> models.User:
-    user.balance = round(user.balance + amount, 2)
+    # Прибавляем на стороне БД, чтобы параллельные запросы не затирали друг друга
+    db.execute(
+        update(models.User)
+        .where(models.User.id == user.id)
+        .values(balance=func.round(models.User.balance + amount, 2))
+    )
     db.commit()
     db.refresh(user)
+    leaderboard.update(user)
     return user
 
 
@@ -64,70 +76,151 @@ def add_balance(db: Session, user: models.User, amount: float) -> models.User:
 # ─────────────────────────────────────────────────────────────
 from datetime import datetime, timezone
 
-def get_user_with_regenerated_energy(db: Session, user: models.User) -> models.User:
-    """Рассчитать восстановленную энергию с момента последнего обновления."""
-    now = datetime.now(timezone.utc)
-    last_update = user.last_energy_update
-    
+def calc_regenerated_energy(energy: int, max_energy: int, last_update: Optional[datetime], now: datetime) -> tuple:
+    """Посчитать энергию на момент now. Возвращает (energy, last_update)."""
     if last_update is None:
         last_update = now
-    
+
     # Убедимся, что last_update имеет timezone
     if last_update.tzinfo is None:
         last_update = last_update.replace(tzinfo=timezone.utc)
-    
-    # Рассчитываем сколько секунд прошло
-    seconds_passed = (now - last_update).total_seconds()
-    
+
     # 1 энергия в секунду
-    energy_to_add = int(seconds_passed)
-    
+    energy_to_add = int((now - last_update).total_seconds())
+
     if energy_to_add > 0:
-        new_energy = min(user.energy + energy_to_add, user.max_energy)
-        user.energy = new_energy
-        user.last_energy_update = now
-        db.commit()
-        db.refresh(user)
-    
+        return min(energy + energy_to_add, max_energy), now
+    return energy, last_update
+
+
+def with_current_energy(user: models.User) -> models.User:
+    """
+    Подставить в объект текущую энергию, ничего не записывая в БД.
+    В БД энергия хранится контрольной точкой (energy, last_energy_update)
+    и пишется только при трате или смене max_energy.
+    """
+    energy, last_update = calc_regenerated_energy(
+        user.energy, user.max_energy, user.last_energy_update, datetime.now(timezone.utc)
+    )
+    # set_committed_value не помечает объект изменённым - сессия его не запишет
+    set_committed_value(user, "energy", energy)
+    set_committed_value(user, "last_energy_update", last_update)
     return user
 
 
-def consume_energy(db: Session, user: models.User, amount: int = 1) -> bool:
-    """Потратить энергию. Возвращает True если успешно."""
-    # Сначала восстанавливаем энергию
-    user = get_user_with_regenerated_energy(db, user)
-    
-    if user.energy < amount:
-        return False
-    
-    user.energy -= amount
-    user.last_energy_update = datetime.now(timezone.utc)
+def regenerated_energy_expr(now: datetime):
+    """SQL-выражение энергии на момент now (1 энергия в секунду, не выше max_energy)."""
+    seconds = func.greatest(
+        func.timestampdiff(literal_column("SECOND"), func.coalesce(models.User.last_energy_update, now), now),
+        0,
+    )
+    return func.least(models.User.energy + seconds, models.User.max_energy)
+
+
+def settle_clicks(db: Session, user_id: int, clicks: int) -> Optional[models.User]:
+    """
+    Списать энергию и начислить доход за клики одним UPDATE.
+    Восстановление энергии, проверка energy >= clicks, списание и начисление
+    clicks * click_power выполняются атомарно в БД. Возвращает None, если
+    энергии не хватило (или пользователя нет).
+    """
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    energy = regenerated_energy_expr(now)
+
+    # MySQL выполняет SET слева направо: energy считается от старого last_energy_update
+    result = db.execute(
+        update(models.User)
+        .where(
+            models.User.id == user_id,
+            models.User.click_power.isnot(None),
+            energy >= clicks,
+        )
+        .ordered_values(
+            (models.User.energy, energy - clicks),
+            (models.User.balance, func.round(models.User.balance + clicks * models.User.click_power, 2)),
+            (models.User.last_energy_update, now),
+        )
+    )
     db.commit()
-    db.refresh(user)
-    return True
 
+    if result.rowcount == 0:
+        user = get_user_by_id(db, user_id)
+        if user and user.click_power is None:
+            # Характеристики ещё не посчитаны (игрок ничего не покупал) - считаем и повторяем
+            effects.recompute_user_stats(db, user)
+            return settle_clicks(db, user_id, clicks)
+        return None
+    user = get_user_by_id(db, user_id)
+    leaderboard.update(user)
+    return user
 
-def update_max_energy(db: Session, user: models.User, new_max: int) -> models.User:
-    """Обновить максимальную энергию пользователя."""
-    user.max_energy = new_max
+
+# ─────────────────────────────────────────────────────────────
+# Passive income
+# ─────────────────────────────────────────────────────────────
+def calc_passive_income(rate: float, click_power: float, last_accrual: Optional[datetime], now: datetime, cap_seconds: int) -> float:
+    """Доход за время с last_accrual по now, не больше cap_seconds."""
+    if last_accrual is None or rate <= 0:
+        return 0.0
+    if last_accrual.tzinfo is None:
+        last_accrual = last_accrual.replace(tzinfo=timezone.utc)
+    seconds = min(max((now - last_accrual).total_seconds(), 0), cap_seconds)
+    return round(rate * click_power * seconds, 2)
+
+
+def accrue_passive_income(db: Session, user: models.User) -> float:
+    """
+    Начислить пассивный доход с момента прошлого начисления.
+    Возвращает начисленную сумму (0, если начисление уже сделал параллельный запрос).
+    """
+    # Секунды без дробной части: DATETIME в MySQL хранит их без микросекунд
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    user = effects.ensure_user_stats(db, user)
+    last_accrual = user.passive_accrued_at
+    amount = 0.0
+    if last_accrual is not None:
+        amount = calc_passive_income(
+            user.passive_rate,
+            user.click_power,
+            last_accrual,
+            now,
+            get_settings().PASSIVE_OFFLINE_CAP_SECONDS,
+        )
+
+    # Сдвигаем отметку только если её никто не сдвинул раньше нас
+    updated = db.query(models.User).filter(
+        models.User.id == user.id,
+        models.User.passive_accrued_at == last_accrual,
+    ).update(
+        {
+            models.User.balance: func.round(models.User.balance + amount, 2),
+            models.User.passive_accrued_at: now,
+        },
+        synchronize_session=False,
+    )
     db.commit()
     db.refresh(user)
-    return user
+
+    if not updated:
+        return 0.0
+    leaderboard.update(user)
+    return amount
 
 
 # ─────────────────────────────────────────────────────────────
 # Upgrade CRUD
 # ─────────────────────────────────────────────────────────────
-def get_upgrade_by_id(db: Session, upgrade_id: int) -> Optional[models.Upgrade]:
-    return db.query(models.Upgrade).filter(models.Upgrade.id == upgrade_id).first()
+# Чтение идёт из каталога (app/catalog.py), запись - в БД с инвалидацией каталога
+def get_upgrade_by_id(db: Session, upgrade_id: int) -> Optional[UpgradeSnapshot]:
+    return get_catalog(db).upgrades_by_id.get(upgrade_id)
 
 
-def get_upgrade_by_key(db: Session, key: str) -> Optional[models.Upgrade]:
-    return db.query(models.Upgrade).filter(models.Upgrade.key == key).first()
+def get_upgrade_by_key(db: Session, key: str) -> Optional[UpgradeSnapshot]:
+    return get_catalog(db).upgrades_by_key.get(key)
 
 
-def get_all_upgrades(db: Session) -> List[models.Upgrade]:
-    return db.query(models.Upgrade).all()
+def get_all_upgrades(db: Session) -> List[UpgradeSnapshot]:
+    return list(get_catalog(db).upgrades)
 
 
 def create_upgrade(db: Session, upgrade: schemas.UpgradeCreate) -> models.Upgrade:
@@ -138,23 +231,42 @@ def create_upgrade(db: Session, upgrade: schemas.UpgradeCreate) -> models.Upgrad
         base_price=upgrade.base_price,
         price_multiplier=upgrade.price_multiplier,
         max_level=upgrade.max_level,
+        value_per_level=upgrade.value_per_level,
     )
     db.add(db_upgrade)
+    invalidate_catalog(db)
     db.commit()
     db.refresh(db_upgrade)
     return db_upgrade
 
 
-def update_upgrade(db: Session, upgrade: models.Upgrade, data: schemas.UpgradeUpdate) -> models.Upgrade:
+def _drop_stale_catalog(db: Session) -> None:
+    """Снимок каталога ссылается на удалённую запись - перечитать каталог во всех воркерах."""
+    invalidate_catalog(db)
+    db.commit()
+
+
+def update_upgrade(db: Session, upgrade: UpgradeSnapshot, data: schemas.UpgradeUpdate) -> Optional[models.Upgrade]:
+    """None, если запись уже удалена (снимок каталога устарел)."""
+    db_upgrade = db.get(models.Upgrade, upgrade.id)
+    if db_upgrade is None:
+        _drop_stale_catalog(db)
+        return None
     for field, value in data.model_dump(exclude_unset=True).items():
-        setattr(upgrade, field, value)
+        setattr(db_upgrade, field, value)
+    invalidate_catalog(db)
     db.commit()
-    db.refresh(upgrade)
-    return upgrade
+    db.refresh(db_upgrade)
+    return db_upgrade
 
 
-def delete_upgrade(db: Session, upgrade: models.Upgrade) -> None:
-    db.delete(upgrade)
+def delete_upgrade(db: Session, upgrade: UpgradeSnapshot) -> None:
+    db_upgrade = db.get(models.Upgrade, upgrade.id)
+    if db_upgrade is None:
+        _drop_stale_catalog(db)  # уже удалена другим запросом
+        return
+    db.delete(db_upgrade)
+    invalidate_catalog(db)
     db.commit()
 
 
@@ -172,12 +284,12 @@ def get_user_upgrades(db: Session, user_id: int) -> List[models.UserUpgrade]:
     return db.query(models.UserUpgrade).filter(models.UserUpgrade.user_id == user_id).all()
 
 
-def calc_upgrade_price(upgrade: models.Upgrade, level: int) -> int:
+def calc_upgrade_price(upgrade: UpgradeSnapshot, level: int) -> int:
     multiplier = upgrade.price_multiplier / 100.0
     return math.floor(upgrade.base_price * (multiplier ** level))
 
 
-def buy_upgrade(db: Session, user: models.User, upgrade: models.Upgrade) -> Optional[models.UserUpgrade]:
+def buy_upgrade(db: Session, user: models.User, upgrade: UpgradeSnapshot) -> Optional[models.UserUpgrade]:
     user_upgrade = get_user_upgrade(db, user.id, upgrade.id)
 
     current_level = user_upgrade.level if user_upgrade else 0
@@ -187,13 +299,22 @@ def buy_upgrade(db: Session, user: models.User, upgrade: models.Upgrade) -> Opti
 
     price = calc_upgrade_price(upgrade, current_level)
 
-    if user.balance < price:
+    # Списываем в БД с проверкой баланса: клики из буфера и параллельные
+    # покупки, попавшие в баланс после чтения, не затираются
+    if not _charge(db, user.id, price):
+        db.rollback()
         return None
 
-    user.balance -= price
-
     if user_upgrade:
-        user_upgrade.level += 1
+        # Уровень поднимается, только если его никто не поднял после чтения
+        raised = db.execute(
+            update(models.UserUpgrade)
+            .where(models.UserUpgrade.id == user_upgrade.id, models.UserUpgrade.level == current_level)
+            .values(level=current_level + 1)
+        ).rowcount
+        if not raised:
+            db.rollback()
+            return None
     else:
         user_upgrade = models.UserUpgrade(
             user_id=user.id,
@@ -202,20 +323,58 @@ def buy_upgrade(db: Session, user: models.User, upgrade: models.Upgrade) -> Opti
         )
         db.add(user_upgrade)
 
-    db.commit()
+    try:
+        db.commit()
+    except IntegrityError:
+        # Параллельная покупка первого уровня уже создала строку (уникальный ключ)
+        db.rollback()
+        return None
     db.refresh(user_upgrade)
+    db.refresh(user)
+
+    # Пересчитываем click_power / passive_rate / max_energy игрока
+    effects.recompute_user_stats(db, user)
+    leaderboard.update(user)
     return user_upgrade
 
 
 # ─────────────────────────────────────────────────────────────
 # Transfer CRUD
 # ─────────────────────────────────────────────────────────────
+def _charge(db: Session, user_id: int, amount: float) -> bool:
+    """Списать amount, если на балансе хватает. Без коммита; False - не хватило."""
+    return db.execute(
+        update(models.User)
+        .where(models.User.id == user_id, models.User.balance >= amount)
+        .values(balance=func.round(models.User.balance - amount, 2))
+    ).rowcount > 0
+
+
+def _credit(db: Session, user_id: int, amount: float) -> None:
+    """Начислить amount прибавкой в БД (без коммита)."""
+    db.execute(
+        update(models.User)
+        .where(models.User.id == user_id)
+        .values(balance=func.round(models.User.balance + amount, 2))
+    )
+
+
 def create_transfer(db: Session, sender: models.User, receiver: models.User, amount: int) -> Optional[models.Transfer]:
-    if sender.balance < amount or amount <= 0:
+    if amount <= 0:
         return None
 
-    sender.balance -= amount
-    receiver.balance += amount
+    # Балансы меняются прибавкой в БД, строки блокируются по возрастанию id,
+    # чтобы встречные переводы не ловили deadlock
+    if sender.id < receiver.id:
+        charged = _charge(db, sender.id, amount)
+        if charged:
+            _credit(db, receiver.id, amount)
+    else:
+        _credit(db, receiver.id, amount)
+        charged = _charge(db, sender.id, amount)
+    if not charged:
+        db.rollback()
+        return None
 
     transfer = models.Transfer(
         sender_id=sender.id,
@@ -225,27 +384,67 @@ def create_transfer(db: Session, sender: models.User, receiver: models.User, amo
     db.add(transfer)
     db.commit()
     db.refresh(transfer)
+    db.refresh(sender)
+    db.refresh(receiver)
+    leaderboard.update(sender)
+    leaderboard.update(receiver)
     return transfer
 
 
-def get_user_transfers(db: Session, user_id: int, limit: int = 50) -> List[models.Transfer]:
-    return db.query(models.Transfer).filter(
-        (models.Transfer.sender_id == user_id) | (models.Transfer.receiver_id == user_id)
-    ).order_by(desc(models.Transfer.created_at)).limit(limit).all()
+def get_transfer_history(
+    db: Session,
+    user_id: int,
+    limit: int = 50,
+    before_created_at: Optional[datetime] = None,
+    before_id: Optional[int] = None,
+) -> list:
+    """
+    История переводов игрока одним запросом: UNION ALL отправленных и полученных
+    (каждая половина идёт по своему индексу (sender_id / receiver_id, created_at))
+    с именем второй стороны. Страницы - по курсору (created_at, id) последней строки.
+    """
+    def side(own_column, other_column, direction: str):
+        query = (
+            select(
+                models.Transfer.id,
+                models.Transfer.amount,
+                models.Transfer.created_at,
+                literal(direction).label("direction"),
+                other_column.label("other_user_id"),
+                models.User.username.label("other_username"),
+            )
+            .outerjoin(models.User, models.User.id == other_column)
+            .where(own_column == user_id)
+        )
+        if before_created_at is not None:
+            older = models.Transfer.created_at < before_created_at
+            if before_id is not None:
+                older = or_(older, and_(models.Transfer.created_at == before_created_at, models.Transfer.id < before_id))
+            query = query.where(older)
+        query = query.order_by(models.Transfer.created_at.desc(), models.Transfer.id.desc()).limit(limit)
+        return select(query.subquery(direction))
+
+    history = union_all(
+        side(models.Transfer.sender_id, models.Transfer.receiver_id, "sent"),
+        side(models.Transfer.receiver_id, models.Transfer.sender_id, "received"),
+    ).subquery()
+    return db.execute(
+        select(history).order_by(history.c.created_at.desc(), history.c.id.desc()).limit(limit)
+    ).all()
 
 
 # ─────────────────────────────────────────────────────────────
 # Shop CRUD
 # ─────────────────────────────────────────────────────────────
-def get_shop_item_by_id(db: Session, item_id: int) -> Optional[models.ShopItem]:
-    return db.query(models.ShopItem).filter(models.ShopItem.id == item_id).first()
+def get_shop_item_by_id(db: Session, item_id: int) -> Optional[ShopItemSnapshot]:
+    return get_catalog(db).shop_items_by_id.get(item_id)
 
 
-def get_all_shop_items(db: Session, active_only: bool = True) -> List[models.ShopItem]:
-    query = db.query(models.ShopItem)
+def get_all_shop_items(db: Session, active_only: bool = True) -> List[ShopItemSnapshot]:
+    items = get_catalog(db).shop_items
     if active_only:
-        query = query.filter(models.ShopItem.is_active == True)
-    return query.all()
+        return [item for item in items if item.is_active]
+    return list(items)
 
 
 def create_shop_item(db: Session, item: schemas.ShopItemCreate) -> models.ShopItem:
@@ -255,27 +454,39 @@ def create_shop_item(db: Session, item: schemas.ShopItemCreate) -> models.ShopIt
         ton_price=item.ton_price,
     )
     db.add(db_item)
+    invalidate_catalog(db)
     db.commit()
     db.refresh(db_item)
     return db_item
 
 
-def update_shop_item(db: Session, item: models.ShopItem, data: schemas.ShopItemUpdate) -> models.ShopItem:
+def update_shop_item(db: Session, item: ShopItemSnapshot, data: schemas.ShopItemUpdate) -> Optional[models.ShopItem]:
+    """None, если запись уже удалена (снимок каталога устарел)."""
+    db_item = db.get(models.ShopItem, item.id)
+    if db_item is None:
+        _drop_stale_catalog(db)
+        return None
     for field, value in data.model_dump(exclude_unset=True).items():
-        setattr(item, field, value)
+        setattr(db_item, field, value)
+    invalidate_catalog(db)
     db.commit()
-    db.refresh(item)
-    return item
+    db.refresh(db_item)
+    return db_item
 
 
-def delete_shop_item(db: Session, item: models.ShopItem) -> None:
-    db.delete(item)
+def delete_shop_item(db: Session, item: ShopItemSnapshot) -> None:
+    db_item = db.get(models.ShopItem, item.id)
+    if db_item is None:
+        _drop_stale_catalog(db)  # уже удалена другим запросом
+        return
+    db.delete(db_item)
+    invalidate_catalog(db)
     db.commit()
 
 
-def create_purchase(db: Session, user: models.User, shop_item: models.ShopItem) -> models.Purchase:
+def create_purchase(db: Session, user: models.User, shop_item: ShopItemSnapshot) -> models.Purchase:
     """Создать покупку и начислить кристаллы пользователю."""
-    user.balance += shop_item.crystals
+    _credit(db, user.id, shop_item.crystals)
 
     purchase = models.Purchase(
         user_id=user.id,
@@ -286,6 +497,8 @@ def create_purchase(db: Session, user: models.User, shop_item: models.ShopItem)
     db.add(purchase)
     db.commit()
     db.refresh(purchase)
+    db.refresh(user)
+    leaderboard.update(user)
     return purchase
 
 
@@ -301,22 +514,15 @@ def get_user_purchases(db: Session, user_id: int, limit: int = 50) -> List[model
 from datetime import date, timedelta
 
 
-def get_task_by_id(db: Session, task_id: int) -> Optional[models.Task]:
-    return db.query(models.Task).filter(models.Task.id == task_id).first()
-
-
-def get_all_tasks(db: Session, active_only: bool = True) -> List[models.Task]:
-    query = db.query(models.Task)
-    if active_only:
-        query = query.filter(models.Task.is_active == True)
-    return query.all()
+def get_task_by_id(db: Session, task_id: int) -> Optional[TaskSnapshot]:
+    return get_catalog(db).tasks_by_id.get(task_id)
 
 
-def get_tasks_by_type(db: Session, task_type: str, active_only: bool = True) -> List[models.Task]:
-    query = db.query(models.Task).filter(models.Task.task_type == task_type)
+def get_all_tasks(db: Session, active_only: bool = True) -> List[TaskSnapshot]:
+    tasks = get_catalog(db).tasks
     if active_only:
-        query = query.filter(models.Task.is_active == True)
-    return query.all()
+        return [t for t in tasks if t.is_active]
+    return list(tasks)
 
 
 def create_task(db: Session, task: schemas.TaskCreate) -> models.Task:
@@ -329,21 +535,33 @@ def create_task(db: Session, task: schemas.TaskCreate) -> models.Task:
         description=task.description,
     )
     db.add(db_task)
+    invalidate_catalog(db)
     db.commit()
     db.refresh(db_task)
     return db_task
 
 
-def update_task(db: Session, task: models.Task, data: schemas.TaskUpdate) -> models.Task:
+def update_task(db: Session, task: TaskSnapshot, data: schemas.TaskUpdate) -> Optional[models.Task]:
+    """None, если запись уже удалена (снимок каталога устарел)."""
+    db_task = db.get(models.Task, task.id)
+    if db_task is None:
+        _drop_stale_catalog(db)
+        return None
     for field, value in data.model_dump(exclude_unset=True).items():
-        setattr(task, field, value)
+        setattr(db_task, field, value)
+    invalidate_catalog(db)
     db.commit()
-    db.refresh(task)
-    return task
+    db.refresh(db_task)
+    return db_task
 
 
-def delete_task(db: Session, task: models.Task) -> None:
-    db.delete(task)
+def delete_task(db: Session, task: TaskSnapshot) -> None:
+    db_task = db.get(models.Task, task.id)
+    if db_task is None:
+        _drop_stale_catalog(db)  # уже удалена другим запросом
+        return
+    db.delete(db_task)
+    invalidate_catalog(db)
     db.commit()
 
 
@@ -361,37 +579,70 @@ def get_current_period_start(task_type: str) -> date:
     return today
 
 
-def get_user_task(db: Session, user_id: int, task_id: int) -> Optional[models.UserTask]:
-    return db.query(models.UserTask).filter(
-        models.UserTask.user_id == user_id,
-        models.UserTask.task_id == task_id,
-    ).first()
+def add_action_counts(db: Session, counts: List[tuple]) -> None:
+    """
+    Прибавить (user_id, action_type, amount) к дневным счётчикам одним upsert.
+    Коммит остаётся за вызывающим, чтобы счётчики шли в одной транзакции с начислением.
+    """
+    today = date.today()
+    rows = [
+        {"user_id": user_id, "action_type": action_type, "period_start": today, "value": amount}
+        for user_id, action_type, amount in counts
+        if amount > 0
+    ]
+    if not rows:
+        return
+    stmt = mysql_insert(models.UserActionCounter)
+    db.execute(
+        stmt.on_duplicate_key_update(value=models.UserActionCounter.value + stmt.inserted.value),
+        rows,
+    )
 
 
-def get_or_create_user_task(db: Session, user_id: int, task: models.Task) -> models.UserTask:
-    """Получить или создать прогресс пользователя по заданию для текущего периода."""
-    period_start = get_current_period_start(task.task_type)
-    
-    user_task = db.query(models.UserTask).filter(
+def record_actions(db: Session, counts: List[tuple]) -> None:
+    """Учесть действия игроков для прогресса заданий (один запрос, сколько бы ни было заданий)."""
+    add_action_counts(db, counts)
+    db.commit()
+
+
+def record_action(db: Session, user_id: int, action_type: str, amount: int) -> None:
+    record_actions(db, [(user_id, action_type, amount)])
+
+
+def get_action_progress(db: Session, user_id: int) -> Dict[tuple, int]:
+    """Прогресс игрока за текущие периоды: {(task_type, action_type): value}."""
+    today = get_current_period_start("daily")
+    week_start = get_current_period_start("weekly")
+    progress: Dict[tuple, int] = {}
+    for action_type, period_start, value in db.query(
+        models.UserActionCounter.action_type,
+        models.UserActionCounter.period_start,
+        models.UserActionCounter.value,
+    ).filter(
+        models.UserActionCounter.user_id == user_id,
+        models.UserActionCounter.period_start >= week_start,
+    ):
+        if period_start == today:
+            progress[("daily", action_type)] = value
+        key = ("weekly", action_type)
+        progress[key] = progress.get(key, 0) + value
+    return progress
+
+
+def get_claimed_task_ids(db: Session, user_id: int) -> set:
+    """id заданий, награда за которые уже получена в текущем периоде."""
+    week_start = get_current_period_start("weekly")
+    tasks_by_id = get_catalog(db).tasks_by_id
+    claimed = set()
+    for task_id, period_start in db.query(models.UserTask.task_id, models.UserTask.period_start).filter(
         models.UserTask.user_id == user_id,
-        models.UserTask.task_id == task.id,
-        models.UserTask.period_start == period_start,
-    ).first()
-    
-    if not user_task:
-        user_task = models.UserTask(
-            user_id=user_id,
-            task_id=task.id,
-            progress=0,
-            is_completed=False,
-            is_claimed=False,
-            period_start=period_start,
-        )
-        db.add(user_task)
-        db.commit()
-        db.refresh(user_task)
-    
-    return user_task
+        models.UserTask.period_start >= week_start,
+        models.UserTask.is_claimed.is_(True),
+    ):
+        task = tasks_by_id.get(task_id)
+        if task and period_start == get_current_period_start(task.task_type):
+            claimed.add(task_id)
+    return claimed
 
 
 def get_user_tasks_with_details(db: Session, user_id: int, task_type: Optional[str] = None) -> List[dict]:
@@ -399,10 +650,13 @@ def get_user_tasks_with_details(db: Session, user_id: int, task_type: Optional[s
     tasks = get_all_tasks(db, active_only=True)
     if task_type:
         tasks = [t for t in tasks if t.task_type == task_type]
-    
+
+    progress = get_action_progress(db, user_id)
+    claimed = get_claimed_task_ids(db, user_id)
+
     result = []
     for task in tasks:
-        user_task = get_or_create_user_task(db, user_id, task)
+        value = progress.get((task.task_type, task.action_type), 0)
         result.append({
             "task_id": task.id,
             "task_type": task.task_type,
@@ -411,47 +665,67 @@ def get_user_tasks_with_details(db: Session, user_id: int, task_type: Optional[s
             "description": task.description,
             "target_value": task.target_value,
             "reward": task.reward,
-            "progress": user_task.progress,
-            "is_completed": user_task.is_completed,
-            "is_claimed": user_task.is_claimed,
+            "progress": value,
+            "is_completed": value >= task.target_value,
+            "is_claimed": task.id in claimed,
         })
-    
+
     return result
 
 
-def update_task_progress(db: Session, user_id: int, action_type: str, amount: int) -> None:
-    """Обновить прогресс по всем активным заданиям с указанным action_type."""
-    tasks = db.query(models.Task).filter(
-        models.Task.action_type == action_type,
-        models.Task.is_active == True,
-    ).all()
-    
-    for task in tasks:
-        user_task = get_or_create_user_task(db, user_id, task)
-        
-        if user_task.is_claimed:
-            continue
-        
-        user_task.progress += amount
-        
-        if user_task.progress >= task.target_value:
-            user_task.is_completed = True
-    
-    db.commit()
+def claim_task_reward(db: Session, user: models.User, task: TaskSnapshot) -> Optional[models.UserTask]:
+    """Забрать награду за выполненное задание."""
+    value = get_action_progress(db, user.id).get((task.task_type, task.action_type), 0)
+    if value < task.target_value:
+        return None
 
+    period_start = get_current_period_start(task.task_type)
+    user_task = db.query(models.UserTask).filter(
+        models.UserTask.user_id == user.id,
+        models.UserTask.task_id == task.id,
+        models.UserTask.period_start == period_start,
+    ).first()
+    if user_task and user_task.is_claimed:
+        return None
 
-def claim_task_reward(db: Session, user: models.User, task: models.Task) -> Optional[models.UserTask]:
-    """Забрать награду за выполненное задание."""
-    user_task = get_or_create_user_task(db, user.id, task)
-    
-    if not user_task.is_completed or user_task.is_claimed:
+    if user_task:
+        # Строка от прежней схемы (прогресс в user_tasks) - помечаем, если её не забрали параллельно
+        claimed = db.query(models.UserTask).filter(
+            models.UserTask.id == user_task.id,
+            models.UserTask.is_claimed.is_(False),
+        ).update({
+            models.UserTask.is_claimed: True,
+            models.UserTask.is_completed: True,
+            models.UserTask.progress: value,
+        }, synchronize_session=False)
+        if not claimed:
+            db.rollback()
+            return None
+    else:
+        user_task = models.UserTask(
+            user_id=user.id,
+            task_id=task.id,
+            progress=value,
+            is_completed=True,
+            is_claimed=True,
+            period_start=period_start,
+        )
+        db.add(user_task)
+
+    db.execute(
+        update(models.User)
+        .where(models.User.id == user.id)
+        .values(balance=func.round(models.User.balance + task.reward, 2))
+    )
+    try:
+        db.commit()
+    except IntegrityError:
+        # Параллельный запрос уже забрал награду (уникальный ключ user_tasks)
+        db.rollback()
         return None
-    
-    user.balance += task.reward
-    user_task.is_claimed = True
-    
-    db.commit()
     db.refresh(user_task)
+    db.refresh(user)
+    leaderboard.update(user)
     return user_task
 
 
@@ -466,18 +740,86 @@ def reset_tasks_for_period(db: Session, task_type: str) -> int:
         ),
         models.UserTask.period_start < period_start,
     ).delete(synchronize_session=False)
-    
+
+    if task_type == "weekly":
+        # Дневные счётчики прошлой недели оставляем (итоги недели), старше - удаляем
+        deleted += db.query(models.UserActionCounter).filter(
+            models.UserActionCounter.period_start < period_start - timedelta(days=7),
+        ).delete(synchronize_session=False)
+
     db.commit()
     return deleted
 
 
+# ─────────────────────────────────────────────────────────────
+# Лидерборды за период
+# ─────────────────────────────────────────────────────────────
+PERIOD_LEADERBOARD_SIZE = 100
+
+
+def get_period_bounds(period_type: str, previous: bool = False) -> tuple:
+    """(первый, последний) день текущего или прошлого периода."""
+    start = get_current_period_start(period_type)
+    length = timedelta(days=7 if period_type == "weekly" else 1)
+    if previous:
+        start -= length
+    return start, start + length - timedelta(days=1)
+
+
+def materialize_period_leaderboard(db: Session, period_type: str, previous: bool = False) -> int:
+    """
+    Пересчитать топ «заработано за период» из счётчиков earn и сохранить в
+    leaderboard_snapshots. Возвращает число строк.
+    """
+    first_day, last_day = get_period_bounds(period_type, previous)
+    earned = func.sum(models.UserActionCounter.value)
+    rows = db.query(models.UserActionCounter.user_id, earned).filter(
+        models.UserActionCounter.action_type == "earn",
+        models.UserActionCounter.period_start.between(first_day, last_day),
+    ).group_by(models.UserActionCounter.user_id).order_by(
+        earned.desc(), models.UserActionCounter.user_id
+    ).limit(PERIOD_LEADERBOARD_SIZE).all()
+
+    db.query(models.LeaderboardSnapshot).filter(
+        models.LeaderboardSnapshot.period_type == period_type,
+        models.LeaderboardSnapshot.period_start == first_day,
+    ).delete(synchronize_session=False)
+    db.add_all([
+        models.LeaderboardSnapshot(
+            period_type=period_type,
+            period_start=first_day,
+            rank=rank,
+            user_id=user_id,
+            earned=int(value),
+        )
+        for rank, (user_id, value) in enumerate(rows, start=1)
+    ])
+    db.commit()
+    return len(rows)
+
+
 # ─────────────────────────────────────────────────────────────
 # Admin Settings CRUD
 # ─────────────────────────────────────────────────────────────
+SETTINGS_CACHE = "admin_settings"
+
+
+def _load_admin_settings(db: Session) -> dict:
+    return {name: value for name, value in db.query(models.AdminSettings.name, models.AdminSettings.value)}
+
+
+_settings_cache = VersionedCache(SETTINGS_CACHE, _load_admin_settings)
+
+
 def get_admin_setting(db: Session, name: str) -> Optional[str]:
-    """Получить значение настройки по ключу."""
-    setting = db.query(models.AdminSettings).filter(models.AdminSettings.name == name).first()
-    return setting.value if setting else None
+    """Получить значение настройки по ключу (из кэша, см. app/cache.py)."""
+    return _settings_cache.get(db).get(name)
+
+
+def invalidate_admin_settings(db: Session) -> None:
+    """Сообщить всем воркерам и боту, что настройки изменились. Коммит за вызывающим."""
+    bump_version(db, SETTINGS_CACHE)
+    _settings_cache.invalidate()
 
 
 def set_admin_setting(db: Session, name: str, value: str, description: str = "") -> models.AdminSettings:
@@ -490,6 +832,7 @@ def set_admin_setting(db: Session, name: str, value: str, description: str = "")
     else:
         setting = models.AdminSettings(name=name, value=value, description=description)
         db.add(setting)
+    invalidate_admin_settings(db)
     db.commit()
     db.refresh(setting)
     return setting
@@ -507,9 +850,19 @@ def create_chat_message(db: Session, user_id: int, text: str) -> models.ChatMess
     return msg
 
 
-def get_chat_messages(db: Session, limit: int = 50, before_id: Optional[int] = None) -> List[models.ChatMessage]:
-    """Получить последние сообщения чата."""
-    query = db.query(models.ChatMessage)
+def get_chat_messages(
+    db: Session,
+    limit: int = 50,
+    before_id: Optional[int] = None,
+    after_id: Optional[int] = None,
+) -> List[models.ChatMessage]:
+    """
+    Получить сообщения чата: последние (новые сверху) или, с after_id,
+    первые limit более новых (старые сверху). Авторы грузятся тем же запросом.
+    """
+    query = db.query(models.ChatMessage).options(joinedload(models.ChatMessage.user))
+    if after_id is not None:
+        return query.filter(models.ChatMessage.id > after_id).order_by(models.ChatMessage.id).limit(limit).all()
     if before_id:
         query = query.filter(models.ChatMessage.id < before_id)
     return query.order_by(desc(models.ChatMessage.id)).limit(limit).all()
@@ -0,0 +1,198 @@
+"""
+Асинхронный вариант crud для AsyncSession (aiomysql).
+
+Простые запросы горячего пути (игрок по id / telegram_id, создание, баланс)
+написаны нативно. Составные операции - клики, пассивный доход, покупки,
+задания, каталог - выполняют ту же логику из crud через AsyncSession.run_sync:
+синхронный код работает в greenlet, а SQL всё равно уходит через aiomysql
+в event loop, без пула потоков. Так правила игры остаются в одном месте.
+"""
+import functools
+from typing import Callable, List, Optional
+
+from sqlalchemy import select, update
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql import func
+
+from . import crud, models, schemas
+from .leaderboard import leaderboard
+
+
+def _run_sync(fn: Callable):
+    """Обернуть функцию crud(db, ...) в корутину (db: AsyncSession, ...)."""
+    @functools.wraps(fn)
+    async def wrapper(db: AsyncSession, *args, **kwargs):
+        return await db.run_sync(fn, *args, **kwargs)
+    return wrapper
+
+
+# ─────────────────────────────────────────────────────────────
+# User
+# ─────────────────────────────────────────────────────────────
+async def get_user_by_id(db: AsyncSession, user_id: int) -> Optional[models.User]:
+    return await db.get(models.User, user_id)
+
+
+async def get_user_by_telegram_id(db: AsyncSession, telegram_id: int) -> Optional[models.User]:
+    return await db.scalar(select(models.User).where(models.User.telegram_id == telegram_id))
+
+
+async def get_users(db: AsyncSession, skip: int = 0, limit: int = 100) -> List[models.User]:
+    result = await db.scalars(select(models.User).offset(skip).limit(limit))
+    return list(result)
+
+
+async def create_user(db: AsyncSession, user: schemas.UserCreate) -> models.User:
+    db_user = models.User(
+        telegram_id=user.telegram_id,
+        username=user.username,
+        first_name=user.first_name,
+        last_name=user.last_name,
+        url_image=user.url_image,
+        balance=0,
+    )
+    db.add(db_user)
+    await db.commit()
+    await db.refresh(db_user)
+    leaderboard.update(db_user)
+    return db_user
+
+
+async def upsert_user(db: AsyncSession, telegram_id: int, data: schemas.UserUpsert) -> models.User:
+    """
+    Создать игрока или обновить его профиль одним INSERT ... ON DUPLICATE KEY UPDATE
+    по users.telegram_id. Повторный вызов с теми же данными ничего не меняет.
+    """
+    values = data.model_dump(exclude_unset=True)
+    stmt = mysql_insert(models.User).values(telegram_id=telegram_id, balance=0, **values)
+    # onupdate для ON DUPLICATE KEY UPDATE не срабатывает, updated_at ставим сами
+    updates = {field: stmt.inserted[field] for field in values}
+    updates["updated_at"] = func.now()
+    await db.execute(stmt.on_duplicate_key_update(**updates))
+    await db.commit()
+
+    user = await get_user_by_telegram_id(db, telegram_id)
+    leaderboard.update(user)
+    return user
+
+
+async def update_user(db: AsyncSession, user: models.User, data: schemas.UserUpdate) -> models.User:
+    for field, value in data.model_dump(exclude_unset=True).items():
+        setattr(user, field, value)
+    await db.commit()
+    await db.refresh(user)
+    leaderboard.update(user)
+    return user
+
+
+async def add_balance(db: AsyncSession, user: models.User, amount: float) -> models.User:
+    # Прибавляем на стороне БД, чтобы параллельные запросы не затирали друг друга
+    await db.execute(
+        update(models.User)
+        .where(models.User.id == user.id)
+        .values(balance=func.round(models.User.balance + amount, 2))
+    )
+    await db.commit()
+    await db.refresh(user)
+    leaderboard.update(user)
+    return user
+
+
+async def get_period_leaderboard(db: AsyncSession, period_type: str, previous: bool = False, limit: int = 50) -> List[tuple]:
+    """Готовый лидерборд за период: [(LeaderboardSnapshot, User), ...]."""
+    period_start, _ = crud.get_period_bounds(period_type, previous)
+    result = await db.execute(
+        select(models.LeaderboardSnapshot, models.User)
+        .join(models.User, models.User.id == models.LeaderboardSnapshot.user_id)
+        .where(
+            models.LeaderboardSnapshot.period_type == period_type,
+            models.LeaderboardSnapshot.period_start == period_start,
+        )
+        .order_by(models.LeaderboardSnapshot.rank)
+        .limit(limit)
+    )
+    return list(result.tuples())
+
+
+settle_clicks = _run_sync(crud.settle_clicks)
+accrue_passive_income = _run_sync(crud.accrue_passive_income)
+
+
+# ─────────────────────────────────────────────────────────────
+# Upgrades
+# ─────────────────────────────────────────────────────────────
+get_upgrade_by_id = _run_sync(crud.get_upgrade_by_id)
+get_upgrade_by_key = _run_sync(crud.get_upgrade_by_key)
+get_all_upgrades = _run_sync(crud.get_all_upgrades)
+create_upgrade = _run_sync(crud.create_upgrade)
+update_upgrade = _run_sync(crud.update_upgrade)
+delete_upgrade = _run_sync(crud.delete_upgrade)
+get_user_upgrades = _run_sync(crud.get_user_upgrades)
+buy_upgrade = _run_sync(crud.buy_upgrade)
+
+
+# ─────────────────────────────────────────────────────────────
+# Shop
+# ─────────────────────────────────────────────────────────────
+get_shop_item_by_id = _run_sync(crud.get_shop_item_by_id)
+get_all_shop_items = _run_sync(crud.get_all_shop_items)
+create_purchase = _run_sync(crud.create_purchase)
+
+
+# ─────────────────────────────────────────────────────────────
+# Tasks
+# ─────────────────────────────────────────────────────────────
+get_task_by_id = _run_sync(crud.get_task_by_id)
+get_all_tasks = _run_sync(crud.get_all_tasks)
+create_task = _run_sync(crud.create_task)
+update_task = _run_sync(crud.update_task)
+delete_task = _run_sync(crud.delete_task)
+get_user_tasks_with_details = _run_sync(crud.get_user_tasks_with_details)
+record_action = _run_sync(crud.record_action)
+record_actions = _run_sync(crud.record_actions)
+claim_task_reward = _run_sync(crud.claim_task_reward)
+reset_tasks_for_period = _run_sync(crud.reset_tasks_for_period)
+
+
+# ─────────────────────────────────────────────────────────────
+# Chat
+# ─────────────────────────────────────────────────────────────
+create_chat_message = _run_sync(crud.create_chat_message)
+get_chat_messages = _run_sync(crud.get_chat_messages)
+
+
+async def get_chat_feed(
+    db: AsyncSession,
+    limit: int = 50,
+    before_id: Optional[int] = None,
+    after_id: Optional[int] = None,
+) -> List[schemas.ChatMessageOut]:
+    """
+    Сообщения вместе с полями автора одним запросом, старые сверху:
+    первые limit после after_id или последние limit (до before_id).
+    Число запросов не зависит от того, сколько разных игроков писали.
+    """
+    query = (
+        select(
+            models.ChatMessage.id,
+            models.ChatMessage.user_id,
+            models.User.username,
+            models.User.first_name,
+            models.User.url_image,
+            models.ChatMessage.text,
+            models.ChatMessage.created_at,
+        )
+        .outerjoin(models.User, models.User.id == models.ChatMessage.user_id)
+    )
+    if after_id is not None:
+        query = query.where(models.ChatMessage.id > after_id).order_by(models.ChatMessage.id).limit(limit)
+    else:
+        if before_id:
+            query = query.where(models.ChatMessage.id < before_id)
+        query = query.order_by(models.ChatMessage.id.desc()).limit(limit)
+
+    rows = (await db.execute(query)).all()
+    if after_id is None:
+        rows.reverse()
+    return [schemas.ChatMessageOut(**row._mapping) for row in rows]
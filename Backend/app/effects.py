@@ -0,0 +1,155 @@
+"""
+Характеристики игрока, которые дают улучшения.
+
+Каждое улучшение (key, value_per_level) компилируется в эффект: какой
+характеристике и сколько добавляет один уровень. Итоговые click_power,
+passive_rate и max_energy хранятся прямо в строке users и пересчитываются
+только при покупке улучшения или при правке улучшений/click_value админом,
+поэтому горячий путь (клик, пассивный доход) читает одну строку.
+"""
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Tuple
+
+from sqlalchemy import bindparam, case, update
+from sqlalchemy.orm import Session
+
+from .catalog import UpgradeSnapshot
+from . import crud, models
+
+
+# Какую характеристику игрока увеличивает каждый уровень улучшения
+UPGRADE_STATS = {
+    "click": "click_power",       # доход за клик
+    "autoclick": "passive_rate",  # автокликов в секунду
+    "megaclick": "passive_rate",
+    "superclick": "passive_rate",
+    "maxEnergy": "max_energy",
+}
+
+BASE_MAX_ENERGY = 100
+
+
+@dataclass(frozen=True)
+class Effect:
+    stat: str
+    per_level: float
+
+
+def compile_effects(upgrades: Iterable[UpgradeSnapshot]) -> Dict[int, Effect]:
+    """Эффекты по id улучшения. Улучшения без известной характеристики пропускаются."""
+    effects = {}
+    for upgrade in upgrades:
+        stat = UPGRADE_STATS.get(upgrade.key)
+        if stat:
+            effects[upgrade.id] = Effect(stat=stat, per_level=upgrade.value_per_level or 1.0)
+    return effects
+
+
+def get_base_stats(db: Session) -> Dict[str, float]:
+    """Характеристики игрока без улучшений."""
+    return {
+        # Базовое значение клика из админ-настроек (по умолчанию 1)
+        "click_power": float(crud.get_admin_setting(db, "click_value") or "1"),
+        "passive_rate": 0.0,
+        "max_energy": BASE_MAX_ENERGY,
+    }
+
+
+def compute_stats(base: Dict[str, float], effects: Dict[int, Effect], levels: Iterable[Tuple[int, int]]) -> Dict[str, float]:
+    """Сложить базу и вклад уровней (upgrade_id, level)."""
+    stats = dict(base)
+    for upgrade_id, level in levels:
+        effect = effects.get(upgrade_id)
+        if effect:
+            stats[effect.stat] += level * effect.per_level
+    stats["max_energy"] = int(round(stats["max_energy"]))
+    return stats
+
+
+def recompute_user_stats(db: Session, user: models.User) -> models.User:
+    """Пересчитать характеристики одного игрока (после покупки улучшения)."""
+    effects = compile_effects(crud.get_all_upgrades(db))
+    levels = [(uu.upgrade_id, uu.level) for uu in crud.get_user_upgrades(db, user.id)]
+    stats = compute_stats(get_base_stats(db), effects, levels)
+
+    if stats["max_energy"] != user.max_energy:
+        # Фиксируем энергию по старому максимуму, иначе новый максимум
+        # задним числом «восстановил» бы энергию за прошедшее время
+        user.energy, user.last_energy_update = crud.calc_regenerated_energy(
+            user.energy, user.max_energy, user.last_energy_update, datetime.now(timezone.utc)
+        )
+
+    user.click_power = stats["click_power"]
+    user.passive_rate = stats["passive_rate"]
+    user.max_energy = stats["max_energy"]
+    db.commit()
+    db.refresh(user)
+    return user
+
+
+def ensure_user_stats(db: Session, user: models.User) -> models.User:
+    """Досчитать характеристики игрокам, у которых их ещё нет (до первой покупки)."""
+    if user.click_power is None or user.passive_rate is None:
+        return recompute_user_stats(db, user)
+    return user
+
+
+def recompute_all_user_stats(db: Session, chunk_size: int = 1000) -> int:
+    """
+    Пересчитать характеристики всех игроков пачками по chunk_size
+    (после правки улучшений или click_value). Возвращает число игроков.
+    """
+    effects = compile_effects(crud.get_all_upgrades(db))
+    base = get_base_stats(db)
+
+    # Там, где меняется max_energy, сначала фиксируем энергию по старому максимуму.
+    # MySQL выполняет SET слева направо, поэтому energy считается до смены max_energy.
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    max_changed = models.User.max_energy != bindparam("new_max_energy")
+    stmt = (
+        update(models.User)
+        .where(models.User.id == bindparam("uid"))
+        .ordered_values(
+            (models.User.energy, case((max_changed, crud.regenerated_energy_expr(now)), else_=models.User.energy)),
+            (models.User.last_energy_update, case((max_changed, now), else_=models.User.last_energy_update)),
+            (models.User.click_power, bindparam("new_click_power")),
+            (models.User.passive_rate, bindparam("new_passive_rate")),
+            (models.User.max_energy, bindparam("new_max_energy")),
+        )
+    )
+
+    total = 0
+    last_id = 0
+    while True:
+        user_ids: List[int] = [
+            row.id for row in db.query(models.User.id)
+            .filter(models.User.id > last_id)
+            .order_by(models.User.id)
+            .limit(chunk_size)
+        ]
+        if not user_ids:
+            break
+
+        levels: Dict[int, List[Tuple[int, int]]] = {uid: [] for uid in user_ids}
+        for user_id, upgrade_id, level in db.query(
+            models.UserUpgrade.user_id, models.UserUpgrade.upgrade_id, models.UserUpgrade.level
+        ).filter(models.UserUpgrade.user_id.in_(user_ids)):
+            levels[user_id].append((upgrade_id, level))
+
+        params = []
+        for uid in user_ids:
+            stats = compute_stats(base, effects, levels[uid])
+            params.append({
+                "uid": uid,
+                "new_click_power": stats["click_power"],
+                "new_passive_rate": stats["passive_rate"],
+                "new_max_energy": stats["max_energy"],
+            })
+        db.connection().execute(stmt, params)
+        db.commit()
+
+        total += len(user_ids)
+        last_id = user_ids[-1]
+
+    return total
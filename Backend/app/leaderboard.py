@@ -0,0 +1,152 @@
+"""
+In-memory лидерборд по балансу.
+
+Игроки лежат в SortedList по ключу (-balance, id), поэтому топ-N, место игрока
+и окно «соседей» считаются за O(log n) без ORDER BY по всей таблице users.
+
+Структура заполняется из БД при старте воркера и обновляется точечно из crud
+при каждом изменении баланса (клики, пассивный доход, покупки, переводы,
+улучшения, награды). Изменения, сделанные другими воркерами и ботом,
+подтягиваются периодической сверкой по users.updated_at (см. app/scheduler.py),
+а полная пересборка раз в час убирает удалённых игроков.
+"""
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, List, NamedTuple, Optional
+
+from sortedcontainers import SortedList
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import func
+
+from . import models
+
+# Запас при сверке: DATETIME хранит секунды, а коммит мог отстать от NOW()
+SYNC_OVERLAP = timedelta(seconds=5)
+
+
+class LeaderboardEntry(NamedTuple):
+    id: int
+    telegram_id: int
+    username: Optional[str]
+    first_name: Optional[str]
+    url_image: Optional[str]
+    balance: float
+
+
+def _entry(user) -> LeaderboardEntry:
+    return LeaderboardEntry(
+        id=user.id,
+        telegram_id=user.telegram_id,
+        username=user.username,
+        first_name=user.first_name,
+        url_image=user.url_image,
+        balance=float(user.balance or 0),
+    )
+
+
+def _key(entry: LeaderboardEntry) -> tuple:
+    return (-entry.balance, entry.id)
+
+
+_COLUMNS = (
+    models.User.id,
+    models.User.telegram_id,
+    models.User.username,
+    models.User.first_name,
+    models.User.url_image,
+    models.User.balance,
+)
+
+
+class Leaderboard:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._order = SortedList()
+        self._entries: Dict[int, LeaderboardEntry] = {}
+        self._synced_at: Optional[datetime] = None
+
+    # ── обновления ───────────────────────────────────────────
+    def update(self, user) -> None:
+        """Записать текущий баланс и имя игрока (объект User или строка с теми же полями)."""
+        entry = _entry(user)
+        with self._lock:
+            self._put(entry)
+
+    def remove(self, user_id: int) -> None:
+        with self._lock:
+            old = self._entries.pop(user_id, None)
+            if old:
+                self._order.remove(_key(old))
+
+    def _put(self, entry: LeaderboardEntry) -> None:
+        old = self._entries.get(entry.id)
+        if old == entry:
+            return
+        if old:
+            self._order.remove(_key(old))
+        self._entries[entry.id] = entry
+        self._order.add(_key(entry))
+
+    # ── сверка с БД ──────────────────────────────────────────
+    def load(self, db: Session) -> int:
+        """Полностью пересобрать лидерборд из БД. Возвращает число игроков."""
+        synced_at = db.scalar(select(func.now()))
+        entries = {row.id: _entry(row) for row in db.execute(select(*_COLUMNS))}
+        order = SortedList(_key(entry) for entry in entries.values())
+        with self._lock:
+            self._entries = entries
+            self._order = order
+            self._synced_at = synced_at
+        return len(entries)
+
+    def sync(self, db: Session) -> int:
+        """Подтянуть игроков, изменённых с прошлой сверки. Возвращает их число."""
+        if self._synced_at is None:
+            return self.load(db)
+        synced_at = db.scalar(select(func.now()))
+        rows = db.execute(
+            select(*_COLUMNS).where(models.User.updated_at >= self._synced_at - SYNC_OVERLAP)
+        ).all()
+        with self._lock:
+            for row in rows:
+                self._put(_entry(row))
+            self._synced_at = synced_at
+        return len(rows)
+
+    # ── чтение ───────────────────────────────────────────────
+    def top(self, limit: int) -> List[LeaderboardEntry]:
+        with self._lock:
+            return [self._entries[user_id] for _, user_id in self._order.islice(0, limit)]
+
+    def rank(self, user_id: int) -> Optional[int]:
+        """Место игрока (с 1) или None, если его нет."""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            return self._order.bisect_left(_key(entry)) + 1
+
+    def around(self, user_id: int, radius: int) -> List[tuple]:
+        """Игрок и до radius соседей сверху и снизу: [(место, запись), ...]."""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return []
+            index = self._order.bisect_left(_key(entry))
+            start = max(index - radius, 0)
+            return [
+                (start + offset + 1, self._entries[uid])
+                for offset, (_, uid) in enumerate(self._order.islice(start, index + radius + 1))
+            ]
+
+    def get(self, user_id: int) -> Optional[LeaderboardEntry]:
+        with self._lock:
+            return self._entries.get(user_id)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._order)
+
+
+leaderboard = Leaderboard()
@@ -3,46 +3,18 @@ from fastapi.middleware.cors import CORSMiddleware
 from starlette.middleware.sessions import SessionMiddleware
 from starlette.types import ASGIApp, Receive, Scope, Send
 
-from sqlalchemy import text
+import anyio.to_thread
 
-from .database import engine, Base
-from .routers import users, upgrades, transfers, shop, tasks, stars, settings, chat
+from .database import engine, async_engine, pool_status
+from .routers import users, upgrades, transfers, shop, tasks, stars, settings, chat, avatars
 from .scheduler import start_scheduler, stop_scheduler
+from .click_buffer import click_buffer
+from .leaderboard import leaderboard
+from .chat_hub import chat_hub
 from .admin import setup_admin
 from . import crud, schemas
 from .database import SessionLocal
-
-# Миграция: добавляем новые колонки к существующим таблицам
-with engine.connect() as conn:
-    try:
-        conn.execute(text("ALTER TABLE shop_items ADD COLUMN ton_price FLOAT DEFAULT NULL"))
-        conn.commit()
-    except Exception:
-        conn.rollback()  # колонка уже существует — игнорируем
-
-    # Задаём ton_price для товаров, где он не установлен (stars * 0.1 TON)
-    try:
-        conn.execute(text("UPDATE shop_items SET ton_price = stars * 0.1 WHERE ton_price IS NULL"))
-        conn.commit()
-    except Exception:
-        conn.rollback()
-
-    # Миграция: balance из BIGINT в DOUBLE для дробных значений
-    try:
-        conn.execute(text("ALTER TABLE users MODIFY COLUMN balance DOUBLE DEFAULT 0.0"))
-        conn.commit()
-    except Exception:
-        conn.rollback()
-
-    # Миграция: value_per_level для улучшений (сколько даёт каждый уровень)
-    try:
-        conn.execute(text("ALTER TABLE upgrades ADD COLUMN value_per_level DOUBLE NOT NULL DEFAULT 1.0"))
-        conn.commit()
-    except Exception:
-        conn.rollback()
-
-# Создаём новые таблицы при старте (chat_messages, etc.)
-Base.metadata.create_all(bind=engine)
+from .config import get_settings
 
 app = FastAPI(
     title="Clicker Diamond API",
@@ -100,6 +72,14 @@ app.include_router(tasks.router)
 app.include_router(stars.router)
 app.include_router(settings.router)
 app.include_router(chat.router)
+app.include_router(avatars.router)
+
+
+@app.on_event("startup")
+async def configure_threadpool():
+    """Пул потоков для sync-роутеров: лишние потоки всё равно ждали бы соединение из пула."""
+    limiter = anyio.to_thread.current_default_thread_limiter()
+    limiter.total_tokens = get_settings().THREADPOOL_SIZE
 
 
 @app.on_event("startup")
@@ -150,20 +130,50 @@ def on_startup():
         if not existing_click_value:
             crud.set_admin_setting(db, "click_value", "0.5", "Базовое значение за клик (без улучшений)")
 
+        # Лидерборд в памяти (дальше обновляется из crud и сверкой в планировщике)
+        print(f"[Leaderboard] Loaded {leaderboard.load(db)} users")
+
     finally:
         db.close()
 
     # Запускаем планировщик
     start_scheduler()
 
+    # Доигрываем журналы упавших воркеров и запускаем сброс кликов
+    click_buffer.start()
+
+
+@app.on_event("startup")
+async def start_chat_hub():
+    """Буфер последних сообщений чата и подтягивание сообщений других воркеров."""
+    await chat_hub.start()
+
 
 @app.on_event("shutdown")
-def on_shutdown():
-    """Остановка планировщика при завершении."""
+async def on_shutdown():
+    """Остановка планировщика, сброс буфера кликов и закрытие пула async-соединений."""
     stop_scheduler()
+    click_buffer.stop()
+    await chat_hub.stop()
+    await async_engine.dispose()
 
 
 @app.get("/", tags=["Health"])
 def health_check():
     """Проверка работоспособности API."""
     return {"status": "ok", "message": "Clicker Diamond API is running"}
+
+
+@app.get("/health/pool", tags=["Health"])
+async def pool_health():
+    """Состояние пулов соединений и пула потоков этого воркера."""
+    limiter = anyio.to_thread.current_default_thread_limiter()
+    return {
+        "sync_pool": pool_status(engine.pool),
+        "async_pool": pool_status(async_engine.pool),
+        "threadpool": {
+            "total": limiter.total_tokens,
+            "busy": limiter.borrowed_tokens,
+            "waiting": limiter.statistics().tasks_waiting,
+        },
+    }
@@ -0,0 +1,128 @@
+"""
+Версионные миграции схемы БД.
+
+Запускаются один раз отдельным шагом перед стартом воркеров:
+
+    python -m app.migrate
+
+1. Под advisory-блокировкой MySQL (GET_LOCK) - параллельный запуск ждёт.
+2. Base.metadata.create_all создаёт недостающие таблицы (чистая БД сразу
+   получает актуальную схему).
+3. Файлы migrations/NNN_*.sql, которых ещё нет в schema_version, выполняются
+   по порядку номеров; после каждого файла номер записывается в schema_version.
+
+Ошибки «колонка / индекс / таблица уже есть» пропускаются: create_all на чистой
+БД и прежние ALTER при старте приложения уже могли сделать то же самое.
+Любая другая ошибка останавливает миграции.
+"""
+import os
+import re
+from typing import List, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+
+from .database import engine, Base
+from . import models  # noqa: F401 - регистрирует модели в Base.metadata
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "migrations")
+LOCK_NAME = "clicker_diamond_migrations"
+LOCK_TIMEOUT_SECONDS = 600
+
+# Duplicate column name, Duplicate key name, Table already exists
+IGNORED_ERRORS = {1060, 1061, 1050}
+
+_FILE_RE = re.compile(r"^(\d+)_.+\.sql$")
+
+
+def list_migrations() -> List[Tuple[int, str]]:
+    """(номер, имя файла) по возрастанию номера."""
+    found = []
+    for name in os.listdir(MIGRATIONS_DIR):
+        match = _FILE_RE.match(name)
+        if match:
+            found.append((int(match.group(1)), name))
+    found.sort()
+    versions = [version for version, _ in found]
+    if len(versions) != len(set(versions)):
+        raise RuntimeError(f"Duplicate migration numbers in {MIGRATIONS_DIR}")
+    return found
+
+
+def split_statements(sql: str) -> List[str]:
+    """Разбить файл на запросы по ';' в конце строки, без комментариев '--'."""
+    statements, current = [], []
+    for line in sql.splitlines():
+        stripped = line.strip()
+        if not stripped or stripped.startswith("--"):
+            continue
+        current.append(line)
+        if stripped.endswith(";"):
+            statements.append("\n".join(current).rstrip().rstrip(";"))
+            current = []
+    if current:
+        statements.append("\n".join(current))
+    return statements
+
+
+def _error_code(e: DBAPIError):
+    args = getattr(e.orig, "args", None)
+    return args[0] if args else None
+
+
+def _apply(conn, version: int, name: str) -> None:
+    with open(os.path.join(MIGRATIONS_DIR, name), encoding="utf-8") as f:
+        statements = split_statements(f.read())
+    for statement in statements:
+        try:
+            conn.execute(text(statement))
+            conn.commit()
+        except DBAPIError as e:
+            conn.rollback()
+            if _error_code(e) not in IGNORED_ERRORS:
+                raise
+            print(f"[Migrate] {name}: skipped ({e.orig})")
+    conn.execute(
+        text("INSERT INTO schema_version (version, name) VALUES (:version, :name)"),
+        {"version": version, "name": name},
+    )
+    conn.commit()
+
+
+def migrate() -> int:
+    """Применить недостающие миграции. Возвращает число применённых."""
+    with engine.connect() as conn:
+        acquired = conn.execute(
+            text("SELECT GET_LOCK(:name, :timeout)"),
+            {"name": LOCK_NAME, "timeout": LOCK_TIMEOUT_SECONDS},
+        ).scalar()
+        if acquired != 1:
+            raise RuntimeError("Could not acquire migration lock")
+        try:
+            conn.execute(text(
+                "CREATE TABLE IF NOT EXISTS schema_version ("
+                " version INT NOT NULL PRIMARY KEY,"
+                " name VARCHAR(255) NOT NULL,"
+                " applied_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP"
+                ")"
+            ))
+            conn.commit()
+
+            Base.metadata.create_all(bind=conn)
+            conn.commit()
+
+            applied = {row[0] for row in conn.execute(text("SELECT version FROM schema_version"))}
+            pending = [(version, name) for version, name in list_migrations() if version not in applied]
+            for version, name in pending:
+                print(f"[Migrate] Applying {name}")
+                _apply(conn, version, name)
+
+            print(f"[Migrate] Schema is up to date ({len(pending)} applied)")
+            return len(pending)
+        finally:
+            conn.execute(text("SELECT RELEASE_LOCK(:name)"), {"name": LOCK_NAME})
+            conn.commit()
+
+
+if __name__ == "__main__":
+    migrate()
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, BigInteger, String, DateTime, ForeignKey, Text, Boolean, Date, Float
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, ForeignKey, Text, Boolean, Date, Float, Index, UniqueConstraint
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 
@@ -10,22 +10,35 @@ class User(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     telegram_id = Column(BigInteger, unique=True, nullable=False, index=True)
-    username = Column(String(255), nullable=True)
+    username = Column(String(255), nullable=True, index=True)  # поиск получателя перевода
     first_name = Column(String(255), nullable=True)
     last_name = Column(String(255), nullable=True)
     url_image = Column(Text, nullable=True)
-    balance = Column(Float, default=0.0, nullable=False)
+    balance = Column(Float, default=0.0, nullable=False, index=True)  # лидерборд
     energy = Column(Integer, default=100, nullable=False)
     max_energy = Column(Integer, default=100, nullable=False)
+    click_power = Column(Float, nullable=True)  # доход за клик с учётом улучшений (см. app/effects.py)
+    passive_rate = Column(Float, nullable=True)  # автокликов в секунду с учётом улучшений
     last_energy_update = Column(DateTime(timezone=True), server_default=func.now())
+    passive_accrued_at = Column(DateTime(timezone=True), server_default=func.now())  # до какого момента начислен пассивный доход
     created_at = Column(DateTime(timezone=True), server_default=func.now())
-    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), index=True)  # сверка лидерборда
 
     upgrades = relationship("UserUpgrade", back_populates="user")
     transfers_sent = relationship("Transfer", foreign_keys="Transfer.sender_id", back_populates="sender")
     transfers_received = relationship("Transfer", foreign_keys="Transfer.receiver_id", back_populates="receiver")
 
 
+class UserAvatar(Base):
+    """Миниатюра аватара игрока в локальном хранилище (см. app/avatars.py)."""
+    __tablename__ = "user_avatars"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    file_unique_id = Column(String(64), nullable=True)  # фото профиля в Telegram; None - фото нет
+    hash = Column(String(64), nullable=True, index=True)  # имя файла миниатюры (sha256 содержимого)
+    fetched_at = Column(DateTime(timezone=True), nullable=True, index=True)  # когда сверяли с Telegram
+
+
 class Upgrade(Base):
     __tablename__ = "upgrades"
 
@@ -44,6 +57,9 @@ class Upgrade(Base):
 
 class UserUpgrade(Base):
     __tablename__ = "user_upgrades"
+    __table_args__ = (
+        UniqueConstraint("user_id", "upgrade_id", name="uq_user_upgrades_user_upgrade"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
@@ -57,6 +73,11 @@ class UserUpgrade(Base):
 
 class Transfer(Base):
     __tablename__ = "transfers"
+    __table_args__ = (
+        # История переводов: отправленные и полученные по отдельности, новые сверху
+        Index("ix_transfers_sender_created", "sender_id", "created_at"),
+        Index("ix_transfers_receiver_created", "receiver_id", "created_at"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     sender_id = Column(Integer, ForeignKey("users.id", ondelete="SET NULL"), nullable=True)
@@ -85,6 +106,9 @@ class ShopItem(Base):
 class Purchase(Base):
     """История покупок в донатном магазине."""
     __tablename__ = "purchases"
+    __table_args__ = (
+        Index("ix_purchases_user_created", "user_id", "created_at"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
@@ -120,6 +144,9 @@ class Task(Base):
 class UserTask(Base):
     """Прогресс пользователя по заданию."""
     __tablename__ = "user_tasks"
+    __table_args__ = (
+        UniqueConstraint("user_id", "task_id", "period_start", name="uq_user_tasks_user_task_period"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
@@ -134,12 +161,49 @@ class UserTask(Base):
     task = relationship("Task", back_populates="user_tasks")
 
 
+class UserActionCounter(Base):
+    """
+    Сколько игрок сделал действий action_type за день.
+    Прогресс заданий считается из этих счётчиков (недельный - суммой за дни недели),
+    а строка user_tasks появляется только при получении награды.
+    """
+    __tablename__ = "user_action_counters"
+    __table_args__ = (
+        # Итоги периода по всем игрокам (лидерборды «заработано за день / неделю»)
+        Index("ix_user_action_counters_action_period", "action_type", "period_start"),
+    )
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    action_type = Column(String(50), primary_key=True)  # "click", "earn", "transfer", "buy_upgrade"
+    period_start = Column(Date, primary_key=True)  # день
+    value = Column(BigInteger, default=0, nullable=False)
+
+
+class LeaderboardSnapshot(Base):
+    """
+    Готовый лидерборд «заработано за период» (daily / weekly).
+    Пересчитывается планировщиком из счётчиков earn и замораживается в конце периода.
+    """
+    __tablename__ = "leaderboard_snapshots"
+
+    period_type = Column(String(20), primary_key=True)  # "daily" или "weekly"
+    period_start = Column(Date, primary_key=True)
+    rank = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    earned = Column(BigInteger, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
 # ─────────────────────────────────────────────────────────────
 # Stars Pending Payments (для хранения ожидающих платежей)
 # ─────────────────────────────────────────────────────────────
 class StarsPending(Base):
     """Ожидающие платежи через Telegram Stars."""
     __tablename__ = "stars_pending"
+    __table_args__ = (
+        # Последний pending-платёж игрока
+        Index("ix_stars_pending_user_status_created", "user_id", "status", "created_at"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
@@ -167,6 +231,14 @@ class AdminSettings(Base):
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 
 
+class CacheVersion(Base):
+    """Версии in-process кэшей (admin_settings и др.) для инвалидации во всех воркерах и боте."""
+    __tablename__ = "cache_versions"
+
+    name = Column(String(50), primary_key=True)
+    version = Column(BigInteger, default=0, nullable=False)
+
+
 # ─────────────────────────────────────────────────────────────
 # Внутриигровой чат
 # ─────────────────────────────────────────────────────────────
@@ -180,3 +252,72 @@ class ChatMessage(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     user = relationship("User")
+
+
+# ─────────────────────────────────────────────────────────────
+# Write-behind буфер кликов
+# ─────────────────────────────────────────────────────────────
+class ClickFlush(Base):
+    """Сегменты журнала кликов, уже применённые к БД (защита от двойного доигрывания)."""
+    __tablename__ = "click_flushes"
+
+    segment = Column(String(100), primary_key=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+# ─────────────────────────────────────────────────────────────
+# Рассылки бота
+# ─────────────────────────────────────────────────────────────
+class BroadcastJob(Base):
+    """
+    Рассылка из /send. Получатели разбиты на диапазоны users.id (broadcast_chunks),
+    которые разбирают процессы бота (см. bot/jobs.py).
+    """
+    __tablename__ = "broadcast_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    status = Column(String(20), default="running", nullable=False, index=True)  # running, done
+    content = Column(Text, nullable=False)  # JSON: текст, кнопки, file_id медиа
+    admin_chat_id = Column(BigInteger, nullable=False)
+    status_message_id = Column(Integer, nullable=True)  # сообщение админу с прогрессом
+    total = Column(Integer, default=0, nullable=False)
+    reported_at = Column(DateTime(timezone=True), nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+
+class BroadcastChunk(Base):
+    """
+    Диапазон получателей рассылки (users.id из (start_id, end_id]).
+    cursor_id - последний обработанный users.id: после падения процесса
+    диапазон дорабатывается с него, когда истечёт аренда claimed_at.
+    """
+    __tablename__ = "broadcast_chunks"
+    __table_args__ = (
+        Index("ix_broadcast_chunks_job_status", "job_id", "status"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    job_id = Column(Integer, ForeignKey("broadcast_jobs.id", ondelete="CASCADE"), nullable=False)
+    start_id = Column(Integer, nullable=False)
+    end_id = Column(Integer, nullable=False)
+    cursor_id = Column(Integer, nullable=False)
+    status = Column(String(20), default="pending", nullable=False)  # pending, running, done
+    worker = Column(String(100), nullable=True)
+    claimed_at = Column(DateTime(timezone=True), nullable=True)
+    sent = Column(Integer, default=0, nullable=False)
+    blocked = Column(Integer, default=0, nullable=False)
+    failed = Column(Integer, default=0, nullable=False)
+
+
+# ─────────────────────────────────────────────────────────────
+# Состояния диалогов бота
+# ─────────────────────────────────────────────────────────────
+class BotFsmState(Base):
+    """FSM aiogram, общий для всех реплик бота в webhook-режиме (см. bot/fsm.py)."""
+    __tablename__ = "bot_fsm_states"
+
+    storage_key = Column(String(255), primary_key=True)  # бот:чат:пользователь:тред:бизнес:destiny
+    state = Column(String(255), nullable=True)
+    data = Column(Text, nullable=True)  # JSON
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
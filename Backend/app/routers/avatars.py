@@ -0,0 +1,31 @@
+from fastapi import APIRouter, Header, HTTPException, Response
+from fastapi.responses import FileResponse
+from typing import Optional
+import os
+
+from ..avatars import avatar_path, is_avatar_name
+
+router = APIRouter(prefix="/avatars", tags=["Avatars"])
+
+# Имя файла - хэш содержимого: по одной ссылке всегда одна и та же картинка
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+@router.get("/{name}")
+def get_avatar(name: str, if_none_match: Optional[str] = Header(None)):
+    """Миниатюра аватара из локального хранилища."""
+    digest, _, ext = name.partition(".")
+    if ext != "jpg" or not is_avatar_name(digest):
+        raise HTTPException(status_code=404, detail="Avatar not found")
+
+    etag = f'"{digest}"'
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+    if if_none_match:
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        if "*" in tags or etag in tags or f"W/{etag}" in tags:
+            return Response(status_code=304, headers=headers)
+
+    path = avatar_path(digest)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Avatar not found")
+    return FileResponse(path, media_type="image/jpeg", headers=headers)
@@ -1,46 +1,63 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
-from sqlalchemy.orm import Session
-from typing import List, Optional
+import asyncio
+import json
 
-from ..database import get_db
-from .. import crud, schemas
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import AsyncIterator, List, Optional
+
+from ..chat_hub import chat_hub
+from ..config import get_settings
+from ..database import get_async_db
+from .. import crud_async, schemas
 
 router = APIRouter(prefix="/chat", tags=["Chat"])
 
+# Сколько сообщений отдать в событии reset (столько же клиент грузит при открытии)
+RESET_LIMIT = 50
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags or etag[2:] in tags
+
 
 @router.get("/messages", response_model=List[schemas.ChatMessageOut])
-def get_messages(
+async def get_messages(
+    response: Response,
     limit: int = Query(50, le=100),
     before_id: Optional[int] = None,
-    db: Session = Depends(get_db),
+    after_id: Optional[int] = None,
+    if_none_match: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    """Получить последние сообщения чата."""
-    messages = crud.get_chat_messages(db, limit=limit, before_id=before_id)
-    # Разворачиваем, чтобы старые были сверху
-    messages.reverse()
-
-    result = []
-    for msg in messages:
-        result.append(schemas.ChatMessageOut(
-            id=msg.id,
-            user_id=msg.user_id,
-            username=msg.user.username if msg.user else None,
-            first_name=msg.user.first_name if msg.user else None,
-            url_image=msg.user.url_image if msg.user else None,
-            text=msg.text,
-            created_at=msg.created_at,
-        ))
-    return result
+    """
+    Получить последние сообщения чата или, с after_id, только более новые.
+    Свежие страницы отдаются из памяти воркера с ETag по последнему id:
+    если новых сообщений нет, ответ - 304 без обращения к БД.
+    """
+    if before_id is None:
+        messages = chat_hub.read(limit, after_id)
+        if messages is not None:
+            # no-cache: браузер хранит ответ, но каждый раз переспрашивает с If-None-Match
+            headers = {"ETag": chat_hub.etag(), "Cache-Control": "no-cache"}
+            if _etag_matches(if_none_match, headers["ETag"]):
+                return Response(status_code=304, headers=headers)
+            response.headers.update(headers)
+            return messages
+    return await crud_async.get_chat_feed(db, limit=limit, before_id=before_id, after_id=after_id)
 
 
 @router.post("/messages/{user_id}", response_model=schemas.ChatMessageOut, status_code=201)
-def send_message(
+async def send_message(
     user_id: int,
     body: schemas.ChatMessageCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
     """Отправить сообщение в чат."""
-    user = crud.get_user_by_id(db, user_id)
+    user = await crud_async.get_user_by_id(db, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
@@ -50,9 +67,9 @@ def send_message(
     if len(text) > 500:
         raise HTTPException(status_code=400, detail="Message too long (max 500)")
 
-    msg = crud.create_chat_message(db, user_id=user.id, text=text)
+    msg = await crud_async.create_chat_message(db, user_id=user.id, text=text)
 
-    return schemas.ChatMessageOut(
+    out = schemas.ChatMessageOut(
         id=msg.id,
         user_id=msg.user_id,
         username=user.username,
@@ -61,3 +78,88 @@ def send_message(
         text=msg.text,
         created_at=msg.created_at,
     )
+    chat_hub.publish(out)
+    return out
+
+
+# ─────────────────────────────────────────────────────────────
+# Поток новых сообщений (Server-Sent Events)
+# ─────────────────────────────────────────────────────────────
+def _message_event(message: dict) -> str:
+    return f"id: {message['id']}\ndata: {json.dumps(message, ensure_ascii=False)}\n\n"
+
+
+def _reset_event() -> str:
+    messages = chat_hub.recent(RESET_LIMIT)
+    last_id = messages[-1]["id"] if messages else chat_hub.high_water
+    return f"id: {last_id}\nevent: reset\ndata: {json.dumps(messages, ensure_ascii=False)}\n\n"
+
+
+async def _event_stream(request: Request, last_id: Optional[int]) -> AsyncIterator[str]:
+    keepalive = get_settings().CHAT_KEEPALIVE_SECONDS
+    # Подписка и чтение буфера идут без await между ними: в очередь попадёт
+    # только то, чего в отданном хвосте буфера ещё не было
+    sub = chat_hub.subscribe()
+    try:
+        if last_id is None:
+            sent_id = chat_hub.high_water
+            yield f"id: {sent_id}\nretry: 3000\n\n"
+        else:
+            sent_id = last_id
+            backlog, complete = chat_hub.since(last_id)
+            if not complete:
+                yield _reset_event()
+                sent_id = chat_hub.high_water
+            else:
+                for message in backlog:
+                    yield _message_event(message)
+                    sent_id = message["id"]
+
+        while not sub.closed:
+            try:
+                message = await asyncio.wait_for(sub.queue.get(), timeout=keepalive)
+            except asyncio.TimeoutError:
+                if await request.is_disconnected():
+                    break
+                yield ": ping\n\n"
+                continue
+
+            if message is None:
+                break
+            if sub.lagged:
+                # Очередь переполнилась: отбрасываем её и догоняем ленту из буфера
+                while not sub.queue.empty():
+                    sub.queue.get_nowait()
+                sub.lagged = False
+                backlog, complete = chat_hub.since(sent_id)
+                if not complete:
+                    yield _reset_event()
+                    sent_id = chat_hub.high_water
+                    continue
+                for message in backlog:
+                    yield _message_event(message)
+                    sent_id = message["id"]
+                continue
+
+            yield _message_event(message)
+            sent_id = max(sent_id, message["id"])
+    finally:
+        chat_hub.unsubscribe(sub)
+
+
+@router.get("/stream")
+async def stream_messages(
+    request: Request,
+    last_id: Optional[int] = None,
+    last_event_id: Optional[int] = Header(None),
+):
+    """
+    Новые сообщения чата в формате text/event-stream.
+    При переподключении браузер сам присылает Last-Event-ID, он важнее last_id.
+    """
+    resume_id = last_event_id if last_event_id is not None else last_id
+    return StreamingResponse(
+        _event_stream(request, resume_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
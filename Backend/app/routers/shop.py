@@ -4,6 +4,7 @@ from typing import List
 
 from ..database import get_db
 from .. import crud, schemas
+from ..click_buffer import click_buffer
 
 router = APIRouter(prefix="/shop", tags=["Shop"])
 
@@ -41,7 +42,10 @@ def update_shop_item(item_id: int, data: schemas.ShopItemUpdate, db: Session = D
     item = crud.get_shop_item_by_id(db, item_id)
     if not item:
         raise HTTPException(status_code=404, detail="Shop item not found")
-    return crud.update_shop_item(db, item, data)
+    updated = crud.update_shop_item(db, item, data)
+    if not updated:
+        raise HTTPException(status_code=404, detail="Shop item not found")
+    return updated
 
 
 @router.delete("/items/{item_id}", status_code=204)
@@ -67,7 +71,9 @@ def purchase_item(user_id: int, req: schemas.PurchaseRequest, db: Session = Depe
     if not shop_item.is_active:
         raise HTTPException(status_code=400, detail="Shop item is not available")
 
-    return crud.create_purchase(db, user, shop_item)
+    purchase = crud.create_purchase(db, user, shop_item)
+    click_buffer.refresh_users([user.id])
+    return purchase
 
 
 @router.get("/purchases/{user_id}", response_model=List[schemas.PurchaseOut])
@@ -1,13 +1,16 @@
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel
 from uuid import uuid4
 from datetime import datetime
 import httpx
 
-from ..database import get_db
+from ..database import get_async_db
 from ..config import get_settings
-from .. import crud, models
+from .. import crud_async, models
+from ..click_buffer import click_buffer
 
 router = APIRouter(prefix="/stars", tags=["Stars Payment"])
 
@@ -32,7 +35,7 @@ class SuccessResponse(BaseModel):
 
 
 @router.post("/create", response_model=CreateInvoiceResponse)
-async def create_stars_invoice(req: CreateInvoiceRequest, db: Session = Depends(get_db)):
+async def create_stars_invoice(req: CreateInvoiceRequest, db: AsyncSession = Depends(get_async_db)):
     """
     Создать invoice для оплаты звёздами.
     Сохраняем pending платёж в БД с уникальным payload.
@@ -42,11 +45,11 @@ async def create_stars_invoice(req: CreateInvoiceRequest, db: Session = Depends(
     if not BOT_TOKEN or BOT_TOKEN == "YOUR_BOT_TOKEN_HERE":
         raise HTTPException(status_code=500, detail="Bot token not configured")
 
-    user = crud.get_user_by_id(db, req.user_id)
+    user = await crud_async.get_user_by_id(db, req.user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
-    shop_item = crud.get_shop_item_by_id(db, req.shop_item_id)
+    shop_item = await crud_async.get_shop_item_by_id(db, req.shop_item_id)
     if not shop_item:
         raise HTTPException(status_code=404, detail="Shop item not found")
 
@@ -86,30 +89,30 @@ async def create_stars_invoice(req: CreateInvoiceRequest, db: Session = Depends(
         status="pending"
     )
     db.add(pending)
-    db.commit()
+    await db.commit()
         
     return CreateInvoiceResponse(invoice_link=invoice_link)
 
 
 @router.post("/success", response_model=SuccessResponse)
-def confirm_stars_payment(req: SuccessRequest, db: Session = Depends(get_db)):
+async def confirm_stars_payment(req: SuccessRequest, db: AsyncSession = Depends(get_async_db)):
     """
     Подтвердить успешный платёж и начислить кристаллы.
     Вызывается после события invoiceClosed со статусом 'paid'.
     """
-    user = crud.get_user_by_id(db, req.user_id)
+    user = await crud_async.get_user_by_id(db, req.user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
     # Ищем последний pending платёж в БД
-    pending = (
-        db.query(models.StarsPending)
-        .filter(
+    pending = await db.scalar(
+        select(models.StarsPending)
+        .where(
             models.StarsPending.user_id == req.user_id,
             models.StarsPending.status == "pending"
         )
         .order_by(models.StarsPending.created_at.desc())
-        .first()
+        .limit(1)
     )
 
     if not pending:
@@ -123,17 +126,18 @@ def confirm_stars_payment(req: SuccessRequest, db: Session = Depends(get_db)):
             new_balance=user.balance,
         )
 
-    shop_item = crud.get_shop_item_by_id(db, pending.shop_item_id)
+    shop_item = await crud_async.get_shop_item_by_id(db, pending.shop_item_id)
     if not shop_item:
         raise HTTPException(status_code=404, detail="Shop item not found")
 
     # Создаём покупку и начисляем кристаллы
-    crud.create_purchase(db, user, shop_item)
+    await crud_async.create_purchase(db, user, shop_item)
 
     # Помечаем платёж как успешный
     pending.status = "success"
     pending.completed_at = datetime.utcnow()
-    db.commit()
+    await db.commit()
+    await run_in_threadpool(click_buffer.refresh_users, [user.id])
 
     return SuccessResponse(
         success=True,
@@ -143,9 +147,9 @@ def confirm_stars_payment(req: SuccessRequest, db: Session = Depends(get_db)):
 
 
 @router.get("/items")
-def get_stars_items(db: Session = Depends(get_db)):
+async def get_stars_items(db: AsyncSession = Depends(get_async_db)):
     """Получить товары для покупки за звёзды."""
-    items = crud.get_all_shop_items(db, active_only=True)
+    items = await crud_async.get_all_shop_items(db, active_only=True)
     return [
         {
             "id": item.id,
@@ -176,22 +180,22 @@ class TonPaymentResponse(BaseModel):
 
 
 @router.get("/ton-wallet")
-def get_ton_wallet():
+async def get_ton_wallet():
     """Получить адрес кошелька для оплаты TON."""
     return {"address": TON_WALLET_ADDRESS}
 
 
 @router.post("/ton-confirm", response_model=TonPaymentResponse)
-def confirm_ton_payment(req: TonPaymentRequest, db: Session = Depends(get_db)):
+async def confirm_ton_payment(req: TonPaymentRequest, db: AsyncSession = Depends(get_async_db)):
     """
     Подтвердить оплату через TON.
     Вызывается фронтендом после успешной отправки транзакции через TON Connect.
     """
-    user = crud.get_user_by_id(db, req.user_id)
+    user = await crud_async.get_user_by_id(db, req.user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
-    shop_item = crud.get_shop_item_by_id(db, req.shop_item_id)
+    shop_item = await crud_async.get_shop_item_by_id(db, req.shop_item_id)
     if not shop_item:
         raise HTTPException(status_code=404, detail="Shop item not found")
 
@@ -202,7 +206,8 @@ def confirm_ton_payment(req: TonPaymentRequest, db: Session = Depends(get_db)):
         raise HTTPException(status_code=400, detail="This item has no TON price")
 
     # Создаём покупку и начисляем кристаллы
-    crud.create_purchase(db, user, shop_item)
+    await crud_async.create_purchase(db, user, shop_item)
+    await run_in_threadpool(click_buffer.refresh_users, [user.id])
 
     return TonPaymentResponse(
         success=True,
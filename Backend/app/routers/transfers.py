@@ -1,9 +1,11 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
+from datetime import datetime
 
 from ..database import get_db
 from .. import crud, schemas
+from ..click_buffer import click_buffer
 
 router = APIRouter(prefix="/transfers", tags=["Transfers"])
 
@@ -27,43 +29,35 @@ def create_transfer(sender_id: int, req: schemas.TransferCreate, db: Session = D
     if sender.id == receiver.id:
         raise HTTPException(status_code=400, detail="Cannot transfer to yourself")
 
+    # Досылаем в БД клики из буфера, чтобы перевод видел актуальный баланс
+    click_buffer.flush_user(sender.id)
+    db.refresh(sender)
+
     transfer = crud.create_transfer(db, sender, receiver, req.amount)
     if not transfer:
         raise HTTPException(status_code=400, detail="Insufficient balance or invalid amount")
 
     # Обновляем прогресс заданий на переводы
-    crud.update_task_progress(db, sender_id, "transfer", req.amount)
+    crud.record_action(db, sender_id, "transfer", req.amount)
+    click_buffer.refresh_users([sender.id, receiver.id])
 
     return transfer
 
 
 @router.get("/{user_id}/history", response_model=List[schemas.TransferHistory])
-def get_transfer_history(user_id: int, limit: int = 50, db: Session = Depends(get_db)):
-    """Получить историю переводов пользователя."""
+def get_transfer_history(
+    user_id: int,
+    limit: int = Query(50, ge=1, le=100),
+    before_created_at: Optional[datetime] = Query(None, description="Курсор: created_at последней полученной записи"),
+    before_id: Optional[int] = Query(None, description="Курсор: id последней полученной записи"),
+    db: Session = Depends(get_db),
+):
+    """Получить историю переводов пользователя (новые сверху, страницы по курсору)."""
     user = crud.get_user_by_id(db, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
-    transfers = crud.get_user_transfers(db, user_id, limit=limit)
-
-    result = []
-    for t in transfers:
-        if t.sender_id == user_id:
-            direction = "sent"
-            other_user_id = t.receiver_id
-            other_user = crud.get_user_by_id(db, t.receiver_id) if t.receiver_id else None
-        else:
-            direction = "received"
-            other_user_id = t.sender_id
-            other_user = crud.get_user_by_id(db, t.sender_id) if t.sender_id else None
-
-        result.append(schemas.TransferHistory(
-            id=t.id,
-            amount=t.amount,
-            created_at=t.created_at,
-            direction=direction,
-            other_user_id=other_user_id,
-            other_username=other_user.username if other_user else None,
-        ))
-
-    return result
+    rows = crud.get_transfer_history(
+        db, user_id, limit=limit, before_created_at=before_created_at, before_id=before_id
+    )
+    return [schemas.TransferHistory(**row._mapping) for row in rows]
@@ -1,64 +1,80 @@
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List
 
-from ..database import get_db
-from .. import crud, schemas, models
+from ..database import get_async_db
+from .. import crud, crud_async, schemas
+from ..click_buffer import click_buffer
+from ..scheduler import schedule_user_stats_recompute
 
 router = APIRouter(prefix="/upgrades", tags=["Upgrades"])
 
 
 @router.get("/", response_model=List[schemas.UpgradeOut])
-def list_upgrades(db: Session = Depends(get_db)):
+async def list_upgrades(db: AsyncSession = Depends(get_async_db)):
     """Получить список всех улучшений."""
-    return crud.get_all_upgrades(db)
+    return await crud_async.get_all_upgrades(db)
 
 
 @router.post("/", response_model=schemas.UpgradeOut, status_code=201)
-def create_upgrade(upgrade: schemas.UpgradeCreate, db: Session = Depends(get_db)):
+async def create_upgrade(upgrade: schemas.UpgradeCreate, db: AsyncSession = Depends(get_async_db)):
     """Создать новое улучшение (для админки)."""
-    existing = crud.get_upgrade_by_key(db, upgrade.key)
+    existing = await crud_async.get_upgrade_by_key(db, upgrade.key)
     if existing:
         raise HTTPException(status_code=400, detail="Upgrade with this key already exists")
-    return crud.create_upgrade(db, upgrade)
+    created = await crud_async.create_upgrade(db, upgrade)
+
+    # Пересчитываем характеристики игроков в фоне
+    schedule_user_stats_recompute()
+    return created
 
 
 @router.get("/{upgrade_id}", response_model=schemas.UpgradeOut)
-def get_upgrade(upgrade_id: int, db: Session = Depends(get_db)):
+async def get_upgrade(upgrade_id: int, db: AsyncSession = Depends(get_async_db)):
     """Получить улучшение по ID."""
-    upgrade = crud.get_upgrade_by_id(db, upgrade_id)
+    upgrade = await crud_async.get_upgrade_by_id(db, upgrade_id)
     if not upgrade:
         raise HTTPException(status_code=404, detail="Upgrade not found")
     return upgrade
 
 
 @router.patch("/{upgrade_id}", response_model=schemas.UpgradeOut)
-def update_upgrade(upgrade_id: int, data: schemas.UpgradeUpdate, db: Session = Depends(get_db)):
+async def update_upgrade(upgrade_id: int, data: schemas.UpgradeUpdate, db: AsyncSession = Depends(get_async_db)):
     """Обновить улучшение."""
-    upgrade = crud.get_upgrade_by_id(db, upgrade_id)
+    upgrade = await crud_async.get_upgrade_by_id(db, upgrade_id)
     if not upgrade:
         raise HTTPException(status_code=404, detail="Upgrade not found")
-    return crud.update_upgrade(db, upgrade, data)
+    updated = await crud_async.update_upgrade(db, upgrade, data)
+    if not updated:
+        raise HTTPException(status_code=404, detail="Upgrade not found")
+
+    # Пересчитываем характеристики игроков в фоне
+    schedule_user_stats_recompute()
+    return updated
 
 
 @router.delete("/{upgrade_id}", status_code=204)
-def delete_upgrade(upgrade_id: int, db: Session = Depends(get_db)):
+async def delete_upgrade(upgrade_id: int, db: AsyncSession = Depends(get_async_db)):
     """Удалить улучшение."""
-    upgrade = crud.get_upgrade_by_id(db, upgrade_id)
+    upgrade = await crud_async.get_upgrade_by_id(db, upgrade_id)
     if not upgrade:
         raise HTTPException(status_code=404, detail="Upgrade not found")
-    crud.delete_upgrade(db, upgrade)
+    await crud_async.delete_upgrade(db, upgrade)
+
+    # Пересчитываем характеристики игроков в фоне
+    schedule_user_stats_recompute()
 
 
 @router.get("/user/{user_id}", response_model=List[schemas.UserUpgradeWithDetails])
-def get_user_upgrades(user_id: int, db: Session = Depends(get_db)):
+async def get_user_upgrades(user_id: int, db: AsyncSession = Depends(get_async_db)):
     """Получить все улучшения пользователя с деталями."""
-    user = crud.get_user_by_id(db, user_id)
+    user = await crud_async.get_user_by_id(db, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
-    all_upgrades = crud.get_all_upgrades(db)
-    user_upgrades = crud.get_user_upgrades(db, user_id)
+    all_upgrades = await crud_async.get_all_upgrades(db)
+    user_upgrades = await crud_async.get_user_upgrades(db, user_id)
 
     user_upgrade_map = {uu.upgrade_id: uu.level for uu in user_upgrades}
 
@@ -79,26 +95,33 @@ def get_user_upgrades(user_id: int, db: Session = Depends(get_db)):
 
 
 @router.post("/user/{user_id}/buy", response_model=schemas.UserUpgradeOut)
-def buy_upgrade(user_id: int, req: schemas.BuyUpgradeRequest, db: Session = Depends(get_db)):
+async def buy_upgrade(user_id: int, req: schemas.BuyUpgradeRequest, db: AsyncSession = Depends(get_async_db)):
     """Купить улучшение для пользователя."""
-    user = crud.get_user_by_id(db, user_id)
+    user = await crud_async.get_user_by_id(db, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
-    upgrade = crud.get_upgrade_by_key(db, req.upgrade_key)
+    upgrade = await crud_async.get_upgrade_by_key(db, req.upgrade_key)
     if not upgrade:
         raise HTTPException(status_code=404, detail="Upgrade not found")
 
-    user_upgrade = crud.buy_upgrade(db, user, upgrade)
+    # Досылаем в БД клики из буфера, чтобы цена сверялась с актуальным балансом
+    # (сброс идёт синхронным движком, поэтому в пуле потоков)
+    await run_in_threadpool(click_buffer.flush_user, user.id)
+    await db.refresh(user)
+
+    # Пассивный доход до покупки считается по старым уровням
+    earned = await crud_async.accrue_passive_income(db, user)
+    if earned > 0:
+        await crud_async.record_action(db, user.id, "earn", int(earned))
+
+    user_upgrade = await crud_async.buy_upgrade(db, user, upgrade)
     if not user_upgrade:
         raise HTTPException(status_code=400, detail="Cannot buy upgrade (not enough balance or max level reached)")
 
     # Обновляем прогресс заданий на покупку улучшений
-    crud.update_task_progress(db, user_id, "buy_upgrade", 1)
-
-    # Если это улучшение maxEnergy, обновляем max_energy пользователя
-    if upgrade.key == "maxEnergy":
-        new_max = 100 + user_upgrade.level * 25
-        crud.update_max_energy(db, user, new_max)
+    await crud_async.record_action(db, user_id, "buy_upgrade", 1)
+    # Новые click_power / max_energy и баланс - в буфер кликов
+    await run_in_threadpool(click_buffer.refresh_users, [user.id])
 
     return user_upgrade
@@ -1,140 +1,202 @@
 from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from typing import List
+import httpx
 
-from ..database import get_db
-from .. import crud, schemas
+from ..config import get_settings
+from ..database import get_async_db, get_db
+from .. import avatars, crud, crud_async, schemas
+from ..click_buffer import click_buffer
+from ..leaderboard import leaderboard
 
 router = APIRouter(prefix="/users", tags=["Users"])
 
 
 @router.post("/", response_model=schemas.UserOut, status_code=201)
-def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
+async def create_user(user: schemas.UserCreate, db: AsyncSession = Depends(get_async_db)):
     """Создать нового пользователя или вернуть существующего по telegram_id."""
-    existing = crud.get_user_by_telegram_id(db, user.telegram_id)
+    existing = await crud_async.get_user_by_telegram_id(db, user.telegram_id)
     if existing:
-        # Восстанавливаем энергию перед возвратом
-        return crud.get_user_with_regenerated_energy(db, existing)
-    return crud.create_user(db, user)
+        # Текущая энергия считается на лету, без записи
+        return crud.with_current_energy(existing)
+    return await crud_async.create_user(db, user)
+
+
+@router.put("/by-telegram/{telegram_id}", response_model=schemas.UserOut)
+async def upsert_user(telegram_id: int, data: schemas.UserUpsert, db: AsyncSession = Depends(get_async_db)):
+    """Создать игрока или обновить профиль по Telegram ID за один запрос (для /start в боте)."""
+    return crud.with_current_energy(await crud_async.upsert_user(db, telegram_id, data))
 
 
 @router.get("/", response_model=List[schemas.UserOut])
-def list_users(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+async def list_users(skip: int = 0, limit: int = 100, db: AsyncSession = Depends(get_async_db)):
     """Получить список пользователей."""
-    return crud.get_users(db, skip=skip, limit=limit)
+    return await crud_async.get_users(db, skip=skip, limit=limit)
 
 
 @router.get("/leaderboard", response_model=List[schemas.UserLeaderboard])
-def get_leaderboard(limit: int = Query(50, le=100), db: Session = Depends(get_db)):
-    """Топ игроков по балансу."""
-    return crud.get_leaderboard(db, limit=limit)
+async def get_leaderboard(limit: int = Query(50, le=100)):
+    """Топ игроков по балансу (из лидерборда в памяти)."""
+    return [entry._asdict() for entry in leaderboard.top(limit)]
+
+
+@router.get("/leaderboard/{period_type}", response_model=schemas.PeriodLeaderboard)
+async def get_period_leaderboard(
+    period_type: str,
+    previous: bool = Query(False, description="Итоги прошлого периода"),
+    limit: int = Query(50, le=100),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Топ по заработанному за день (daily) или неделю (weekly)."""
+    if period_type not in ("daily", "weekly"):
+        raise HTTPException(status_code=400, detail="period_type must be 'daily' or 'weekly'")
+
+    rows = await crud_async.get_period_leaderboard(db, period_type, previous=previous, limit=limit)
+    return schemas.PeriodLeaderboard(
+        period_type=period_type,
+        period_start=crud.get_period_bounds(period_type, previous)[0],
+        entries=[
+            schemas.PeriodLeaderboardEntry(
+                rank=snapshot.rank,
+                id=user.id,
+                username=user.username,
+                first_name=user.first_name,
+                url_image=user.url_image,
+                earned=snapshot.earned,
+            )
+            for snapshot, user in rows
+        ],
+    )
 
 
 @router.get("/by-telegram/{telegram_id}", response_model=schemas.UserOut)
-def get_user_by_telegram(telegram_id: int, db: Session = Depends(get_db)):
+async def get_user_by_telegram(telegram_id: int, db: AsyncSession = Depends(get_async_db)):
     """Получить пользователя по Telegram ID."""
-    user = crud.get_user_by_telegram_id(db, telegram_id)
+    user = await crud_async.get_user_by_telegram_id(db, telegram_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
-    return user
+    return crud.with_current_energy(user)
 
 
 @router.get("/{user_id}", response_model=schemas.UserOut)
-def get_user(user_id: int, db: Session = Depends(get_db)):
+async def get_user(user_id: int, db: AsyncSession = Depends(get_async_db)):
     """Получить пользователя по ID."""
-    user = crud.get_user_by_id(db, user_id)
+    user = await crud_async.get_user_by_id(db, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
-    return crud.get_user_with_regenerated_energy(db, user)
+    return crud.with_current_energy(user)
+
+
+@router.get("/{user_id}/rank", response_model=schemas.UserRank)
+async def get_user_rank(user_id: int):
+    """Место игрока в общем лидерборде."""
+    entry = leaderboard.get(user_id)
+    rank = leaderboard.rank(user_id)
+    if entry is None or rank is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return schemas.UserRank(user_id=user_id, rank=rank, balance=entry.balance, total_players=len(leaderboard))
+
+
+@router.get("/{user_id}/rank/around", response_model=List[schemas.UserLeaderboardRanked])
+async def get_players_around(user_id: int, radius: int = Query(5, ge=1, le=50)):
+    """Игрок и его соседи по лидерборду (radius мест выше и ниже)."""
+    window = leaderboard.around(user_id, radius)
+    if not window:
+        raise HTTPException(status_code=404, detail="User not found")
+    return [{**entry._asdict(), "rank": rank} for rank, entry in window]
 
 
 @router.patch("/{user_id}", response_model=schemas.UserOut)
-def update_user(user_id: int, data: schemas.UserUpdate, db: Session = Depends(get_db)):
+async def update_user(user_id: int, data: schemas.UserUpdate, db: AsyncSession = Depends(get_async_db)):
     """Обновить данные пользователя."""
+    user = await crud_async.get_user_by_id(db, user_id)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    user = await crud_async.update_user(db, user, data)
+    await run_in_threadpool(click_buffer.refresh_users, [user.id])
+    return user
+
+
+@router.post("/{user_id}/avatar", response_model=schemas.UserOut)
+def refresh_avatar(user_id: int, db: Session = Depends(get_db)):
+    """Скачать фото профиля из Telegram в хранилище аватаров (бот вызывает для новых игроков)."""
     user = crud.get_user_by_id(db, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
-    return crud.update_user(db, user, data)
+    if not get_settings().TELEGRAM_BOT_TOKEN:
+        raise HTTPException(status_code=503, detail="TELEGRAM_BOT_TOKEN is not set")
+    try:
+        with avatars.telegram_client() as client:
+            avatars.refresh_avatar(db, client, user)
+    except (avatars.AvatarError, httpx.HTTPError, OSError) as e:
+        raise HTTPException(status_code=502, detail=f"Avatar fetch failed: {e}")
+    return crud.with_current_energy(user)
 
 
 @router.post("/{user_id}/add-balance", response_model=schemas.UserOut)
-def add_balance(user_id: int, req: schemas.AddBalanceRequest, db: Session = Depends(get_db)):
+async def add_balance(user_id: int, req: schemas.AddBalanceRequest, db: AsyncSession = Depends(get_async_db)):
     """Добавить баланс пользователю (для покупок в магазине)."""
-    user = crud.get_user_by_id(db, user_id)
+    user = await crud_async.get_user_by_id(db, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     if req.amount <= 0:
         raise HTTPException(status_code=400, detail="Amount must be positive")
-    return crud.add_balance(db, user, req.amount)
+    return await crud_async.add_balance(db, user, req.amount)
 
 
 @router.post("/{user_id}/click", response_model=schemas.UserOut)
-def click(user_id: int, req: schemas.ClickRequest, db: Session = Depends(get_db)):
+async def click(user_id: int, req: schemas.ClickRequest, db: AsyncSession = Depends(get_async_db)):
     """Обработать клики пользователя."""
-    user = crud.get_user_by_id(db, user_id)
+    if req.clicks <= 0:
+        raise HTTPException(status_code=400, detail="Clicks must be positive")
+
+    if click_buffer.enabled:
+        # Клики копятся в памяти и уходят в БД пачкой (см. app/click_buffer.py)
+        try:
+            # Ждёт fsync журнала (group commit), поэтому в пуле потоков
+            state = await run_in_threadpool(click_buffer.add_clicks, user_id, req.clicks)
+        except KeyError:
+            raise HTTPException(status_code=404, detail="User not found")
+        if state is None:
+            raise HTTPException(status_code=400, detail="Not enough energy")
+        return state
+
+    # Восстановление и списание энергии + начисление одним UPDATE
+    user = await crud_async.settle_clicks(db, user_id, req.clicks)
     if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-
-    # Восстанавливаем энергию
-    user = crud.get_user_with_regenerated_energy(db, user)
-
-    # Проверяем достаточно ли энергии
-    if user.energy < req.clicks:
-        raise HTTPException(status_code=400, detail="Not enough energy")
-
-    # Тратим энергию
-    if not crud.consume_energy(db, user, req.clicks):
+        if not await crud_async.get_user_by_id(db, user_id):
+            raise HTTPException(status_code=404, detail="User not found")
         raise HTTPException(status_code=400, detail="Not enough energy")
 
-    # Базовое значение клика из админ-настроек (по умолчанию 1)
-    base_click_value = float(crud.get_admin_setting(db, "click_value") or "1")
+    amount = req.clicks * user.click_power
 
-    # Получаем уровень улучшения клика
-    click_upgrade = crud.get_upgrade_by_key(db, "click")
-    click_power = base_click_value
-    if click_upgrade:
-        user_upgrade = crud.get_user_upgrade(db, user.id, click_upgrade.id)
-        if user_upgrade:
-            vpl = click_upgrade.value_per_level or 1.0
-            click_power = base_click_value + user_upgrade.level * vpl
-
-    amount = req.clicks * click_power
-    user = crud.add_balance(db, user, amount)
-
-    # Обновляем прогресс заданий на клики
-    crud.update_task_progress(db, user.id, "click", req.clicks)
-    # Обновляем прогресс заданий на заработок
-    crud.update_task_progress(db, user.id, "earn", int(amount))
+    # Прогресс заданий на клики и заработок - один upsert
+    await crud_async.record_actions(db, [
+        (user.id, "click", req.clicks),
+        (user.id, "earn", int(amount)),
+    ])
 
     return user
 
 
 @router.post("/{user_id}/passive", response_model=schemas.UserOut)
-def passive_income(user_id: int, req: schemas.ClickRequest, db: Session = Depends(get_db)):
-    """Пассивный доход (автоклик) - не тратит энергию."""
-    user = crud.get_user_by_id(db, user_id)
+async def passive_income(user_id: int, db: AsyncSession = Depends(get_async_db)):
+    """
+    Синхронизация пассивного дохода (автоклик) - не тратит энергию.
+    Доход считается на сервере по уровням улучшений и времени с прошлой синхронизации,
+    поэтому клиенту достаточно вызывать его изредка.
+    """
+    user = await crud_async.get_user_by_id(db, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
-    # Восстанавливаем энергию (но не тратим)
-    user = crud.get_user_with_regenerated_energy(db, user)
-
-    # Базовое значение клика из админ-настроек (по умолчанию 1)
-    base_click_value = float(crud.get_admin_setting(db, "click_value") or "1")
-
-    # Получаем уровень улучшения клика
-    click_upgrade = crud.get_upgrade_by_key(db, "click")
-    click_power = base_click_value
-    if click_upgrade:
-        user_upgrade = crud.get_user_upgrade(db, user.id, click_upgrade.id)
-        if user_upgrade:
-            vpl = click_upgrade.value_per_level or 1.0
-            click_power = base_click_value + user_upgrade.level * vpl
-
-    amount = req.clicks * click_power
-    user = crud.add_balance(db, user, amount)
+    amount = await crud_async.accrue_passive_income(db, user)
 
     # Обновляем прогресс заданий на заработок (но не на клики)
-    crud.update_task_progress(db, user.id, "earn", int(amount))
+    if amount > 0:
+        await crud_async.record_action(db, user.id, "earn", int(amount))
+        await run_in_threadpool(click_buffer.refresh_users, [user.id])
 
-    return user
+    return crud.with_current_energy(user)
@@ -1,17 +1,61 @@
 """
-Планировщик для автоматического сброса заданий.
+Планировщик фоновых задач.
 
 - Ежедневные задания сбрасываются каждый день в 00:00
 - Еженедельные задания сбрасываются каждый понедельник в 00:00
+  (прогресс считается из дневных счётчиков и обнуляется сам со сменой даты,
+  сброс только удаляет старые строки)
+- Характеристики игроков пересчитываются по запросу после правки улучшений
+- Лидерборды «заработано за день / неделю» пересчитываются каждые
+  PERIOD_LEADERBOARD_REFRESH_SECONDS и замораживаются в начале нового периода.
+  Планировщик есть в каждом воркере, поэтому эти задачи идут под блокировкой
+  MySQL GET_LOCK: пересчёт пропускается, если её держит другой воркер,
+  заморозка ждёт её до PERIOD_LEADERBOARD_FREEZE_WAIT_SECONDS
+- Лидерборд в памяти сверяется с БД каждые LEADERBOARD_SYNC_SECONDS и
+  полностью пересобирается раз в час
+- Аватары игроков без миниатюры и устаревшие сверяются с Telegram каждые
+  AVATAR_REFRESH_SECONDS порциями по AVATAR_REFRESH_BATCH
 """
+import threading
+from contextlib import contextmanager
+
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
+from sqlalchemy import text
 
-from .database import SessionLocal
-from . import crud
+from .config import get_settings
+from .database import SessionLocal, engine
+from .click_buffer import click_buffer
+from .leaderboard import leaderboard
+from . import avatars, crud, effects
 
 scheduler = BackgroundScheduler()
 
+PERIOD_LEADERBOARD_LOCK = "period_leaderboards"
+# Заморозка в 00:00 не должна теряться из-за идущего пересчёта; повтор в другом воркере безвреден
+PERIOD_LEADERBOARD_FREEZE_WAIT_SECONDS = 120
+
+
+@contextmanager
+def _advisory_lock(name: str, timeout: int):
+    """
+    Блокировка MySQL GET_LOCK на отдельном соединении (сессия вернула бы его
+    в пул после commit). Отдаёт True, если блокировка взята за timeout секунд.
+    """
+    with engine.connect() as conn:
+        acquired = conn.execute(
+            text("SELECT GET_LOCK(:name, :timeout)"), {"name": name, "timeout": timeout}
+        ).scalar()
+        if acquired != 1:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            conn.execute(text("SELECT RELEASE_LOCK(:name)"), {"name": name})
+            conn.commit()
+
 
 def reset_daily_tasks():
     """Сбросить ежедневные задания."""
@@ -37,6 +81,121 @@ def reset_weekly_tasks():
         db.close()
 
 
+def refresh_period_leaderboards():
+    """Пересчитать лидерборды текущего дня и недели (один воркер за раз)."""
+    db = SessionLocal()
+    try:
+        with _advisory_lock(PERIOD_LEADERBOARD_LOCK, 0) as acquired:
+            if not acquired:
+                return  # пересчитывает другой воркер
+            for period_type in ("daily", "weekly"):
+                crud.materialize_period_leaderboard(db, period_type)
+    except Exception as e:
+        print(f"[Scheduler] Error refreshing period leaderboards: {e}")
+    finally:
+        db.close()
+
+
+def freeze_daily_leaderboard():
+    """Итоговый лидерборд прошедшего дня."""
+    db = SessionLocal()
+    try:
+        with _advisory_lock(PERIOD_LEADERBOARD_LOCK, PERIOD_LEADERBOARD_FREEZE_WAIT_SECONDS) as acquired:
+            if not acquired:
+                print("[Scheduler] Skipped daily leaderboard freeze: lock is busy")
+                return
+            total = crud.materialize_period_leaderboard(db, "daily", previous=True)
+        print(f"[Scheduler] Froze daily leaderboard: {total} players")
+    except Exception as e:
+        print(f"[Scheduler] Error freezing daily leaderboard: {e}")
+    finally:
+        db.close()
+
+
+def freeze_weekly_leaderboard():
+    """Итоговый лидерборд прошедшей недели."""
+    db = SessionLocal()
+    try:
+        with _advisory_lock(PERIOD_LEADERBOARD_LOCK, PERIOD_LEADERBOARD_FREEZE_WAIT_SECONDS) as acquired:
+            if not acquired:
+                print("[Scheduler] Skipped weekly leaderboard freeze: lock is busy")
+                return
+            total = crud.materialize_period_leaderboard(db, "weekly", previous=True)
+        print(f"[Scheduler] Froze weekly leaderboard: {total} players")
+    except Exception as e:
+        print(f"[Scheduler] Error freezing weekly leaderboard: {e}")
+    finally:
+        db.close()
+
+
+def sync_leaderboard():
+    """Подтянуть в лидерборд игроков, изменённых другими воркерами."""
+    db = SessionLocal()
+    try:
+        leaderboard.sync(db)
+    except Exception as e:
+        print(f"[Scheduler] Error syncing leaderboard: {e}")
+    finally:
+        db.close()
+
+
+def rebuild_leaderboard():
+    """Полностью пересобрать лидерборд (убирает удалённых игроков)."""
+    db = SessionLocal()
+    try:
+        total = leaderboard.load(db)
+        print(f"[Scheduler] Rebuilt leaderboard: {total} users")
+    except Exception as e:
+        print(f"[Scheduler] Error rebuilding leaderboard: {e}")
+    finally:
+        db.close()
+
+
+def refresh_avatars():
+    """Обновить аватары игроков без миниатюры и давно не сверявшихся."""
+    db = SessionLocal()
+    try:
+        total = avatars.refresh_stale(db, get_settings().AVATAR_REFRESH_BATCH)
+        if total:
+            print(f"[Scheduler] Refreshed avatars: {total} users")
+    except Exception as e:
+        print(f"[Scheduler] Error refreshing avatars: {e}")
+    finally:
+        db.close()
+
+
+# Поднимается при каждой правке; работающий пересчёт увидит его и пройдёт ещё раз
+_stats_dirty = threading.Event()
+
+
+def recompute_user_stats():
+    """Пересчитать click_power / passive_rate / max_energy всех игроков."""
+    while _stats_dirty.is_set():
+        _stats_dirty.clear()
+        db = SessionLocal()
+        try:
+            total = effects.recompute_all_user_stats(db)
+            print(f"[Scheduler] Recomputed stats for {total} users")
+            click_buffer.refresh_users()
+        except Exception as e:
+            print(f"[Scheduler] Error recomputing user stats: {e}")
+        finally:
+            db.close()
+
+
+def schedule_user_stats_recompute():
+    """
+    Поставить пересчёт характеристик в очередь (запустится сразу).
+    Несколько правок подряд схлопываются в один пересчёт.
+    """
+    _stats_dirty.set()
+    scheduler.add_job(
+        recompute_user_stats,
+        id="recompute_user_stats",
+        replace_existing=True,
+    )
+
+
 def start_scheduler():
     """Запустить планировщик."""
     # Ежедневный сброс в 00:00
@@ -55,6 +214,46 @@ def start_scheduler():
         replace_existing=True,
     )
 
+    # Итоги дня / недели (счётчики прошлой недели сброс заданий не удаляет)
+    scheduler.add_job(
+        freeze_daily_leaderboard,
+        CronTrigger(hour=0, minute=0),
+        id="freeze_daily_leaderboard",
+        replace_existing=True,
+    )
+    scheduler.add_job(
+        freeze_weekly_leaderboard,
+        CronTrigger(day_of_week="mon", hour=0, minute=0),
+        id="freeze_weekly_leaderboard",
+        replace_existing=True,
+    )
+    scheduler.add_job(
+        refresh_period_leaderboards,
+        IntervalTrigger(seconds=get_settings().PERIOD_LEADERBOARD_REFRESH_SECONDS),
+        id="refresh_period_leaderboards",
+        replace_existing=True,
+    )
+
+    scheduler.add_job(
+        sync_leaderboard,
+        IntervalTrigger(seconds=get_settings().LEADERBOARD_SYNC_SECONDS),
+        id="sync_leaderboard",
+        replace_existing=True,
+    )
+    scheduler.add_job(
+        rebuild_leaderboard,
+        IntervalTrigger(hours=1),
+        id="rebuild_leaderboard",
+        replace_existing=True,
+    )
+
+    scheduler.add_job(
+        refresh_avatars,
+        IntervalTrigger(seconds=get_settings().AVATAR_REFRESH_SECONDS),
+        id="refresh_avatars",
+        replace_existing=True,
+    )
+
     scheduler.start()
     print("[Scheduler] Started - daily reset at 00:00, weekly reset on Monday 00:00")
 
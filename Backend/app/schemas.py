@@ -1,6 +1,6 @@
 from pydantic import BaseModel
 from typing import Optional, List
-from datetime import datetime
+from datetime import date, datetime
 
 
 # ─────────────────────────────────────────────────────────────
@@ -18,6 +18,14 @@ class UserCreate(UserBase):
     pass
 
 
+class UserUpsert(BaseModel):
+    """Профиль из Telegram для /start: обновляются только переданные поля."""
+    username: Optional[str] = None
+    first_name: Optional[str] = None
+    last_name: Optional[str] = None
+    url_image: Optional[str] = None
+
+
 class UserUpdate(BaseModel):
     username: Optional[str] = None
     first_name: Optional[str] = None
@@ -31,7 +39,10 @@ class UserOut(UserBase):
     balance: float
     energy: int
     max_energy: int
+    click_power: Optional[float] = None
+    passive_rate: Optional[float] = None
     last_energy_update: datetime
+    passive_accrued_at: Optional[datetime] = None
     created_at: datetime
     updated_at: datetime
 
@@ -51,6 +62,32 @@ class UserLeaderboard(BaseModel):
         from_attributes = True
 
 
+class UserLeaderboardRanked(UserLeaderboard):
+    rank: int
+
+
+class PeriodLeaderboardEntry(BaseModel):
+    rank: int
+    id: int
+    username: Optional[str]
+    first_name: Optional[str]
+    url_image: Optional[str]
+    earned: int
+
+
+class PeriodLeaderboard(BaseModel):
+    period_type: str
+    period_start: date
+    entries: List[PeriodLeaderboardEntry]
+
+
+class UserRank(BaseModel):
+    user_id: int
+    rank: int
+    balance: float
+    total_players: int
+
+
 # ─────────────────────────────────────────────────────────────
 # Upgrade
 # ─────────────────────────────────────────────────────────────
@@ -0,0 +1,277 @@
+"""
+Движок рассылки: несколько параллельных отправителей за общим token bucket.
+
+Лимиты Telegram для бота: около 30 сообщений в секунду на все чаты и не чаще
+раза в секунду в один чат. Глобальный лимит держит TokenBucket
+(BROADCAST_RATE с запасом до 30). В каждый чат рассылка отправляет одно
+сообщение, а повтор идёт только после ожидания, поэтому лимит на чат
+соблюдается сам. Отчёт админу правится не чаще BROADCAST_REPORT_SECONDS.
+
+- TelegramRetryAfter (flood wait) ставит на паузу весь bucket на retry_after
+  секунд, после чего то же сообщение отправляется снова.
+- Пользователи, заблокировавшие бота (TelegramForbiddenError), пропускаются.
+- Сетевые ошибки и 5xx повторяются до BROADCAST_MAX_ATTEMPTS раз.
+"""
+import asyncio
+import json
+import time
+from dataclasses import dataclass, field
+from typing import AsyncIterable, Callable, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramNetworkError,
+    TelegramNotFound,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+from aiogram.types import InlineKeyboardMarkup, Message
+
+from .config import (
+    BROADCAST_RATE,
+    BROADCAST_CONCURRENCY,
+    BROADCAST_MAX_ATTEMPTS,
+)
+
+
+# ================== RATE LIMIT ==================
+
+class TokenBucket:
+    """rate токенов в секунду, не больше capacity про запас."""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float) -> None:
+        """Не выдавать токены seconds секунд (flood wait от Telegram)."""
+        self.tokens = 0
+        self.updated = max(self.updated, time.monotonic() + seconds)
+
+    async def acquire(self) -> None:
+        # Под замком: ждущие отправители получают токены по очереди
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.updated:
+                    await asyncio.sleep(self.updated - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+# ================== CONTENT ==================
+
+@dataclass
+class BroadcastContent:
+    """Что рассылаем: текст или медиа с подписью и кнопками."""
+    text: str
+    keyboard: Optional[InlineKeyboardMarkup] = None
+    photo: Optional[str] = None
+    video: Optional[str] = None
+    document: Optional[str] = None
+
+    def to_json(self) -> str:
+        return json.dumps({
+            "text": self.text,
+            "keyboard": self.keyboard.model_dump(mode="json", exclude_none=True) if self.keyboard else None,
+            "photo": self.photo,
+            "video": self.video,
+            "document": self.document,
+        }, ensure_ascii=False)
+
+    @classmethod
+    def from_json(cls, raw: str) -> "BroadcastContent":
+        data = json.loads(raw)
+        keyboard = data.pop("keyboard", None)
+        return cls(keyboard=InlineKeyboardMarkup.model_validate(keyboard) if keyboard else None, **data)
+
+    @classmethod
+    def from_message(cls, message: Message, text: str, keyboard) -> "BroadcastContent":
+        return cls(
+            text=text,
+            keyboard=keyboard,
+            photo=message.photo[-1].file_id if message.photo else None,
+            video=message.video.file_id if message.video else None,
+            document=message.document.file_id if message.document else None,
+        )
+
+    async def send(self, bot: Bot, chat_id: int) -> None:
+        if self.photo:
+            await bot.send_photo(
+                chat_id=chat_id,
+                photo=self.photo,
+                caption=self.text,
+                reply_markup=self.keyboard,
+                parse_mode="HTML"
+            )
+        elif self.video:
+            await bot.send_video(
+                chat_id=chat_id,
+                video=self.video,
+                caption=self.text,
+                reply_markup=self.keyboard,
+                parse_mode="HTML"
+            )
+        elif self.document:
+            await bot.send_document(
+                chat_id=chat_id,
+                document=self.document,
+                caption=self.text,
+                reply_markup=self.keyboard,
+                parse_mode="HTML"
+            )
+        else:
+            await bot.send_message(
+                chat_id=chat_id,
+                text=self.text,
+                reply_markup=self.keyboard,
+                parse_mode="HTML",
+                disable_web_page_preview=True
+            )
+
+
+# ================== STATS ==================
+
+@dataclass
+class BroadcastStats:
+    total: Optional[int] = None
+    sent: int = 0
+    blocked: int = 0
+    failed: int = 0
+    flood_waits: int = 0
+    started_at: float = field(default_factory=time.monotonic)
+
+    @property
+    def done(self) -> int:
+        return self.sent + self.blocked + self.failed
+
+    @property
+    def rate(self) -> float:
+        elapsed = time.monotonic() - self.started_at
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+    def report(self, finished: bool = False) -> str:
+        elapsed = int(time.monotonic() - self.started_at)
+        head = "✅ Рассылка завершена" if finished else "🚀 Рассылка идёт"
+        progress = f"{self.done}/{self.total}" if self.total is not None else str(self.done)
+        lines = [
+            head,
+            "",
+            f"📊 Обработано: {progress}",
+            f"✉️ Доставлено: {self.sent}",
+            f"🚫 Заблокировали бота: {self.blocked}",
+            f"❌ Ошибки: {self.failed}",
+            f"⚡ Скорость: {self.rate:.1f} сообщ./сек",
+            f"⏱ Прошло: {elapsed // 60} мин {elapsed % 60} сек",
+        ]
+        if self.flood_waits:
+            lines.append(f"⏸ Flood wait: {self.flood_waits}")
+        if not finished and self.total and self.rate > 0:
+            left = int((self.total - self.done) / self.rate)
+            lines.append(f"⏳ Осталось: ~{left // 60} мин")
+        return "\n".join(lines)
+
+
+# ================== ENGINE ==================
+
+class Broadcaster:
+    def __init__(
+        self,
+        bot: Bot,
+        content: BroadcastContent,
+        stats: Optional[BroadcastStats] = None,
+        bucket: Optional[TokenBucket] = None,
+    ):
+        self.bot = bot
+        self.content = content
+        self.stats = stats or BroadcastStats()
+        # Лимит Telegram общий на бота: рассылки одного процесса делят один bucket
+        self.bucket = bucket or TokenBucket(BROADCAST_RATE)
+
+    async def deliver(self, chat_id: int) -> str:
+        """Отправить одному получателю: "sent", "blocked" или "failed"."""
+        attempts = 0
+        while True:
+            await self.bucket.acquire()
+            try:
+                await self.content.send(self.bot, chat_id)
+                return "sent"
+            except TelegramRetryAfter as e:
+                # Превысили лимит: ждут все отправители, затем повтор того же сообщения
+                self.stats.flood_waits += 1
+                self.bucket.pause(e.retry_after)
+            except TelegramForbiddenError:
+                return "blocked"
+            except (TelegramBadRequest, TelegramNotFound) as e:
+                print(f"❌ FAIL {chat_id}: {e}")
+                return "failed"
+            except (TelegramNetworkError, TelegramServerError, asyncio.TimeoutError) as e:
+                attempts += 1
+                if attempts >= BROADCAST_MAX_ATTEMPTS:
+                    print(f"❌ FAIL {chat_id}: {e}")
+                    return "failed"
+                await asyncio.sleep(2 ** attempts)
+            except Exception as e:
+                print(f"❌ FAIL {chat_id}: {e}")
+                return "failed"
+
+    def _count(self, result: str) -> None:
+        if result == "sent":
+            self.stats.sent += 1
+        elif result == "blocked":
+            self.stats.blocked += 1
+        else:
+            self.stats.failed += 1
+
+    async def _sender(self, queue: asyncio.Queue, on_done: Optional[Callable[[int], None]]) -> None:
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            key, chat_id = item
+            self._count(await self.deliver(chat_id))
+            if on_done:
+                on_done(key)
+
+    async def run(
+        self,
+        recipients: AsyncIterable[Tuple[int, int]],
+        on_done: Optional[Callable[[int], None]] = None,
+    ) -> BroadcastStats:
+        """
+        Разослать всем из recipients - пар (ключ, chat_id). Очередь ограничена,
+        поэтому получатели читаются по мере отправки и память не растёт.
+        on_done(ключ) вызывается, когда получатель обработан.
+        """
+        queue: asyncio.Queue = asyncio.Queue(maxsize=BROADCAST_CONCURRENCY * 4)
+        senders = [asyncio.create_task(self._sender(queue, on_done)) for _ in range(BROADCAST_CONCURRENCY)]
+        try:
+            async for item in recipients:
+                await queue.put(item)
+            for _ in senders:
+                await queue.put(None)
+            await asyncio.gather(*senders)
+        finally:
+            for task in senders:
+                task.cancel()
+        return self.stats
+
+
+async def edit_report(bot: Bot, chat_id: int, message_id: int, text: str) -> None:
+    """Обновить сообщение админу с прогрессом рассылки."""
+    try:
+        await bot.edit_message_text(text=text, chat_id=chat_id, message_id=message_id)
+    except TelegramRetryAfter as e:
+        await asyncio.sleep(e.retry_after)
+    except Exception as e:
+        print(f"⚠️ BROADCAST REPORT: {e}")
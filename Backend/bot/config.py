@@ -31,5 +31,48 @@ DB_CONFIG = {
     "charset": "utf8mb4"
 }
 
+# Как часто сверять версию кэша admin_settings (секунды)
+SETTINGS_CHECK_SECONDS = float(os.getenv("CACHE_VERSION_CHECK_SECONDS", "2"))
+
 # API URL
 API_URL = os.getenv("API_URL", "http://localhost:8000")
+
+# Рассылка (bot/broadcast.py): Telegram пропускает около 30 сообщений в секунду на бота
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "20"))
+BROADCAST_REPORT_SECONDS = float(os.getenv("BROADCAST_REPORT_SECONDS", "10"))
+BROADCAST_MAX_ATTEMPTS = int(os.getenv("BROADCAST_MAX_ATTEMPTS", "3"))
+
+# Рассылки в БД (bot/jobs.py)
+BROADCAST_CHUNK_SIZE = int(os.getenv("BROADCAST_CHUNK_SIZE", "10000"))  # users.id в одном диапазоне
+BROADCAST_BATCH_SIZE = int(os.getenv("BROADCAST_BATCH_SIZE", "500"))  # получателей в одном чтении из users
+BROADCAST_CHECKPOINT_SECONDS = float(os.getenv("BROADCAST_CHECKPOINT_SECONDS", "5"))  # как часто сохранять курсор
+BROADCAST_LEASE_SECONDS = int(os.getenv("BROADCAST_LEASE_SECONDS", "300"))  # через сколько диапазон упавшего воркера свободен
+BROADCAST_POLL_SECONDS = float(os.getenv("BROADCAST_POLL_SECONDS", "5"))  # как часто искать новые диапазоны
+
+# Пул соединений бота с MySQL (bot/db.py)
+BOT_DB_POOL_SIZE = int(os.getenv("BOT_DB_POOL_SIZE", "5"))
+BOT_DB_POOL_RECYCLE = int(os.getenv("BOT_DB_POOL_RECYCLE", "1800"))  # меньше wait_timeout MySQL
+
+# HTTP к API: таймаут запроса, сек
+API_TIMEOUT_SECONDS = float(os.getenv("API_TIMEOUT_SECONDS", "10"))
+
+# Фоновая загрузка аватаров новых игроков
+AVATAR_WORKERS = int(os.getenv("AVATAR_WORKERS", "2"))
+AVATAR_QUEUE_SIZE = int(os.getenv("AVATAR_QUEUE_SIZE", "10000"))
+
+# Приём апдейтов: polling (один процесс) или webhook (bot/webhook.py, несколько реплик за одним адресом)
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+# Свой адрес Bot API, например заглушка для локальной проверки (python -m bot.stub_telegram)
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "")
+
+# Webhook
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")  # публичный адрес, например https://bot.example.com/webhook
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")  # заголовок X-Telegram-Bot-Api-Secret-Token, обязателен в webhook-режиме
+WEBHOOK_CONCURRENCY = int(os.getenv("WEBHOOK_CONCURRENCY", "50"))  # апдейтов в обработке одновременно на процесс
+WEBHOOK_MAX_PENDING = int(os.getenv("WEBHOOK_MAX_PENDING", "1000"))  # больше - отвечаем 503, Telegram повторит
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))  # параллельных запросов от Telegram (1-100)
+WEBHOOK_DRAIN_SECONDS = float(os.getenv("WEBHOOK_DRAIN_SECONDS", "10"))  # сколько доделывать апдейты при остановке
@@ -0,0 +1,46 @@
+"""
+Пул соединений с MySQL на всё время жизни процесса бота.
+
+Раньше каждый запрос открывал aiomysql.connect и закрывал его: на каждый
+/start - TCP-рукопожатие и авторизация в MySQL. Теперь соединения берутся
+из общего пула и возвращаются в него.
+"""
+import asyncio
+from contextlib import asynccontextmanager
+
+import aiomysql
+
+from .config import DB_CONFIG, BOT_DB_POOL_SIZE, BOT_DB_POOL_RECYCLE
+
+_pool: aiomysql.Pool | None = None
+_pool_lock = asyncio.Lock()
+
+
+async def get_pool() -> aiomysql.Pool:
+    global _pool
+    if _pool is None:
+        async with _pool_lock:
+            if _pool is None:
+                _pool = await aiomysql.create_pool(
+                    minsize=1,
+                    maxsize=BOT_DB_POOL_SIZE,
+                    pool_recycle=BOT_DB_POOL_RECYCLE,
+                    **DB_CONFIG
+                )
+    return _pool
+
+
+@asynccontextmanager
+async def connection():
+    """Соединение из пула (autocommit; для транзакции - conn.begin())."""
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        yield conn
+
+
+async def close_pool() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.close()
+        await _pool.wait_closed()
+        _pool = None
@@ -0,0 +1,58 @@
+"""
+Состояния диалогов бота (FSM aiogram) в MySQL, таблица bot_fsm_states.
+
+MemoryStorage живёт в памяти процесса: с несколькими репликами за одним
+webhook-адресом /send и следующее сообщение админа приходят в разные
+процессы. В webhook-режиме состояние лежит в общей БД - один запрос по
+первичному ключу на апдейт.
+"""
+import json
+from typing import Any, Dict, Mapping, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+from .db import connection
+
+
+def _storage_key(key: StorageKey) -> str:
+    business = getattr(key, "business_connection_id", None)  # поле есть с aiogram 3.5
+    parts = (key.bot_id, key.chat_id, key.user_id, key.thread_id, business, key.destiny)
+    return ":".join("" if part is None else str(part) for part in parts)
+
+
+class MySQLStorage(BaseStorage):
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        await self._save(key, "state", state.state if isinstance(state, State) else state)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return await self._load(key, "state")
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        await self._save(key, "data", json.dumps(dict(data), ensure_ascii=False))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        raw = await self._load(key, "data")
+        return json.loads(raw) if raw else {}
+
+    async def close(self) -> None:
+        pass  # пул закрывает close_pool() при остановке бота
+
+    async def _save(self, key: StorageKey, column: str, value: Optional[str]) -> None:
+        async with connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    f"INSERT INTO bot_fsm_states (storage_key, {column}) VALUES (%s, %s) "
+                    f"ON DUPLICATE KEY UPDATE {column} = VALUES({column})",
+                    (_storage_key(key), value)
+                )
+
+    async def _load(self, key: StorageKey, column: str) -> Optional[str]:
+        async with connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    f"SELECT {column} FROM bot_fsm_states WHERE storage_key = %s",
+                    (_storage_key(key),)
+                )
+                row = await cur.fetchone()
+        return row[0] if row else None
@@ -0,0 +1,353 @@
+"""
+Рассылки, которые переживают перезапуск бота.
+
+/send только записывает рассылку в broadcast_jobs и режет получателей на
+диапазоны users.id (broadcast_chunks). Отправляют сообщения воркеры: цикл
+run_worker в процессе бота и, при необходимости, отдельные процессы
+`python -m bot.worker`.
+
+- Воркер забирает диапазон через SELECT ... FOR UPDATE SKIP LOCKED и держит
+  аренду (claimed_at), продлевая её раз в BROADCAST_CHECKPOINT_SECONDS -
+  вместе с прогрессом или отдельно, если курсор не сдвинулся (медленный лимит,
+  долгие ретраи).
+- Получатели читаются из users пачками по keyset и сразу идут отправителям,
+  память не зависит от размера базы.
+- Раз в BROADCAST_CHECKPOINT_SECONDS в диапазон пишется cursor_id (все до него
+  обработаны) и счётчики. Если процесс упал, по истечении
+  BROADCAST_LEASE_SECONDS диапазон забирает другой воркер и продолжает с
+  cursor_id. Повторно могут уйти сообщения за один интервал сохранения.
+- Отчёт админу правит тот воркер, который первым обновил reported_at.
+- Рассылка завершается, когда готовы все её диапазоны; финальный отчёт
+  отправляет воркер, закрывший последний диапазон.
+
+Лимит Telegram общий на бота, а BROADCAST_RATE действует на один процесс:
+при N процессах рассылки ставьте BROADCAST_RATE около 25 / N.
+"""
+import asyncio
+import os
+import socket
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass
+from typing import Optional
+
+from aiogram import Bot
+
+from .broadcast import Broadcaster, BroadcastContent, BroadcastStats, TokenBucket, edit_report
+from .db import connection
+from .config import (
+    BROADCAST_RATE,
+    BROADCAST_REPORT_SECONDS,
+    BROADCAST_CHUNK_SIZE,
+    BROADCAST_BATCH_SIZE,
+    BROADCAST_CHECKPOINT_SECONDS,
+    BROADCAST_LEASE_SECONDS,
+    BROADCAST_POLL_SECONDS,
+)
+
+
+@dataclass
+class Chunk:
+    id: int
+    job_id: int
+    end_id: int
+    cursor_id: int
+    content: BroadcastContent
+
+
+# ================== JOBS ==================
+
+async def create_job(content: BroadcastContent, admin_chat_id: int, status_message_id: int) -> int:
+    """Записать рассылку и её диапазоны получателей. Возвращает id рассылки."""
+    async with connection() as conn:
+        await conn.begin()
+        try:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    "SELECT MIN(id), MAX(id), COUNT(*) FROM users WHERE telegram_id IS NOT NULL"
+                )
+                min_id, max_id, total = await cur.fetchone()
+
+                await cur.execute(
+                    "INSERT INTO broadcast_jobs (status, content, admin_chat_id, status_message_id, total) "
+                    "VALUES (%s, %s, %s, %s, %s)",
+                    ("running" if total else "done", content.to_json(), admin_chat_id, status_message_id, total)
+                )
+                job_id = cur.lastrowid
+
+                if total:
+                    chunks = [
+                        (job_id, start, min(start + BROADCAST_CHUNK_SIZE, max_id), start)
+                        for start in range(min_id - 1, max_id, BROADCAST_CHUNK_SIZE)
+                    ]
+                    await cur.executemany(
+                        "INSERT INTO broadcast_chunks "
+                        "(job_id, start_id, end_id, cursor_id, status, sent, blocked, failed) "
+                        "VALUES (%s, %s, %s, %s, 'pending', 0, 0, 0)",
+                        chunks
+                    )
+            await conn.commit()
+        except Exception:
+            await conn.rollback()
+            raise
+    return job_id
+
+
+async def claim_chunk(worker: str) -> Optional[Chunk]:
+    """Взять свободный диапазон или диапазон с истёкшей арендой."""
+    async with connection() as conn:
+        await conn.begin()
+        try:
+            async with conn.cursor() as cur:
+                # OF c: блокируем только диапазон, строку рассылки делят все воркеры
+                await cur.execute(
+                    "SELECT c.id, c.job_id, c.end_id, c.cursor_id, j.content "
+                    "FROM broadcast_chunks c JOIN broadcast_jobs j ON j.id = c.job_id "
+                    "WHERE j.status = 'running' AND (c.status = 'pending' "
+                    "OR (c.status = 'running' AND c.claimed_at < NOW() - INTERVAL %s SECOND)) "
+                    "ORDER BY c.id LIMIT 1 "
+                    "FOR UPDATE OF c SKIP LOCKED",
+                    (BROADCAST_LEASE_SECONDS,)
+                )
+                row = await cur.fetchone()
+                if row:
+                    await cur.execute(
+                        "UPDATE broadcast_chunks SET status = 'running', worker = %s, claimed_at = NOW() "
+                        "WHERE id = %s",
+                        (worker, row[0])
+                    )
+            await conn.commit()
+        except Exception:
+            await conn.rollback()
+            raise
+
+    if not row:
+        return None
+    return Chunk(id=row[0], job_id=row[1], end_id=row[2], cursor_id=row[3], content=BroadcastContent.from_json(row[4]))
+
+
+async def fetch_recipients(after_id: int, end_id: int, limit: int) -> list:
+    """Пачка (users.id, telegram_id) из (after_id, end_id] по возрастанию id."""
+    async with connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                "SELECT id, telegram_id FROM users "
+                "WHERE id > %s AND id <= %s AND telegram_id IS NOT NULL "
+                "ORDER BY id LIMIT %s",
+                (after_id, end_id, limit)
+            )
+            return list(await cur.fetchall())
+
+
+async def save_progress(chunk: Chunk, worker: str, cursor_id: int, sent: int, blocked: int, failed: int, done: bool) -> bool:
+    """
+    Записать курсор и счётчики пачки и продлить аренду.
+    False, если диапазон уже забрал другой воркер.
+    """
+    async with connection() as conn:
+        async with conn.cursor() as cur:
+            # cursor_id или status меняются при каждом вызове, поэтому rowcount = 0 значит «не наш»
+            await cur.execute(
+                "UPDATE broadcast_chunks SET cursor_id = %s, sent = sent + %s, blocked = blocked + %s, "
+                "failed = failed + %s, status = %s, claimed_at = NOW() "
+                "WHERE id = %s AND worker = %s AND status = 'running'",
+                (cursor_id, sent, blocked, failed, "done" if done else "running", chunk.id, worker)
+            )
+            return cur.rowcount > 0
+
+
+async def renew_lease(chunk: Chunk, worker: str) -> bool:
+    """Продлить аренду без прогресса. False, если диапазон уже забрал другой воркер."""
+    async with connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                "UPDATE broadcast_chunks SET claimed_at = NOW() "
+                "WHERE id = %s AND worker = %s AND status = 'running'",
+                (chunk.id, worker)
+            )
+            if cur.rowcount > 0:
+                return True
+            # rowcount = 0 и когда claimed_at уже равен NOW() (продлили в эту же секунду)
+            await cur.execute(
+                "SELECT 1 FROM broadcast_chunks WHERE id = %s AND worker = %s AND status = 'running'",
+                (chunk.id, worker)
+            )
+            return await cur.fetchone() is not None
+
+
+async def _job_stats(cur, job_id: int):
+    """(admin_chat_id, status_message_id, BroadcastStats) по всем диапазонам рассылки."""
+    await cur.execute(
+        "SELECT j.admin_chat_id, j.status_message_id, j.total, "
+        "TIMESTAMPDIFF(SECOND, j.created_at, NOW()), "
+        "COALESCE(SUM(c.sent), 0), COALESCE(SUM(c.blocked), 0), COALESCE(SUM(c.failed), 0) "
+        "FROM broadcast_jobs j LEFT JOIN broadcast_chunks c ON c.job_id = j.id "
+        "WHERE j.id = %s GROUP BY j.id",
+        (job_id,)
+    )
+    chat_id, message_id, total, elapsed, sent, blocked, failed = await cur.fetchone()
+    stats = BroadcastStats(
+        total=total,
+        sent=int(sent),
+        blocked=int(blocked),
+        failed=int(failed),
+        started_at=time.monotonic() - (elapsed or 0),
+    )
+    return chat_id, message_id, stats
+
+
+async def report_progress(bot: Bot, job_id: int) -> None:
+    """Обновить отчёт админу, если с прошлого прошло BROADCAST_REPORT_SECONDS (любым воркером)."""
+    async with connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                "UPDATE broadcast_jobs SET reported_at = NOW() "
+                "WHERE id = %s AND status = 'running' "
+                "AND (reported_at IS NULL OR reported_at <= NOW() - INTERVAL %s SECOND)",
+                (job_id, BROADCAST_REPORT_SECONDS)
+            )
+            if not cur.rowcount:
+                return
+            chat_id, message_id, stats = await _job_stats(cur, job_id)
+    if message_id:
+        await edit_report(bot, chat_id, message_id, stats.report())
+
+
+async def finish_job(bot: Bot, job_id: int) -> None:
+    """Закрыть рассылку, если готовы все диапазоны, и отправить итог админу."""
+    async with connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                "UPDATE broadcast_jobs SET status = 'done', finished_at = NOW() "
+                "WHERE id = %s AND status = 'running' AND NOT EXISTS "
+                "(SELECT 1 FROM broadcast_chunks WHERE job_id = %s AND status <> 'done')",
+                (job_id, job_id)
+            )
+            if not cur.rowcount:
+                return
+            chat_id, message_id, stats = await _job_stats(cur, job_id)
+
+    print(f"📊 BROADCAST {job_id} DONE: sent={stats.sent} blocked={stats.blocked} failed={stats.failed}")
+    if message_id:
+        await edit_report(bot, chat_id, message_id, stats.report(finished=True))
+
+
+# ================== WORKER ==================
+
+async def stream_recipients(after_id: int, end_id: int):
+    """
+    Получатели диапазона (users.id, telegram_id) по возрастанию id, пачками
+    по keyset. Следующая пачка читается, пока отправляется текущая.
+    """
+    pending = asyncio.create_task(fetch_recipients(after_id, end_id, BROADCAST_BATCH_SIZE))
+    try:
+        while pending:
+            rows = await pending
+            pending = None
+            if len(rows) == BROADCAST_BATCH_SIZE:
+                pending = asyncio.create_task(fetch_recipients(rows[-1][0], end_id, BROADCAST_BATCH_SIZE))
+            for user_id, tg_id in rows:
+                yield user_id, int(tg_id)
+    finally:
+        if pending:
+            pending.cancel()
+
+
+class Watermark:
+    """
+    Наибольший users.id, до которого включительно все получатели обработаны.
+    Отправители завершают сообщения не по порядку, а курсор должен быть сплошным.
+    """
+
+    def __init__(self, start: int):
+        self.value = start
+        self._issued = deque()  # users.id в порядке выдачи отправителям
+        self._done = set()  # обработанные, но ещё не дошедшие до начала очереди
+
+    async def track(self, recipients):
+        async for user_id, chat_id in recipients:
+            self._issued.append(user_id)
+            yield user_id, chat_id
+
+    def done(self, user_id: int) -> None:
+        self._done.add(user_id)
+        while self._issued and self._issued[0] in self._done:
+            self.value = self._issued.popleft()
+            self._done.discard(self.value)
+
+
+async def process_chunk(bot: Bot, chunk: Chunk, worker: str, bucket: TokenBucket) -> None:
+    """
+    Разослать диапазону с его курсора одним потоком получателей.
+    Курсор и счётчики сохраняются раз в BROADCAST_CHECKPOINT_SECONDS.
+    """
+    broadcaster = Broadcaster(bot, chunk.content, bucket=bucket)
+    stats = broadcaster.stats
+    watermark = Watermark(chunk.cursor_id)
+    saved = [chunk.cursor_id, 0, 0, 0]  # курсор и счётчики на момент прошлого сохранения
+
+    async def checkpoint(done: bool) -> bool:
+        cursor_id = chunk.end_id if done else watermark.value
+        counts = (stats.sent, stats.blocked, stats.failed)
+        if not done and cursor_id == saved[0]:
+            # Курсор не сдвинулся - сохранять нечего, но аренду продлеваем
+            return await renew_lease(chunk, worker)
+        owned = await save_progress(
+            chunk, worker, cursor_id,
+            counts[0] - saved[1], counts[1] - saved[2], counts[2] - saved[3],
+            done,
+        )
+        saved[:] = [cursor_id, *counts]
+        return owned
+
+    run = asyncio.create_task(broadcaster.run(
+        watermark.track(stream_recipients(chunk.cursor_id, chunk.end_id)),
+        on_done=watermark.done,
+    ))
+    try:
+        while not run.done():
+            await asyncio.wait({run}, timeout=BROADCAST_CHECKPOINT_SECONDS)
+            if run.done():
+                break
+            if not await checkpoint(done=False):
+                print(f"⚠️ BROADCAST chunk {chunk.id}: lease lost")
+                return
+            await report_progress(bot, chunk.job_id)
+        run.result()  # ошибка рассылки - наружу, диапазон доработают после аренды
+    finally:
+        run.cancel()
+
+    if not await checkpoint(done=True):
+        print(f"⚠️ BROADCAST chunk {chunk.id}: lease lost")
+        return
+    await finish_job(bot, chunk.job_id)
+
+
+def worker_name() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+async def run_worker(bot: Bot) -> None:
+    """Бесконечно разбирать диапазоны рассылок."""
+    worker = worker_name()
+    bucket = TokenBucket(BROADCAST_RATE)
+    print(f"📣 Broadcast worker {worker} started")
+
+    while True:
+        try:
+            chunk = await claim_chunk(worker)
+        except Exception as e:
+            print(f"⚠️ BROADCAST claim failed: {e}")
+            chunk = None
+
+        if chunk is None:
+            await asyncio.sleep(BROADCAST_POLL_SECONDS)
+            continue
+
+        try:
+            await process_chunk(bot, chunk, worker, bucket)
+        except Exception as e:
+            # Диапазон доработает любой воркер, когда истечёт аренда
+            print(f"❌ BROADCAST chunk {chunk.id} failed: {e}")
+            await asyncio.sleep(BROADCAST_POLL_SECONDS)
@@ -3,13 +3,14 @@ Telegram Bot for Clicker Diamond
 Based on working example, without referral logic
 """
 import asyncio
+import functools
 import re
+import time
 import uuid
 
 import aiohttp
-import aiomysql
 
-from aiogram import Bot, Dispatcher
+from aiogram import Dispatcher
 from aiogram.filters import CommandStart
 from aiogram.types import (
     Message,
@@ -23,18 +24,28 @@ from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.storage.memory import MemoryStorage
 
+from .broadcast import BroadcastContent
+from .db import connection, close_pool
+from .fsm import MySQLStorage
+from .jobs import create_job, run_worker
+from .telegram import create_bot
+from .webhook import run_webhook
 from .config import (
-    BOT_TOKEN,
+    BOT_MODE,
     BOT_USERNAME,
     WEBAPP_URL,
     ADMIN_TG_IDS,
-    DB_CONFIG,
     API_URL,
+    API_TIMEOUT_SECONDS,
+    AVATAR_WORKERS,
+    AVATAR_QUEUE_SIZE,
+    SETTINGS_CHECK_SECONDS,
 )
 
 
-bot = Bot(BOT_TOKEN)
-dp = Dispatcher(storage=MemoryStorage())
+bot = create_bot()
+# Реплики в webhook-режиме делят состояния диалогов через БД
+dp = Dispatcher(storage=MySQLStorage() if BOT_MODE == "webhook" else MemoryStorage())
 
 
 class BroadcastState(StatesGroup):
@@ -43,88 +54,125 @@ class BroadcastState(StatesGroup):
 
 # ================== DATABASE ==================
 
-async def fetch_all_tg_ids():
-    """Получить все telegram_id пользователей для рассылки."""
-    conn = await aiomysql.connect(**DB_CONFIG)
-    async with conn.cursor() as cur:
-        await cur.execute(
-            "SELECT telegram_id FROM users WHERE telegram_id IS NOT NULL"
-        )
-        rows = await cur.fetchall()
-    conn.close()
-    return [int(r[0]) for r in rows if r[0]]
+# Кэш admin_settings: перечитывается, только когда API подняло версию в cache_versions
+_settings_cache: dict | None = None
+_settings_version = -1
+_settings_checked_at = 0.0
 
 
 async def fetch_setting(name: str) -> str | None:
-    """Получить настройку из admin_settings."""
-    conn = await aiomysql.connect(**DB_CONFIG)
-    async with conn.cursor() as cur:
-        await cur.execute(
-            "SELECT value FROM admin_settings WHERE name=%s LIMIT 1",
-            (name,)
-        )
-        row = await cur.fetchone()
-    conn.close()
-    return row[0] if row else None
+    """Получить настройку из admin_settings (через кэш)."""
+    global _settings_cache, _settings_version, _settings_checked_at
+
+    now = time.monotonic()
+    if _settings_cache is None or now - _settings_checked_at >= SETTINGS_CHECK_SECONDS:
+        async with connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    "SELECT version FROM cache_versions WHERE name=%s",
+                    ("admin_settings",)
+                )
+                row = await cur.fetchone()
+                version = row[0] if row else 0
+
+                if _settings_cache is None or version != _settings_version:
+                    await cur.execute("SELECT name, value FROM admin_settings")
+                    _settings_cache = {r[0]: r[1] for r in await cur.fetchall()}
+                    _settings_version = version
+        _settings_checked_at = now
+
+    return _settings_cache.get(name)
 
 
 # ================== API FUNCTIONS ==================
 
-async def get_user_by_tg(tg_id: str):
-    """Получить пользователя по telegram_id."""
-    async with aiohttp.ClientSession() as session:
-        async with session.get(f"{API_URL}/users/by-telegram/{tg_id}") as resp:
-            if resp.status == 404:
-                return None
-            return await resp.json()
+# Одна keep-alive сессия к API на весь процесс
+_http: aiohttp.ClientSession | None = None
+
 
+def get_http() -> aiohttp.ClientSession:
+    global _http
+    if _http is None or _http.closed:
+        _http = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=API_TIMEOUT_SECONDS))
+    return _http
 
-async def create_user(payload: dict):
-    """Создать пользователя через API."""
-    async with aiohttp.ClientSession() as session:
-        async with session.post(f"{API_URL}/users/", json=payload) as resp:
-            return await resp.json()
+
+async def close_http() -> None:
+    if _http is not None and not _http.closed:
+        await _http.close()
+
+
+async def upsert_user(tg_id: int, profile: dict):
+    """Создать пользователя или обновить профиль одним запросом к API."""
+    async with get_http().put(f"{API_URL}/users/by-telegram/{tg_id}", json=profile) as resp:
+        resp.raise_for_status()
+        return await resp.json()
 
 
 # ================== AVATAR ==================
 
-async def get_avatar_url(user_id: int) -> str | None:
-    """Получить URL аватара пользователя."""
+# Аватары подтягиваются в фоне: /start не ждёт запросов к Telegram.
+# Фото скачивает API (POST /users/{id}/avatar) в своё хранилище миниатюр,
+# так что ссылка с токеном бота никуда не уходит.
+_avatar_queue: asyncio.Queue = asyncio.Queue(maxsize=AVATAR_QUEUE_SIZE)
+_avatar_pending: set[int] = set()
+
+
+def queue_avatar(user_id: int) -> None:
+    """Поставить игрока в очередь за аватаром (если очередь полна - подтянет планировщик API)."""
+    if user_id in _avatar_pending:
+        return
     try:
-        photos = await bot.get_user_profile_photos(user_id, limit=1)
-        if photos.total_count == 0:
-            return None
-        file_id = photos.photos[0][-1].file_id
-        file = await bot.get_file(file_id)
-        return f"https://api.telegram.org/file/bot{BOT_TOKEN}/{file.file_path}"
-    except Exception:
-        return None
+        _avatar_queue.put_nowait(user_id)
+        _avatar_pending.add(user_id)
+    except asyncio.QueueFull:
+        pass
 
 
-# ================== TEMPLATE RENDER ==================
+async def avatar_worker():
+    while True:
+        user_id = await _avatar_queue.get()
+        try:
+            async with get_http().post(f"{API_URL}/users/{user_id}/avatar") as resp:
+                resp.raise_for_status()
+        except Exception as e:
+            print(f"⚠️ AVATAR {user_id}: {e}")
+        finally:
+            _avatar_pending.discard(user_id)
 
-def render_start_message(raw: str, variables: dict):
-    """
-    Рендерит стартовое сообщение с переменными и кнопками.
-    
-    Формат:
-    TEXT:
-    Привет, {firstname}!
-    
-    BUTTONS:
-    🚀 Играть|webapp
-    📢 Канал|https://t.me/channel
-    """
-    if not raw:
-        return "", None
 
-    # Подстановка переменных
+# ================== TEMPLATE RENDER ==================
+
+def _fill(template: str, variables: dict) -> str:
     for k, v in variables.items():
-        raw = raw.replace(f"{{{k}}}", str(v or ""))
+        template = template.replace(f"{{{k}}}", str(v or ""))
+    return template
+
+
+def _build_keyboard(buttons) -> InlineKeyboardMarkup | None:
+    rows = []
+    for label, action in buttons:
+        if action == "webapp":
+            btn = InlineKeyboardButton(
+                text=label,
+                web_app=WebAppInfo(url=WEBAPP_URL)
+            )
+        else:
+            btn = InlineKeyboardButton(
+                text=label,
+                url=action
+            )
+        rows.append([btn])
+    return InlineKeyboardMarkup(inline_keyboard=rows) if rows else None
 
-    text = ""
-    buttons = []
 
+@functools.lru_cache(maxsize=8)
+def parse_start_template(raw: str):
+    """
+    Разобрать шаблон один раз на значение настройки:
+    (текст с {переменными}, кнопки [(подпись, действие)], готовая клавиатура).
+    Клавиатура None, если в кнопках есть переменные - тогда она собирается на каждый /start.
+    """
     if "BUTTONS:" in raw:
         text_part, buttons_part = raw.split("BUTTONS:", 1)
     else:
@@ -135,36 +183,42 @@ def render_start_message(raw: str, variables: dict):
     else:
         text = text_part.strip()
 
+    buttons = []
     for line in buttons_part.strip().splitlines():
         if "|" not in line:
             continue
 
         label, action = line.split("|", 1)
-        label = label.strip()
-        action = action.strip()
+        buttons.append((label.strip(), action.strip()))
 
-        if action == "webapp":
-            buttons.append(
-                InlineKeyboardButton(
-                    text=label,
-                    web_app=WebAppInfo(url=WEBAPP_URL)
-                )
-            )
-        else:
-            buttons.append(
-                InlineKeyboardButton(
-                    text=label,
-                    url=action
-                )
-            )
+    buttons = tuple(buttons)
+    static = not any("{" in label or "{" in action for label, action in buttons)
+    return text, buttons, _build_keyboard(buttons) if static else None
 
-    keyboard = None
-    if buttons:
-        keyboard = InlineKeyboardMarkup(
-            inline_keyboard=[[btn] for btn in buttons]
+
+def render_start_message(raw: str, variables: dict):
+    """
+    Рендерит стартовое сообщение с переменными и кнопками.
+    
+    Формат:
+    TEXT:
+    Привет, {firstname}!
+    
+    BUTTONS:
+    🚀 Играть|webapp
+    📢 Канал|https://t.me/channel
+    """
+    if not raw:
+        return "", None
+
+    # Разбор шаблона кэширован, на каждый /start - только подстановка переменных
+    text, buttons, keyboard = parse_start_template(raw)
+    if keyboard is None and buttons:
+        keyboard = _build_keyboard(
+            [(_fill(label, variables), _fill(action, variables)) for label, action in buttons]
         )
 
-    return text, keyboard
+    return _fill(text, variables).strip(), keyboard
 
 
 def extract_button(text: str):
@@ -192,52 +246,6 @@ def extract_button(text: str):
 
 # ================== BROADCAST ==================
 
-async def broadcast_any(message: Message, text: str, keyboard):
-    """Рассылка сообщения всем пользователям."""
-    tg_ids = await fetch_all_tg_ids()
-    print(f"📊 BROADCAST USERS: {len(tg_ids)}")
-
-    for tg_id in tg_ids:
-        try:
-            if message.photo:
-                await bot.send_photo(
-                    chat_id=tg_id,
-                    photo=message.photo[-1].file_id,
-                    caption=text,
-                    reply_markup=keyboard,
-                    parse_mode="HTML"
-                )
-            elif message.video:
-                await bot.send_video(
-                    chat_id=tg_id,
-                    video=message.video.file_id,
-                    caption=text,
-                    reply_markup=keyboard,
-                    parse_mode="HTML"
-                )
-            elif message.document:
-                await bot.send_document(
-                    chat_id=tg_id,
-                    document=message.document.file_id,
-                    caption=text,
-                    reply_markup=keyboard,
-                    parse_mode="HTML"
-                )
-            else:
-                await bot.send_message(
-                    chat_id=tg_id,
-                    text=text,
-                    reply_markup=keyboard,
-                    parse_mode="HTML",
-                    disable_web_page_preview=True
-                )
-
-            await asyncio.sleep(0.1)
-
-        except Exception as e:
-            print(f"❌ FAIL {tg_id}: {e}")
-
-
 @dp.message(lambda m: m.text == "/send")
 async def start_broadcast(message: Message, state: FSMContext):
     """Начать рассылку (только для админов)."""
@@ -260,11 +268,18 @@ async def process_broadcast_message(message: Message, state: FSMContext):
         return
 
     await state.clear()
-    await message.answer("🚀 Рассылка запущена")
+    status = await message.answer("🚀 Рассылка запущена")
 
     raw_text = message.text or message.caption or ""
     text, keyboard = extract_button(raw_text)
-    asyncio.create_task(broadcast_any(message, text, keyboard))
+
+    # Рассылку разбирают воркеры (run_worker здесь и python -m bot.worker)
+    job_id = await create_job(
+        BroadcastContent.from_message(message, text, keyboard),
+        admin_chat_id=message.chat.id,
+        status_message_id=status.message_id,
+    )
+    print(f"📣 BROADCAST {job_id} queued")
 
 
 # ================== PAYMENTS ==================
@@ -285,21 +300,18 @@ async def start_handler(message: Message):
     firstname = message.from_user.first_name
     lastname = message.from_user.last_name
 
-    # Проверяем/создаём пользователя
-    user = await get_user_by_tg(tg_id)
-
-    if not user:
-        avatar_url = await get_avatar_url(message.from_user.id)
-
-        payload = {
-            "telegram_id": int(tg_id),
+    # Создаём пользователя или обновляем профиль - один запрос к API
+    try:
+        user = await upsert_user(int(tg_id), {
             "username": username,
             "first_name": firstname,
             "last_name": lastname,
-            "url_image": avatar_url,
-        }
-
-        await create_user(payload)
+        })
+        if not user.get("url_image"):
+            queue_avatar(user["id"])
+    except Exception as e:
+        # Приветствие отправляем в любом случае
+        print(f"⚠️ UPSERT {tg_id}: {e}")
 
     # Получаем текст из настроек
     start_text_raw = await fetch_setting("start_text")
@@ -348,7 +360,20 @@ BUTTONS:
 
 async def main():
     print("🤖 Bot started!")
-    await dp.start_polling(bot)
+    # Рассылки из БД (в том числе недоделанные до перезапуска) и фоновые аватары
+    background = [asyncio.create_task(run_worker(bot))]
+    background += [asyncio.create_task(avatar_worker()) for _ in range(AVATAR_WORKERS)]
+    try:
+        if BOT_MODE == "webhook":
+            await run_webhook(dp, bot)
+        else:
+            await dp.start_polling(bot)
+    finally:
+        for task in background:
+            task.cancel()
+        await close_http()
+        await close_pool()
+        await bot.session.close()
 
 
 if __name__ == "__main__":
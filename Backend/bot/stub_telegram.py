@@ -0,0 +1,118 @@
+"""
+Заглушка Bot API для локальной проверки webhook-режима без Telegram.
+
+    python -m bot.stub_telegram                       # слушает :8081
+    TELEGRAM_API_URL=http://localhost:8081 BOT_MODE=webhook WEBHOOK_SECRET=local \\
+        WEBHOOK_URL=http://localhost:8080/webhook python -m bot.main
+    curl -X POST "http://localhost:8081/push?count=1000&concurrency=50"
+
+- На любой метод отвечает успехом: send*/edit* возвращают сообщение,
+  getMe - бота, остальные - true. Адрес из setWebhook запоминается.
+- POST /push отправляет на этот адрес count апдейтов /start от разных
+  пользователей (не больше concurrency одновременно) и возвращает коды
+  ответов и время. За адресом может стоять балансировщик с несколькими репликами.
+- GET /stats - сколько раз вызван каждый метод.
+"""
+import asyncio
+import itertools
+import os
+import time
+from collections import Counter
+
+import aiohttp
+from aiohttp import web
+
+STUB_PORT = int(os.getenv("STUB_TELEGRAM_PORT", "8081"))
+
+calls: Counter = Counter()
+webhook = {"url": None, "secret": None}
+_message_ids = itertools.count(1)
+_update_ids = itertools.count(1)
+
+
+def _message(chat_id) -> dict:
+    return {
+        "message_id": next(_message_ids),
+        "date": int(time.time()),
+        "chat": {"id": int(chat_id or 0), "type": "private"},
+        "text": "",
+    }
+
+
+async def bot_method(request: web.Request) -> web.Response:
+    method = request.match_info["method"]
+    params = dict(await request.post()) if request.can_read_body else dict(request.query)
+    calls[method] += 1
+
+    if method == "setWebhook":
+        webhook["url"] = params.get("url")
+        webhook["secret"] = params.get("secret_token")
+    if method == "getMe":
+        result = {"id": 1, "is_bot": True, "first_name": "Stub", "username": "stub_bot"}
+    elif method.startswith(("send", "edit")):
+        result = _message(params.get("chat_id"))
+    elif method == "getUserProfilePhotos":
+        result = {"total_count": 0, "photos": []}
+    else:
+        result = True
+    return web.json_response({"ok": True, "result": result})
+
+
+def _start_update(user_id: int) -> dict:
+    user = {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "username": f"user{user_id}"}
+    return {
+        "update_id": next(_update_ids),
+        "message": {
+            "message_id": next(_message_ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": user,
+            "text": "/start",
+            "entities": [{"type": "bot_command", "offset": 0, "length": 6}],
+        },
+    }
+
+
+async def push(request: web.Request) -> web.Response:
+    if not webhook["url"]:
+        return web.json_response({"error": "setWebhook was not called"}, status=400)
+    count = int(request.query.get("count", "100"))
+    concurrency = int(request.query.get("concurrency", "40"))
+    headers = {"X-Telegram-Bot-Api-Secret-Token": webhook["secret"]} if webhook["secret"] else {}
+    statuses: Counter = Counter()
+    slots = asyncio.Semaphore(concurrency)
+
+    async def send(session: aiohttp.ClientSession, user_id: int) -> None:
+        async with slots:
+            try:
+                async with session.post(webhook["url"], json=_start_update(user_id), headers=headers) as resp:
+                    statuses[resp.status] += 1
+            except aiohttp.ClientError:
+                statuses["error"] += 1
+
+    started = time.monotonic()
+    async with aiohttp.ClientSession() as session:
+        await asyncio.gather(*(send(session, 10_000_000 + i) for i in range(count)))
+    elapsed = time.monotonic() - started
+    return web.json_response({
+        "sent": count,
+        "statuses": {str(status): n for status, n in statuses.items()},
+        "seconds": round(elapsed, 3),
+        "per_second": round(count / elapsed, 1) if elapsed > 0 else None,
+    })
+
+
+async def stats(request: web.Request) -> web.Response:
+    return web.json_response({"webhook": webhook["url"], "calls": dict(calls)})
+
+
+def build_app() -> web.Application:
+    app = web.Application()
+    app.router.add_route("*", "/bot{token}/{method}", bot_method)
+    app.router.add_post("/push", push)
+    app.router.add_get("/stats", stats)
+    return app
+
+
+if __name__ == "__main__":
+    web.run_app(build_app(), port=STUB_PORT)
@@ -0,0 +1,16 @@
+"""
+Клиент Bot API. TELEGRAM_API_URL подменяет адрес api.telegram.org:
+локальный Bot API сервер или заглушка bot/stub_telegram.py для проверки без Telegram.
+"""
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+
+from .config import BOT_TOKEN, TELEGRAM_API_URL
+
+
+def create_bot() -> Bot:
+    if not TELEGRAM_API_URL:
+        return Bot(BOT_TOKEN)
+    session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL))
+    return Bot(BOT_TOKEN, session=session)
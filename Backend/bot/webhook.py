@@ -0,0 +1,133 @@
+"""
+Webhook-режим бота (BOT_MODE=webhook) вместо long polling.
+
+Polling - один цикл getUpdates на процесс, и второй процесс с тем же токеном
+получить апдейты не может. С webhook Telegram сам присылает апдейты POST-ом
+на WEBHOOK_URL, поэтому за одним адресом может стоять несколько реплик бота.
+
+- Запрос от Telegram получает 200 сразу, апдейт обрабатывается в фоне.
+  Одновременно в обработке не больше WEBHOOK_CONCURRENCY апдейтов на процесс,
+  остальные ждут своей очереди.
+- Если в процессе уже WEBHOOK_MAX_PENDING апдейтов, он отвечает 503 и Telegram
+  повторяет доставку позже (балансировщик может отправить её в другую реплику).
+- При остановке процесс перестаёт принимать запросы и до WEBHOOK_DRAIN_SECONDS
+  доделывает принятые апдейты. Недоделанные к этому времени теряются: Telegram
+  уже получил на них 200.
+- Состояния диалогов (/send) в этом режиме хранятся в MySQL (bot/fsm.py).
+- Без WEBHOOK_SECRET процесс не запускается: иначе любой, кто знает адрес,
+  может прислать поддельный апдейт (например, /send от имени админа). Секрет
+  общий для всех реплик, поэтому задаётся в окружении, а не генерируется.
+- GET /health - для проверки реплики балансировщиком.
+"""
+import asyncio
+import secrets
+import signal
+
+from aiogram import Bot, Dispatcher
+from aiohttp import web
+
+from .config import (
+    WEBHOOK_URL,
+    WEBHOOK_PATH,
+    WEBHOOK_HOST,
+    WEBHOOK_PORT,
+    WEBHOOK_SECRET,
+    WEBHOOK_CONCURRENCY,
+    WEBHOOK_MAX_PENDING,
+    WEBHOOK_MAX_CONNECTIONS,
+    WEBHOOK_DRAIN_SECONDS,
+)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookHandler:
+    def __init__(self, dp: Dispatcher, bot: Bot, concurrency: int, max_pending: int, secret: str):
+        self.dp = dp
+        self.bot = bot
+        self.secret = secret
+        self.max_pending = max_pending
+        self._slots = asyncio.Semaphore(concurrency)
+        self._tasks: set[asyncio.Task] = set()
+
+    @property
+    def pending(self) -> int:
+        return len(self._tasks)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if not secrets.compare_digest(request.headers.get(SECRET_HEADER, ""), self.secret):
+            return web.Response(status=401)
+        if self.pending >= self.max_pending:
+            return web.Response(status=503)
+        try:
+            update = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+
+        task = asyncio.create_task(self._process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.json_response({})
+
+    async def _process(self, update: dict) -> None:
+        async with self._slots:
+            try:
+                await self.dp.feed_raw_update(self.bot, update)
+            except Exception as e:
+                print(f"❌ UPDATE {update.get('update_id')}: {e}")
+
+    async def health(self, request: web.Request) -> web.Response:
+        return web.json_response({"status": "ok", "pending": self.pending})
+
+    async def drain(self, timeout: float) -> None:
+        """Дождаться принятых апдейтов, по таймауту отменить оставшиеся."""
+        if not self._tasks:
+            return
+        _, unfinished = await asyncio.wait(set(self._tasks), timeout=timeout)
+        for task in unfinished:
+            task.cancel()
+        if unfinished:
+            print(f"⚠️ WEBHOOK: dropped {len(unfinished)} updates on shutdown")
+
+
+def build_app(handler: WebhookHandler) -> web.Application:
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, handler.handle)
+    app.router.add_get("/health", handler.health)
+    return app
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot) -> None:
+    """Принимать апдейты по webhook до SIGTERM / SIGINT."""
+    if not WEBHOOK_SECRET:
+        raise RuntimeError("WEBHOOK_SECRET is required in webhook mode")
+    handler = WebhookHandler(dp, bot, WEBHOOK_CONCURRENCY, WEBHOOK_MAX_PENDING, WEBHOOK_SECRET)
+    runner = web.AppRunner(build_app(handler))
+    await runner.setup()
+    site = web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT)
+    await site.start()
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+
+    await dp.emit_startup(bot=bot)
+    try:
+        if WEBHOOK_URL:
+            # Все реплики ставят один и тот же адрес - повторный вызов ничего не меняет
+            await bot.set_webhook(
+                WEBHOOK_URL,
+                secret_token=WEBHOOK_SECRET,
+                max_connections=WEBHOOK_MAX_CONNECTIONS,
+                allowed_updates=dp.resolve_used_update_types(),
+            )
+        print(f"🌐 Webhook listening on {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+        await stop.wait()
+    finally:
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.remove_signal_handler(sig)
+        await site.stop()
+        await handler.drain(WEBHOOK_DRAIN_SECONDS)
+        await runner.cleanup()
+        await dp.emit_shutdown(bot=bot)
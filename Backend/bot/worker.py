@@ -0,0 +1,24 @@
+"""
+Отдельный процесс рассылки: только разбирает диапазоны broadcast_chunks,
+без приёма апдейтов (в режиме polling апдейты получает только один процесс бота).
+
+    python -m bot.worker
+"""
+import asyncio
+
+from .db import close_pool
+from .jobs import run_worker
+from .telegram import create_bot
+
+
+async def main():
+    bot = create_bot()
+    try:
+        await run_worker(bot)
+    finally:
+        await bot.session.close()
+        await close_pool()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
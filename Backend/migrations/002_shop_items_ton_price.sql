@@ -0,0 +1,6 @@
+-- Migration: TON price for shop items
+-- Товары без цены в TON получают stars * 0.1
+
+ALTER TABLE shop_items ADD COLUMN ton_price FLOAT DEFAULT NULL;
+
+UPDATE shop_items SET ton_price = stars * 0.1 WHERE ton_price IS NULL;
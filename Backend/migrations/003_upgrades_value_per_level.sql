@@ -0,0 +1,3 @@
+-- Migration: how much each upgrade level gives
+
+ALTER TABLE upgrades ADD COLUMN value_per_level DOUBLE NOT NULL DEFAULT 1.0;
@@ -0,0 +1,3 @@
+-- Migration: watermark of the last passive income accrual
+
+ALTER TABLE users ADD COLUMN passive_accrued_at DATETIME DEFAULT CURRENT_TIMESTAMP;
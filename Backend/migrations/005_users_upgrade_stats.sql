@@ -0,0 +1,5 @@
+-- Migration: player stats derived from upgrades (NULL = not computed yet)
+
+ALTER TABLE users ADD COLUMN click_power DOUBLE DEFAULT NULL;
+
+ALTER TABLE users ADD COLUMN passive_rate DOUBLE DEFAULT NULL;
@@ -0,0 +1,33 @@
+-- Migration: indexes for the hot queries in crud.py
+-- Перед уникальными ключами удаляем дубли, которые мог насоздать get-or-create
+
+-- user_upgrades: оставляем строку с максимальным уровнем (при равенстве - первую)
+DELETE uu FROM user_upgrades uu
+JOIN user_upgrades keep
+  ON keep.user_id = uu.user_id
+ AND keep.upgrade_id = uu.upgrade_id
+ AND (keep.level > uu.level OR (keep.level = uu.level AND keep.id < uu.id));
+
+ALTER TABLE user_upgrades ADD UNIQUE KEY uq_user_upgrades_user_upgrade (user_id, upgrade_id);
+
+-- user_tasks: оставляем строку с полученной наградой (при равенстве - первую)
+DELETE ut FROM user_tasks ut
+JOIN user_tasks keep
+  ON keep.user_id = ut.user_id
+ AND keep.task_id = ut.task_id
+ AND keep.period_start = ut.period_start
+ AND (keep.is_claimed > ut.is_claimed OR (keep.is_claimed = ut.is_claimed AND keep.id < ut.id));
+
+ALTER TABLE user_tasks ADD UNIQUE KEY uq_user_tasks_user_task_period (user_id, task_id, period_start);
+
+CREATE INDEX ix_transfers_sender_created ON transfers (sender_id, created_at);
+
+CREATE INDEX ix_transfers_receiver_created ON transfers (receiver_id, created_at);
+
+CREATE INDEX ix_purchases_user_created ON purchases (user_id, created_at);
+
+CREATE INDEX ix_stars_pending_user_status_created ON stars_pending (user_id, status, created_at);
+
+CREATE INDEX ix_users_balance ON users (balance);
+
+CREATE INDEX ix_users_username ON users (username);
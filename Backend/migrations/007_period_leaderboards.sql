@@ -0,0 +1,4 @@
+-- Migration: period leaderboards
+-- Таблицу leaderboard_snapshots создаёт create_all; здесь индекс для итогов периода по счётчикам
+
+CREATE INDEX ix_user_action_counters_action_period ON user_action_counters (action_type, period_start);
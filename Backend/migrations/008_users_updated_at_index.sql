@@ -0,0 +1,4 @@
+-- Migration: index for the leaderboard sync
+-- Leaderboard.sync выбирает игроков по updated_at каждые LEADERBOARD_SYNC_SECONDS
+
+CREATE INDEX ix_users_updated_at ON users (updated_at);
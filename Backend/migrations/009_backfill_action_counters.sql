@@ -0,0 +1,39 @@
+-- Migration: carry unfinished task progress from user_tasks into user_action_counters
+-- Раньше прогресс копился в user_tasks.progress (у каждого задания свой, у забранных не рос).
+-- Переносим его для текущего дня и недели, чтобы незабранные задания не начинались с нуля.
+-- Счётчики после переключения считают только новые действия, поэтому значения складываются.
+
+-- Сегодняшний прогресс дневных заданий - в счётчик сегодняшнего дня
+INSERT INTO user_action_counters (user_id, action_type, period_start, value)
+SELECT d.user_id, d.action_type, CURDATE(), d.progress
+FROM (
+    SELECT ut.user_id, t.action_type, MAX(ut.progress) AS progress
+    FROM user_tasks ut
+    JOIN tasks t ON t.id = ut.task_id
+    WHERE t.task_type = 'daily' AND ut.period_start = CURDATE() AND ut.is_claimed = 0 AND ut.progress > 0
+    GROUP BY ut.user_id, t.action_type
+) d
+ON DUPLICATE KEY UPDATE value = value + VALUES(value);
+
+-- Остаток недельного прогресса (без сегодняшнего) - во вчерашний день той же недели,
+-- чтобы сегодняшние дневные счётчики и лидерборд дня не выросли. В понедельник
+-- неделя состоит из одного сегодняшнего дня: его прогресс уже перенесён выше,
+-- а более раннего дня в неделе нет, поэтому остаток не переносится
+INSERT INTO user_action_counters (user_id, action_type, period_start, value)
+SELECT w.user_id, w.action_type, CURDATE() - INTERVAL 1 DAY, w.progress - COALESCE(d.progress, 0)
+FROM (
+    SELECT ut.user_id, t.action_type, ut.period_start, MAX(ut.progress) AS progress
+    FROM user_tasks ut
+    JOIN tasks t ON t.id = ut.task_id
+    WHERE t.task_type = 'weekly' AND ut.period_start = CURDATE() - INTERVAL WEEKDAY(CURDATE()) DAY AND ut.is_claimed = 0
+    GROUP BY ut.user_id, t.action_type, ut.period_start
+) w
+LEFT JOIN (
+    SELECT ut.user_id, t.action_type, MAX(ut.progress) AS progress
+    FROM user_tasks ut
+    JOIN tasks t ON t.id = ut.task_id
+    WHERE t.task_type = 'daily' AND ut.period_start = CURDATE() AND ut.is_claimed = 0
+    GROUP BY ut.user_id, t.action_type
+) d ON d.user_id = w.user_id AND d.action_type = w.action_type
+WHERE WEEKDAY(CURDATE()) > 0 AND w.progress > COALESCE(d.progress, 0)
+ON DUPLICATE KEY UPDATE value = value + VALUES(value);
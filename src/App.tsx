@@ -13,7 +13,7 @@ import * as api from './api/client'
 type Page = 'home' | 'upgrades' | 'shop' | 'exchange' | 'tasks'
 
 export default function App() {
-  const { user, upgrades, isLoading, error, initUser, handleClick, handlePassiveIncome, handleBuyUpgrade, getPassiveIncome, getMaxEnergy } = useUser()
+  const { user, upgrades, isLoading, error, initUser, handleClick, tickPassiveIncome, syncPassiveIncome, handleBuyUpgrade, getPassiveIncome, getMaxEnergy } = useUser()
   
   const [page, setPage] = useState<Page>('home')
   const [isTopOpen, setIsTopOpen] = useState<boolean>(false)
@@ -37,45 +37,34 @@ export default function App() {
     }
   }, [isTopOpen])
 
-  // Autoclick timers based on upgrades (passive income - doesn't consume energy)
+  // Passive income: local ticking every second, server sync every 15 seconds
+  // (the server computes income from upgrade levels and elapsed time)
+  // Depend on the id and stable callbacks only, so balance ticks do not restart the intervals
+  const userId = user?.id
+  const hasPassive = getPassiveIncome() > 0
   useEffect(() => {
-    if (!user) return
+    if (userId === undefined || !hasPassive) return
 
-    const timers: number[] = []
-    
-    const autoclickLevel = upgrades.find(u => u.key === 'autoclick')?.level ?? 0
-    const megaclickLevel = upgrades.find(u => u.key === 'megaclick')?.level ?? 0
-    const superclickLevel = upgrades.find(u => u.key === 'superclick')?.level ?? 0
-
-    for (let i = 0; i < autoclickLevel; i++) {
-      const id = window.setInterval(() => handlePassiveIncome(1), 2000)
-      timers.push(id)
-    }
-    for (let i = 0; i < megaclickLevel; i++) {
-      const id = window.setInterval(() => handlePassiveIncome(1), 1000)
-      timers.push(id)
-    }
-    for (let i = 0; i < superclickLevel; i++) {
-      const id = window.setInterval(() => handlePassiveIncome(1), 500)
-      timers.push(id)
-    }
+    const tickId = window.setInterval(() => tickPassiveIncome(1), 1000)
+    const syncId = window.setInterval(() => syncPassiveIncome(), 15000)
 
     return () => {
-      for (const id of timers) window.clearInterval(id)
+      window.clearInterval(tickId)
+      window.clearInterval(syncId)
     }
-  }, [user, upgrades, handlePassiveIncome])
+  }, [userId, hasPassive, tickPassiveIncome, syncPassiveIncome])
 
   // Periodic energy refresh from server (every 5 seconds)
   const { refreshUser: refreshUserFn } = useUser()
   useEffect(() => {
-    if (!user) return
+    if (userId === undefined) return
     
     const id = window.setInterval(() => {
       refreshUserFn()
     }, 5000)
 
     return () => window.clearInterval(id)
-  }, [user, refreshUserFn])
+  }, [userId, refreshUserFn])
 
   // Show loading screen
   if (isLoading) {
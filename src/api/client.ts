@@ -1,5 +1,10 @@
 const API_BASE = import.meta.env.VITE_API_URL || 'http://localhost:8000';
 
+// Аватары из хранилища API приходят ссылкой от корня (/avatars/<hash>.jpg)
+export function avatarSrc(url: string | null): string | null {
+  return url && url.startsWith('/') ? `${API_BASE}${url}` : url;
+}
+
 export interface User {
   id: number;
   telegram_id: number;
@@ -101,11 +106,10 @@ export async function clickAction(userId: number, clicks: number = 1): Promise<U
   return res.json();
 }
 
-export async function passiveIncome(userId: number, clicks: number = 1): Promise<User> {
+// Пассивный доход считается на сервере по времени с прошлой синхронизации
+export async function syncPassiveIncome(userId: number): Promise<User> {
   const res = await fetch(`${API_BASE}/users/${userId}/passive`, {
     method: 'POST',
-    headers: { 'Content-Type': 'application/json' },
-    body: JSON.stringify({ clicks }),
   });
   if (!res.ok) throw new Error('Passive income failed');
   return res.json();
@@ -209,8 +213,14 @@ export async function transferToUser(
   return res.json();
 }
 
-export async function getTransferHistory(userId: number, limit: number = 50): Promise<TransferHistory[]> {
-  const res = await fetch(`${API_BASE}/transfers/${userId}/history?limit=${limit}`);
+// before - последняя запись предыдущей страницы (курсор created_at + id)
+export async function getTransferHistory(userId: number, limit: number = 50, before?: TransferHistory): Promise<TransferHistory[]> {
+  const params = new URLSearchParams({ limit: String(limit) });
+  if (before) {
+    params.set('before_created_at', before.created_at);
+    params.set('before_id', String(before.id));
+  }
+  const res = await fetch(`${API_BASE}/transfers/${userId}/history?${params}`);
   if (!res.ok) throw new Error('Failed to get transfer history');
   return res.json();
 }
@@ -263,9 +273,10 @@ export interface ChatMessage {
   created_at: string;
 }
 
-export async function getChatMessages(limit: number = 50, beforeId?: number): Promise<ChatMessage[]> {
+export async function getChatMessages(limit: number = 50, beforeId?: number, afterId?: number): Promise<ChatMessage[]> {
   let url = `${API_BASE}/chat/messages?limit=${limit}`;
   if (beforeId) url += `&before_id=${beforeId}`;
+  if (afterId) url += `&after_id=${afterId}`;
   const res = await fetch(url);
   if (!res.ok) throw new Error('Failed to get chat messages');
   return res.json();
@@ -281,6 +292,22 @@ export async function sendChatMessage(userId: number, text: string): Promise<Cha
   return res.json();
 }
 
+// Поток новых сообщений (SSE). После обрыва EventSource переподключается сам
+// и продолжает с последнего полученного id (заголовок Last-Event-ID).
+// onReset приходит, если пропущено больше, чем сервер держит в памяти.
+export function subscribeChat(
+  lastId: number | undefined,
+  onMessage: (msg: ChatMessage) => void,
+  onReset: (msgs: ChatMessage[]) => void,
+): () => void {
+  let url = `${API_BASE}/chat/stream`;
+  if (lastId) url += `?last_id=${lastId}`;
+  const source = new EventSource(url);
+  source.onmessage = e => onMessage(JSON.parse(e.data));
+  source.addEventListener('reset', e => onReset(JSON.parse((e as MessageEvent).data)));
+  return () => source.close();
+}
+
 export async function getClickValue(): Promise<number> {
   const res = await fetch(`${API_BASE}/settings/click-value`);
   if (!res.ok) return 1;
@@ -3,6 +3,8 @@ import * as api from '../api/client'
 import { useUser } from '../context/UserContext'
 import './Chat.css'
 
+const MAX_MESSAGES = 100
+
 type Props = {
   onClose: () => void
 }
@@ -16,6 +18,8 @@ export default function Chat({ onClose }: Props) {
   const [toast, setToast] = useState<string | null>(null)
   const listRef = useRef<HTMLDivElement>(null)
   const pollRef = useRef<ReturnType<typeof setInterval> | null>(null)
+  const messagesRef = useRef<api.ChatMessage[]>([])
+  messagesRef.current = messages
 
   const scrollToBottom = useCallback(() => {
     if (listRef.current) {
@@ -44,18 +48,37 @@ export default function Chat({ onClose }: Props) {
     scrollToBottom()
   }, [messages, scrollToBottom])
 
-  // Poll for new messages every 3 seconds
+  const appendMessage = useCallback((msg: api.ChatMessage) => {
+    setMessages(prev => {
+      if (prev.some(m => m.id === msg.id)) return prev
+      const next = [...prev, msg].sort((a, b) => a.id - b.id)
+      return next.slice(-MAX_MESSAGES)
+    })
+  }, [])
+
+  // New messages are pushed by the server; polling only without EventSource
   useEffect(() => {
-    pollRef.current = setInterval(async () => {
-      try {
-        const msgs = await api.getChatMessages(50)
-        setMessages(msgs)
-      } catch { /* ignore */ }
-    }, 3000)
-    return () => {
-      if (pollRef.current) clearInterval(pollRef.current)
+    if (loading) return
+
+    if (typeof EventSource === 'undefined') {
+      pollRef.current = setInterval(async () => {
+        try {
+          const current = messagesRef.current
+          const lastId = current.length ? current[current.length - 1].id : undefined
+          const msgs = await api.getChatMessages(50, undefined, lastId)
+          msgs.forEach(appendMessage)
+        } catch { /* ignore */ }
+      }, 3000)
+      return () => {
+        if (pollRef.current) clearInterval(pollRef.current)
+      }
     }
-  }, [])
+
+    const lastId = messagesRef.current.length
+      ? messagesRef.current[messagesRef.current.length - 1].id
+      : undefined
+    return api.subscribeChat(lastId, appendMessage, setMessages)
+  }, [loading, appendMessage])
 
   const handleSend = async () => {
     if (!user || !input.trim() || sending) return
@@ -65,7 +88,7 @@ export default function Chat({ onClose }: Props) {
 
     try {
       const newMsg = await api.sendChatMessage(user.id, text)
-      setMessages(prev => [...prev, newMsg])
+      appendMessage(newMsg)
     } catch (e) {
       console.error('Send failed', e)
       setInput(text)
@@ -158,7 +181,7 @@ export default function Chat({ onClose }: Props) {
                       aria-label={msg.username ? `Открыть профиль @${msg.username}` : 'Открыть профиль'}
                     >
                       {msg.url_image ? (
-                        <img src={msg.url_image} alt="" className="chat-avatar-img" />
+                        <img src={api.avatarSrc(msg.url_image) ?? undefined} alt="" className="chat-avatar-img" />
                       ) : (
                         <div className="chat-avatar-placeholder">
                           {(msg.first_name || msg.username || '?')[0]}
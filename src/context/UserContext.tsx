@@ -1,4 +1,4 @@
-import { createContext, useContext, useState, useCallback, type ReactNode } from 'react';
+import { createContext, useContext, useState, useCallback, useRef, type ReactNode } from 'react';
 import * as api from '../api/client';
 
 // ─────────────────────────────────────────────────────────────
@@ -54,7 +54,8 @@ interface UserContextType {
 
   // Game actions
   handleClick: (clicks?: number) => Promise<void>;
-  handlePassiveIncome: (clicks?: number) => Promise<void>;
+  tickPassiveIncome: (seconds: number) => void;
+  syncPassiveIncome: () => Promise<void>;
   handleBuyUpgrade: (upgradeKey: string) => Promise<boolean>;
   handleClaimTask: (taskId: number) => Promise<boolean>;
   handleTransfer: (receiverUsername: string, amount: number) => Promise<boolean>;
@@ -79,6 +80,12 @@ export function UserProvider({ children }: { children: ReactNode }) {
   const [isLoading, setIsLoading] = useState(true);
   const [error, setError] = useState<string | null>(null);
   const [baseClickValue, setBaseClickValue] = useState<number>(1);
+  // Пассивный доход, начисленный локально после последней синхронизации (сервер его ещё не записал)
+  const unsyncedPassive = useRef(0);
+
+  // Колбэки зависят от id, а не от user: иначе ежесекундный тик пересоздаёт их и интервалы в App
+  const userId = user?.id;
+  const telegramId = user?.telegramId;
 
   // ─────────────────────────────────────────────────────────────
   // Init user from Telegram or local
@@ -157,12 +164,12 @@ export function UserProvider({ children }: { children: ReactNode }) {
   // Refresh functions
   // ─────────────────────────────────────────────────────────────
   const refreshUser = useCallback(async () => {
-    if (!user) return;
+    if (telegramId === undefined) return;
     try {
-      const apiUser = await api.getUserByTelegramId(user.telegramId);
+      const apiUser = await api.getUserByTelegramId(telegramId);
       setUser(prev => prev ? { 
         ...prev, 
-        balance: apiUser.balance,
+        balance: Math.round((apiUser.balance + unsyncedPassive.current) * 100) / 100,
         energy: apiUser.energy,
         maxEnergy: apiUser.max_energy,
         lastEnergyUpdate: apiUser.last_energy_update,
@@ -170,7 +177,7 @@ export function UserProvider({ children }: { children: ReactNode }) {
     } catch (e) {
       console.error('Failed to refresh user', e);
     }
-  }, [user]);
+  }, [telegramId]);
 
   const refreshUpgrades = useCallback(async () => {
     if (!user) return;
@@ -234,7 +241,7 @@ export function UserProvider({ children }: { children: ReactNode }) {
       const updated = await api.clickAction(user.id, clicks);
       setUser(prev => prev ? { 
         ...prev, 
-        balance: updated.balance,
+        balance: Math.round((updated.balance + unsyncedPassive.current) * 100) / 100,
         energy: updated.energy,
         maxEnergy: updated.max_energy,
         lastEnergyUpdate: updated.last_energy_update,
@@ -248,18 +255,13 @@ export function UserProvider({ children }: { children: ReactNode }) {
     }
   }, [user, refreshUser, refreshTasks]);
 
-  const handlePassiveIncome = useCallback(async (clicks: number = 1) => {
-    if (!user) return;
-
-    // Optimistic update (пассивный доход не тратит энергию, округляем до 2 знаков)
-    const clickPower = getClickPower();
-    setUser(prev => prev ? { 
-      ...prev, 
-      balance: Math.round((prev.balance + clicks * clickPower) * 100) / 100,
-    } : null);
+  // Сервер сам считает доход по уровням улучшений и прошедшему времени
+  const syncPassiveIncome = useCallback(async () => {
+    if (userId === undefined) return;
 
     try {
-      const updated = await api.passiveIncome(user.id, clicks);
+      const updated = await api.syncPassiveIncome(userId);
+      unsyncedPassive.current = 0;
       setUser(prev => prev ? { 
         ...prev, 
         balance: updated.balance,
@@ -268,16 +270,17 @@ export function UserProvider({ children }: { children: ReactNode }) {
         lastEnergyUpdate: updated.last_energy_update,
       } : null);
     } catch (e) {
-      console.error('Passive income failed', e);
-      await refreshUser();
+      console.error('Passive income sync failed', e);
     }
-  }, [user, refreshUser]);
+  }, [userId]);
 
   const handleBuyUpgrade = useCallback(async (upgradeKey: string): Promise<boolean> => {
     if (!user) return false;
 
     try {
       await api.buyUpgrade(user.id, upgradeKey);
+      // Покупка сначала начисляет накопленный пассивный доход на сервере
+      unsyncedPassive.current = 0;
       await Promise.all([refreshUser(), refreshUpgrades(), refreshTasks()]);
       return true;
     } catch (e) {
@@ -355,6 +358,17 @@ export function UserProvider({ children }: { children: ReactNode }) {
     return autoclick + megaclick + superclick;
   }, [getUpgradeLevel, getUpgradeValue]);
 
+  // Локальное начисление пассивного дохода между синхронизациями (без запросов)
+  const tickPassiveIncome = useCallback((seconds: number) => {
+    const income = getPassiveIncome() * getClickPower() * seconds;
+    if (income <= 0) return;
+    unsyncedPassive.current += income;
+    setUser(prev => prev ? {
+      ...prev,
+      balance: Math.round((prev.balance + income) * 100) / 100,
+    } : null);
+  }, [getPassiveIncome, getClickPower]);
+
   const getMaxEnergy = useCallback((): number => {
     // Use max_energy from user if available, otherwise calculate from upgrades
     if (user?.maxEnergy) {
@@ -377,7 +391,8 @@ export function UserProvider({ children }: { children: ReactNode }) {
     refreshUpgrades,
     refreshTasks,
     handleClick,
-    handlePassiveIncome,
+    tickPassiveIncome,
+    syncPassiveIncome,
     handleBuyUpgrade,
     handleClaimTask,
     handleTransfer,